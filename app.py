@@ -1,13 +1,26 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session
+import time
+_startup_begin = time.perf_counter()  # 用于统计应用启动耗时
+
+from flask import Flask, render_template, request, jsonify, redirect, url_for, session, Response, stream_with_context, \
+    abort, make_response
+from sqlalchemy.exc import IntegrityError
 from flask_migrate import Migrate
 from werkzeug.utils import secure_filename
 
+from services.admission import AdmissionController, QueueFull
+from services.blob_store import BlobStore
+from services.metrics import metrics
 from services.ollama_service import OllamaService
-from services.file_service import process_file
 from models.user import db, User
 from models.message import Message, ConversationThread
+from models.document import DocumentJob
+from models.database import configure_sqlite, database_uri, engine_options
 from services.auth_service import AuthService
+import gzip
+import hashlib
+import json
 import os
+from datetime import datetime, timedelta
 
 
 app = Flask(__name__, static_folder='static')
@@ -18,22 +31,176 @@ app.config.update(
     SESSION_COOKIE_HTTPONLY=True,
     SESSION_COOKIE_SAMESITE='Lax'
 )
-ollama = OllamaService()
+# 生成请求的准入控制：限制全局和单用户的并发生成数，超出的请求按用户轮转排队
+admission = AdmissionController(
+    max_active=int(os.environ.get('CHAT_MAX_ACTIVE', '8')),
+    max_per_user=int(os.environ.get('CHAT_MAX_PER_USER', '2')),
+    max_queue=int(os.environ.get('CHAT_MAX_QUEUE', '32'))
+)
+
+ollama = OllamaService(
+    max_active=admission.max_active,  # 预处理线程池按同时生成的请求数确定大小
+    base_url=os.environ.get('OLLAMA_BACKENDS', 'http://localhost:11434'),  # 逗号分隔的多个实例，可写 地址=并发上限
+    backend_concurrency=int(os.environ.get('OLLAMA_BACKEND_CONCURRENCY', '4')),  # 单个实例默认的并发上限
+    models=[m.strip() for m in os.environ.get('OLLAMA_MODELS', '').split(',') if m.strip()] or None,  # 可选模型，第一个为默认
+    search_url=os.environ.get('SEARXNG_URL', 'http://localhost:8080'),
+    memory_budget_mb=int(os.environ.get('MEMORY_BUDGET_MB', '256')),  # 会话向量记忆的内存预算
+    vector_store_dir=os.environ.get('VECTOR_STORE_DIR', 'vector_store'),  # 向量持久化目录
+    document_cache_dir=os.environ.get('DOCUMENT_CACHE_DIR', 'document_cache'),  # 文档分块和向量缓存目录
+    vector_index={
+        "kind": os.environ.get('VECTOR_INDEX', 'auto'),  # auto / flat / hnsw / ivfpq
+        "hnsw_threshold": int(os.environ.get('VECTOR_HNSW_THRESHOLD', '20000')),  # auto 模式下超过该条数改用HNSW
+        "ivfpq_threshold": int(os.environ.get('VECTOR_IVFPQ_THRESHOLD', '200000'))  # 超过该条数改用IVF-PQ
+    },
+    tokenizer_name=os.environ.get('PROMPT_TOKENIZER') or None,  # 统计提示词token数的分词器，未设置时按字符估算
+    prompt_budget=int(os.environ.get('PROMPT_TOKEN_BUDGET', '0')) or None,  # 提示词token预算，默认为上下文窗口减去回答预留
+    response_cache={
+        "mode": os.environ.get('RESPONSE_CACHE', 'off'),  # off / exact / semantic
+        "scope": os.environ.get('RESPONSE_CACHE_SCOPE', 'user'),  # user：仅同一用户复用；global：所有用户共享
+        "ttl": float(os.environ.get('RESPONSE_CACHE_TTL', '3600')),
+        "similarity": float(os.environ.get('RESPONSE_CACHE_SIMILARITY', '0.95'))  # 语义匹配的余弦相似度阈值
+    },
+    summary={
+        "every": int(os.environ.get('SUMMARY_EVERY', '10')),  # 较早的消息每积累多少条合并进会话摘要，0为关闭
+        "model": os.environ.get('SUMMARY_MODEL') or None,  # 生成摘要和标题的模型，默认使用默认模型
+        "auto_title": os.environ.get('AUTO_TITLE', '1') == '1'  # 第一轮问答后自动生成会话标题
+    }
+)
+
+GZIP_MIN_BYTES = 1024  # 小于该大小的响应不压缩
+
+CHAT_QUEUE_TIMEOUT = int(os.environ.get('CHAT_QUEUE_TIMEOUT', '120'))  # 排队等待的最长时间（秒）
+QUEUE_HEARTBEAT = 1.0  # 流式接口排队期间推送排队位置的间隔（秒）
+# 未带 request_id 的请求：该时间内同一会话中内容相同的用户消息视为重复提交（秒），0为不检查
+DUPLICATE_MESSAGE_WINDOW = float(os.environ.get('DUPLICATE_MESSAGE_WINDOW', '5'))
 
 # 确保上传目录存在
 UPLOAD_FOLDER = 'uploads'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# 上传文件按内容哈希存储，同名文件不再互相覆盖，相同内容只保存一份
+uploads = BlobStore(UPLOAD_FOLDER)
 
 
 # 数据库配置
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(os.path.abspath(os.path.dirname(__file__)),
-                                                                    'site.db')
+# 设置 DATABASE_URL 时改用对应数据库（如 PostgreSQL，需安装 psycopg2-binary），迁移脚本相同
+app.config['SQLALCHEMY_DATABASE_URI'] = database_uri(
+    os.path.join(os.path.abspath(os.path.dirname(__file__)), 'site.db'),
+    os.environ.get('DATABASE_URL')
+)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(
+    app.config['SQLALCHEMY_DATABASE_URI'],
+    pool_size=int(os.environ.get('DB_POOL_SIZE', '10')),
+    max_overflow=int(os.environ.get('DB_MAX_OVERFLOW', '20'))
+)
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db.init_app(app)
+with app.app_context():
+    # SQLite 启用 WAL 等连接参数
+    configure_sqlite(db.engine)
 
 # 初始化数据库迁移
 migrate = Migrate(app, db)
 
+# 运行指标：/metrics 输出Prometheus格式；METRICS_ENABLED=0 时不再计时
+metrics.enabled = os.environ.get('METRICS_ENABLED', '1') == '1'
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')  # 设置后抓取 /metrics 需带 Authorization: Bearer <token>
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '0') == '1'  # 在响应头中附带本次请求各阶段耗时
+metrics.watch_commits(db.session)
+
+
+def _collect_metrics():
+    """抓取时读取的队列长度、缓存命中率和后端状态"""
+    admission_stats = admission.stats()
+    yield 'llmwebui_chat_active', 'gauge', '正在生成的请求数', {}, admission_stats["active"]
+    yield 'llmwebui_chat_queued', 'gauge', '排队等待生成的请求数', {}, admission_stats["queued"]
+    for result in ("admitted", "rejected", "cancelled"):
+        yield 'llmwebui_chat_admission_total', 'counter', '准入控制处理的请求数', {"result": result}, \
+            admission_stats[result]
+    yield 'llmwebui_document_jobs_pending', 'gauge', '排队或处理中的文档任务数', {}, ollama.documents.pending
+
+    embedder_stats = ollama.embedder.stats()
+    yield 'llmwebui_embedding_queued', 'gauge', '等待向量化的文本数', {}, embedder_stats["queued"]
+    caches = {
+        "embedding": embedder_stats,
+        "search": ollama.searxng.cache.stats(),
+        "response": ollama.response_cache.stats(),
+        "user": AuthService.user_cache.stats()
+    }
+    for name, stats in caches.items():
+        yield 'llmwebui_cache_hit_ratio', 'gauge', '缓存命中率', {"cache": name}, \
+            stats.get("hit_rate", stats.get("cache_hit_rate", 0.0))
+    yield 'llmwebui_memory_bytes', 'gauge', '会话向量记忆占用的内存', {}, ollama.memory.total_bytes()
+
+    for backend in ollama.pool.stats():
+        labels = {"backend": backend["url"]}
+        yield 'llmwebui_ollama_up', 'gauge', 'Ollama实例是否可用（未熔断）', labels, int(backend["available"])
+        yield 'llmwebui_ollama_outstanding', 'gauge', 'Ollama实例上未完成的请求数', labels, backend["outstanding"]
+        yield 'llmwebui_ollama_requests_total', 'counter', '分配给Ollama实例的请求数', labels, backend["requests"]
+        yield 'llmwebui_ollama_failures_total', 'counter', 'Ollama实例的失败次数', labels, backend["failures"]
+
+
+metrics.register(_collect_metrics)
+
+# 向量模型延迟加载：首个请求（或就绪探针）触发后台预热，迁移等命令行操作不会加载模型
+EMBEDDER_WARMUP = os.environ.get('EMBEDDER_WARMUP', '1') == '1'
+STARTUP_BUDGET_MS = int(os.environ.get('STARTUP_BUDGET_MS', '1500'))
+
+
+# 文档处理任务在应用上下文中执行
+ollama.init_app(app)
+
+
+@app.before_request
+def warm_up_embedder():
+    if EMBEDDER_WARMUP and not ollama.embedder.ready:
+        ollama.embedder.warm_up_async()
+    # 恢复上次进程退出时未完成的文档任务（仅执行一次）
+    ollama.documents.recover()
+    # 在后台获取各Ollama实例提供的模型，用于按模型分配请求（仅执行一次）
+    ollama.pool.discover_async()
+
+
+@app.after_request
+def add_server_timing(response):
+    if SERVER_TIMING and metrics.enabled:
+        timing = metrics.server_timing()
+        if timing:
+            response.headers['Server-Timing'] = timing
+    return response
+
+
+@app.route('/health', endpoint='health')
+def health():
+    """存活探针：进程能处理请求即返回200"""
+    return jsonify({"status": "ok"})
+
+
+@app.route('/health/ready', endpoint='health_ready')
+def health_ready():
+    """就绪探针：向量模型加载完成后才返回200，滚动重启时据此切换流量"""
+    ready = ollama.embedder.ready
+    status = {
+        "ready": ready,
+        "startup_ms": round(STARTUP_MS, 1),
+        "model_load_seconds": ollama.embedder.load_seconds
+    }
+    return jsonify(status), 200 if ready else 503
+
+
+@app.route('/metrics', endpoint='metrics')
+def export_metrics():
+    """Prometheus抓取接口"""
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        abort(401)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.route('/models', endpoint='list_models')
+@AuthService.login_required
+def list_models():
+    """可选的模型及各Ollama实例的状态"""
+    return jsonify({"models": ollama.models, "default": ollama.model, "backends": ollama.pool.stats()})
+
 
 @app.route('/', endpoint='index')
 @AuthService.login_required
@@ -73,85 +240,219 @@ def logout():
     return AuthService.handle_logout()
 
 
+def _encode_cursor(conversation):
+    return f"{conversation.last_activity.isoformat()}_{conversation.id}"
+
+
+def _decode_cursor(cursor):
+    last_activity, conversation_id = cursor.rsplit('_', 1)
+    return datetime.fromisoformat(last_activity), int(conversation_id)
+
+
 @app.route('/conversations', methods=['GET'], endpoint='get_conversations')
 @AuthService.login_required
 def get_conversations():
+    """按最后活跃时间倒序分页返回会话列表（键集分页，cursor 为上一页返回的 next_cursor）"""
     user = AuthService.get_current_user()
+    limit = min(request.args.get('limit', 50, type=int), 200)
+    cursor = request.args.get('cursor')
 
+    query = ConversationThread.query.filter(
+        ConversationThread.user_id == user.id,
+        ConversationThread.message_count > 0
+    )
+    if cursor:
+        try:
+            last_activity, conversation_id = _decode_cursor(cursor)
+        except ValueError:
+            return jsonify({"error": "无效的分页游标"}), 400
+        query = query.filter(db.or_(
+            ConversationThread.last_activity < last_activity,
+            db.and_(ConversationThread.last_activity == last_activity, ConversationThread.id < conversation_id)
+        ))
+
+    conversations = query.order_by(
+        ConversationThread.last_activity.desc(),
+        ConversationThread.id.desc()
+    ).limit(limit + 1).all()
+
+    has_more = len(conversations) > limit
+    conversations = conversations[:limit]
+    return jsonify({
+        "conversations": [conv.to_dict() for conv in conversations],
+        "next_cursor": _encode_cursor(conversations[-1]) if has_more else None
+    })
 
-    conversations = db.session.query(
-        ConversationThread.id,
-        ConversationThread.title,
-        ConversationThread.created_at,
-        db.func.max(Message.timestamp).label('last_activity'),
-        db.func.count(Message.id).label('message_count')
-    ).join(
-        Message, Message.conversation_id == ConversationThread.id
-    ).filter_by(user_id=user.id).group_by(Message.conversation_id).all()
 
-    return jsonify([{
-        'id': conv.id,
-        'title': conv.title,
-        'created_at': conv.created_at.isoformat(),
-        'last_activity': conv.last_activity.isoformat(),
-        'message_count': conv.message_count
-    } for conv in conversations])
+def _gzip_response(response):
+    """客户端支持时压缩较大的响应体"""
+    if (response.status_code != 200 or response.direct_passthrough
+            or 'gzip' not in request.headers.get('Accept-Encoding', '').lower()):
+        return response
+    data = response.get_data()
+    if len(data) < GZIP_MIN_BYTES:
+        return response
+    response.set_data(gzip.compress(data, compresslevel=5))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
 
 
-@app.route('/conversations/<conversation_id>', methods=['GET'], endpoint='get_conversation')
+@app.route('/conversations/<int:conversation_id>', methods=['GET'], endpoint='get_conversation')
 @AuthService.login_required
 def get_conversation(conversation_id):
-    user = AuthService.get_current_user()
-    messages = Message.query.filter_by(
-        user_id=user.id,
-        conversation_id=conversation_id
-    ).order_by(Message.timestamp.asc()).all()
-
-    return jsonify([msg.to_dict() for msg in messages])
+    """分页返回会话消息
 
-
-@app.route('/chat', methods=['POST'], endpoint='chat')
-@AuthService.login_required
-def chat():
+    - 默认返回最新的 limit 条
+    - before=<消息id>：更早的消息（向上翻页）
+    - after=<消息id> 或 since=<ISO时间>：更新的消息（增量刷新）
+    消息按时间正序返回；会话未变化时根据 ETag 返回304。
+    """
     user = AuthService.get_current_user()
+    thread = ConversationThread.query.filter_by(id=conversation_id, user_id=user.id).first()
+    if not thread:
+        return jsonify({"error": "对话不存在"}), 404
+
+    # 会话内容只会因新消息而变化，用冗余的消息数和最后活跃时间生成ETag，无需查询消息表
+    etag = hashlib.md5(
+        f"{thread.id}:{thread.message_count}:{thread.last_activity}:{sorted(request.args.items())}".encode()
+    ).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
 
+    limit = min(request.args.get('limit', 50, type=int), 200)
+    before = request.args.get('before', type=int)
+    after = request.args.get('after', type=int)
+    since = request.args.get('since')
+
+    query = Message.query.filter_by(user_id=user.id, conversation_id=conversation_id)
+    newer = after is not None or since is not None
+    if newer:
+        if after is not None:
+            anchor = Message.query.with_entities(Message.timestamp).filter_by(
+                id=after, conversation_id=conversation_id).first()
+            if not anchor:
+                return jsonify({"error": "无效的消息游标"}), 400
+            query = query.filter(db.or_(
+                Message.timestamp > anchor.timestamp,
+                db.and_(Message.timestamp == anchor.timestamp, Message.id > after)
+            ))
+        else:
+            try:
+                query = query.filter(Message.timestamp > datetime.fromisoformat(since))
+            except ValueError:
+                return jsonify({"error": "无效的时间参数"}), 400
+        messages = query.order_by(Message.timestamp.asc(), Message.id.asc()).limit(limit + 1).all()
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+    else:
+        if before is not None:
+            anchor = Message.query.with_entities(Message.timestamp).filter_by(
+                id=before, conversation_id=conversation_id).first()
+            if not anchor:
+                return jsonify({"error": "无效的消息游标"}), 400
+            query = query.filter(db.or_(
+                Message.timestamp < anchor.timestamp,
+                db.and_(Message.timestamp == anchor.timestamp, Message.id < before)
+            ))
+        messages = query.order_by(Message.timestamp.desc(), Message.id.desc()).limit(limit + 1).all()
+        has_more = len(messages) > limit
+        messages = list(reversed(messages[:limit]))
+
+    response = jsonify({
+        "messages": [msg.to_dict() for msg in messages],
+        "has_more": has_more
+    })
+    response.set_etag(etag)
+    # 浏览器每次都带上 If-None-Match 重新验证
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return _gzip_response(response)
+
+
+def _save_upload(file):
+    """边读边计算哈希保存上传文件，返回 (文件名, 存储路径, 内容哈希)"""
+    # 扩展名取自原始文件名（secure_filename 会去掉中文文件名的主体部分）
+    suffix = os.path.splitext(file.filename)[1].lower()
+    if not suffix[1:].isalnum():
+        suffix = ''
+    filename = secure_filename(file.filename)
+    if not filename.lower().endswith(suffix) or filename.lower() == suffix.lstrip('.'):
+        filename = 'upload' + suffix
+    digest, blob_path, created = uploads.save(file.stream, suffix)
+    print(f"[DEBUG] 上传文件 {file.filename} -> {blob_path}" + ("" if created else "（内容已存在，复用）"))
+    return filename, blob_path, digest
+
+
+def _requested_model():
+    """请求中指定的模型，未指定时返回None（使用默认模型）"""
+    model = request.form.get('model') or None
+    if model and model not in ollama.models:
+        abort(make_response(jsonify({"error": f"不支持的模型：{model}", "models": ollama.models}), 400))
+    return model
+
+
+def _admit(user_id):
+    """登记生成请求，排队已满时直接返回429和预计的排队位置"""
+    try:
+        return admission.enter(user_id)
+    except QueueFull as e:
+        response = make_response(jsonify({
+            "error": str(e),
+            "queue_position": e.position,
+            "retry_after": e.retry_after
+        }), 429)
+        response.headers['Retry-After'] = str(e.retry_after)
+        abort(response)
+
+
+def _prepare_chat_turn(user):
+    """解析聊天请求：获取或创建会话、处理上传文件并保存用户消息
+
+    新建会话、用户消息和文档任务在同一个事务中提交；AI消息在生成结束后单独提交，
+    生成期间不持有写事务，避免阻塞其他请求的写入。
+    """
     # 获取或创建会话ID
     if not request.form.get('conversation_id'):
         conversation_thread = ConversationThread(
-            title = "新对话",
+            title = ConversationThread.DEFAULT_TITLE,
             user_id = user.id,
         )
 
-        # 新建对话线程并提交到数据库
+        # 新建对话线程，flush 获得id，与用户消息一起提交
         db.session.add(conversation_thread)
-        db.session.commit()
+        db.session.flush()
         conversation_id = conversation_thread.id
     else:
-        # 使用现有会话id
-        conversation_id = int(request.form.get('conversation_id'))
+        # 使用现有会话id，只能向自己的会话发送消息
+        conversation_id = request.form.get('conversation_id', type=int)
+        if not conversation_id or not ConversationThread.query.with_entities(ConversationThread.id).filter_by(
+                id=conversation_id, user_id=user.id).first():
+            db.session.rollback()
+            abort(make_response(jsonify({"error": "对话不存在"}), 404))
 
     # 获取消息内容
     message_content = request.form.get('message', '')
 
-    # 解析文件路径
+    # 保存上传文件，消息中只记录文件名，文件本身按内容哈希存储
     file_path = None
+    upload = None
     if 'file' in request.files:
         file = request.files['file']
         if file.filename != '':
-            filename = secure_filename(file.filename)
-            file_path = os.path.join(UPLOAD_FOLDER, filename)
-            file.save(file_path)
-            print(f"上传的文件名:{file.filename}")
+            upload = _save_upload(file)
+            file_path = upload[0]
 
-    # 处理上传的文件
-    file_text = None
-    if 'file' in request.files:
-        file = request.files['file']
-        file_text = process_file(file)  # 提取文件内容
+    # 文件内容由生成阶段分块索引到会话记忆中，不再直接作为消息内容
+    if file_path and not message_content.strip():
+        message_content = f"请阅读上传的文件：{file_path}"
 
-    # 如果文件有内容，使用文件内容作为输入消息
-    if file_text:
-        message_content = file_text  # 更新消息内容为文件内容
+    # 客户端为每次提交生成的请求ID，重复提交（如网络重试、重复点击）直接拒绝
+    request_id = request.form.get('request_id') or None
+    if request_id and Message.query.filter_by(conversation_id=conversation_id, request_id=request_id).first():
+        db.session.rollback()
+        abort(make_response(jsonify({"error": "重复的请求", "conversation_id": conversation_id}), 409))
 
     # 保存用户消息
     user_message = Message(
@@ -159,43 +460,235 @@ def chat():
         is_user=True,
         user_id=user.id,
         conversation_id=conversation_id,
-        file_path=file_path
+        file_path=file_path,
+        content_hash=Message.hash_content(message_content),
+        request_id=request_id
     )
 
-    # 确保没有重复对象
-    existing_message = Message.query.filter_by(content=message_content, conversation_id=conversation_id).first()
+    # 没有请求ID的旧客户端：短时间内内容相同的用户消息视为重复点击，复用已保存的消息；
+    # 之后再发送相同的内容（如“继续”）是新的一轮。按内容哈希走索引查询，不比较大段文本
+    existing_message = None
+    if not request_id and DUPLICATE_MESSAGE_WINDOW > 0:
+        existing_message = Message.query.filter(
+            Message.conversation_id == conversation_id,
+            Message.content_hash == user_message.content_hash,
+            Message.is_user.is_(True),
+            Message.timestamp >= datetime.utcnow() - timedelta(seconds=DUPLICATE_MESSAGE_WINDOW)
+        ).first()
     if not existing_message:
         db.session.add(user_message)
+    else:
+        user_message = existing_message
+
+    # 上传的文件交给后台任务解析和索引，请求本身不等待
+    document_job = None
+    if upload:
+        filename, blob_path, digest = upload
+        document_job = ollama.documents.create(
+            user_id=user.id,
+            conversation_id=conversation_id,
+            file_path=os.path.abspath(blob_path),
+            filename=filename,
+            content_hash=digest
+        )
+
+    try:
         db.session.commit()
+    except IntegrityError:
+        # 并发的重复提交被唯一索引拦截
+        db.session.rollback()
+        abort(make_response(jsonify({"error": "重复的请求", "conversation_id": conversation_id}), 409))
+    if document_job:
+        ollama.documents.start(document_job.id)
+
+    return conversation_id, message_content, file_path, user_message, document_job
 
-    # 获取模型响应
-    model_response = ollama.generate_response(
-        prompt=message_content,
-        user_id=user.id,
-        conversation_id=conversation_id,
-        file_path=file_path
-    )
 
-    # Ensure the model response is an instance of Message and add to session
+def _start_chat_turn():
+    """聊天请求的准备工作（同步接口与 asgi.py 共用）：登记排队并保存用户消息，失败时归还名额
+
+    返回 (user, model, ticket, _prepare_chat_turn 的结果)
+    """
+    user = AuthService.get_current_user()
+    model = _requested_model()
+    ticket = _admit(user.id)
+    try:
+        return user, model, ticket, _prepare_chat_turn(user)
+    except Exception:
+        ticket.release()
+        raise
+
+
+def _save_ai_message(user_id, conversation_id, content, file_path):
+    """生成结束后单独提交AI消息"""
     ai_message = Message(
-        content=model_response,
+        content=content,
         is_user=False,  # This is from the model
-        user_id=user.id,
+        user_id=user_id,
         conversation_id=conversation_id,
         file_path=str(file_path) if file_path else None
     )
-
     db.session.add(ai_message)
     db.session.commit()
+    # 需要时在后台更新会话摘要和标题
+    ollama.summaries.schedule(conversation_id)
+    return ai_message
+
+
+@app.route('/chat', methods=['POST'], endpoint='chat')
+@AuthService.login_required
+def chat():
+    user, model, ticket, turn = _start_chat_turn()
+    conversation_id, message_content, file_path, user_message, document_job = turn
+    try:
+        # 排队等到生成名额后获取模型响应
+        if ticket.wait(CHAT_QUEUE_TIMEOUT):
+            model_response = ollama.generate_response(
+                prompt=message_content,
+                user_id=user.id,
+                conversation_id=conversation_id,
+                document_job_id=document_job.id if document_job else None,
+                model=model
+            )
+        else:
+            model_response = "错误：排队等待超时，请稍后重试"
+    finally:
+        ticket.release()
+
+    ai_message = _save_ai_message(user.id, conversation_id, model_response, file_path)
 
     # 返回响应时包含conversation_id
     return jsonify({
         "success": True,
         "conversation_id": conversation_id,
         "user_message": user_message.to_dict(),
-        "model_response": ai_message.to_dict()
+        "model_response": ai_message.to_dict(),
+        "document": document_job.to_dict() if document_job else None
     })
 
+
+@app.route('/chat/stream', methods=['POST'], endpoint='chat_stream')
+@AuthService.login_required
+def chat_stream():
+    """流式聊天接口：以NDJSON逐行推送模型输出，生成结束后保存AI消息"""
+    user, model, ticket, turn = _start_chat_turn()
+    user_id = user.id
+    conversation_id, message_content, file_path, user_message, document_job = turn
+    user_message_dict = user_message.to_dict() if user_message.id else None
+    document_job_id = document_job.id if document_job else None
+    document_dict = document_job.to_dict() if document_job else None
+
+    def generate():
+        yield json.dumps({
+            "type": "meta",
+            "conversation_id": conversation_id,
+            "user_message": user_message_dict,
+            "document": document_dict
+        }, ensure_ascii=False) + "\n"
+
+        # 排队期间定时推送当前位置
+        while not ticket.granted.is_set() and time.monotonic() - ticket.enqueued_at < CHAT_QUEUE_TIMEOUT:
+            yield json.dumps({"type": "queued", "position": ticket.position()}) + "\n"
+            ticket.wait(QUEUE_HEARTBEAT)
+
+        if ticket.granted.is_set():
+            tokens = ollama.stream_response(
+                prompt=message_content,
+                user_id=user_id,
+                conversation_id=conversation_id,
+                document_job_id=document_job_id,
+                model=model
+            )
+        else:
+            tokens = iter(["错误：排队等待超时，请稍后重试"])
+
+        parts = []
+        for token in tokens:
+            parts.append(token)
+            yield json.dumps({"type": "token", "content": token}, ensure_ascii=False) + "\n"
+        # 生成结束后立即归还名额，不等保存消息
+        ticket.release()
+
+        # 流结束后一次性保存完整的AI消息
+        ai_message = _save_ai_message(user_id, conversation_id, "".join(parts), file_path)
+
+        yield json.dumps({
+            "type": "done",
+            "conversation_id": conversation_id,
+            "model_response": ai_message.to_dict()
+        }, ensure_ascii=False) + "\n"
+
+    response = Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        # 禁止反向代理缓冲，保证token能及时到达浏览器
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    # 客户端断开时响应被关闭：仍在排队的请求移出队列，正在生成的请求随生成器关闭停止读取Ollama输出并归还名额
+    response.call_on_close(ticket.release)
+    return response
+
+@app.route('/documents', methods=['POST'], endpoint='upload_document')
+@AuthService.login_required
+def upload_document():
+    """上传文档到已有会话，立即返回任务信息，解析和索引在后台进行"""
+    user = AuthService.get_current_user()
+    conversation_id = request.form.get('conversation_id', type=int)
+    if not conversation_id or not ConversationThread.query.filter_by(id=conversation_id, user_id=user.id).first():
+        return jsonify({"error": "对话不存在"}), 404
+
+    file = request.files.get('file')
+    if not file or file.filename == '':
+        return jsonify({"error": "未选择文件"}), 400
+
+    filename, blob_path, digest = _save_upload(file)
+    job = ollama.documents.submit(
+        user_id=user.id,
+        conversation_id=conversation_id,
+        file_path=os.path.abspath(blob_path),
+        filename=filename,
+        content_hash=digest
+    )
+    return jsonify(job.to_dict()), 202
+
+
+@app.route('/documents/<int:job_id>', methods=['GET'], endpoint='get_document')
+@AuthService.login_required
+def get_document(job_id):
+    """查询文档处理进度"""
+    user = AuthService.get_current_user()
+    job = ollama.documents.get(job_id, user.id)
+    if not job:
+        return jsonify({"error": "任务不存在"}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route('/documents/<int:job_id>', methods=['DELETE'], endpoint='delete_document')
+@AuthService.login_required
+def delete_document(job_id):
+    """删除文档，其分块不再参与会话检索"""
+    user = AuthService.get_current_user()
+    job = ollama.documents.get(job_id, user.id)
+    if not job:
+        return jsonify({"error": "任务不存在"}), 404
+    if not job.finished:
+        return jsonify({"error": "文档仍在处理中，请稍后再删除"}), 409
+    removed = ollama.documents.delete(job)
+    return jsonify({"success": True, "removed_chunks": removed})
+
+
+@app.route('/conversations/<int:conversation_id>/documents', methods=['GET'], endpoint='get_conversation_documents')
+@AuthService.login_required
+def get_conversation_documents(conversation_id):
+    """列出会话中上传的文档及其处理状态"""
+    user = AuthService.get_current_user()
+    jobs = DocumentJob.query.filter_by(
+        user_id=user.id,
+        conversation_id=conversation_id
+    ).order_by(DocumentJob.created_at.asc()).all()
+    return jsonify([job.to_dict() for job in jobs])
+
+
 # 删除对话
 @app.route('/delete_conversation/<int:conversation_id>', methods=['DELETE'])
 @AuthService.login_required
@@ -210,11 +703,23 @@ def delete_conversation(conversation_id):
 
     # 删除与对话相关的消息
     Message.query.filter_by(conversation_id=conversation_id).delete()
+    DocumentJob.query.filter_by(conversation_id=conversation_id).delete()
     db.session.delete(conversation)
     db.session.commit()
+    ollama.memory.drop(user.id, conversation_id)
 
     return jsonify({"success": True})
 
 
+# 启动耗时统计：重依赖均已延迟加载，超出预算说明有新的重量级导入
+STARTUP_MS = (time.perf_counter() - _startup_begin) * 1000
+if STARTUP_MS > STARTUP_BUDGET_MS:
+    print(f"[STARTUP] 警告：应用初始化耗时 {STARTUP_MS:.0f}ms，超出预算 {STARTUP_BUDGET_MS}ms")
+else:
+    print(f"[STARTUP] 应用初始化耗时 {STARTUP_MS:.0f}ms")
+
+
 if __name__ == '__main__':
+    if EMBEDDER_WARMUP:
+        ollama.embedder.warm_up_async()
     app.run()
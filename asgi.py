@@ -0,0 +1,288 @@
+"""ASGI入口：生成请求在事件循环中等待，不再每个请求占用一个线程
+
+    pip install uvicorn httpx asgiref
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+
+- POST /chat 和 /chat/stream 由协程处理：排队、SearXNG搜索和Ollama生成都以非阻塞方式等待，
+  大量生成请求同时挂起时只占用少量线程；数据库读写和向量化在线程池中执行
+- 其余路由原样交给Flask应用（经 asgiref 的 WsgiToAsgi 在线程中执行）
+- 会话登录、before_request / after_request 钩子和错误处理与同步模式一致，请求格式和响应格式不变
+"""
+import asyncio
+import json
+import sys
+import tempfile
+import time
+
+from asgiref.wsgi import WsgiToAsgi
+from flask import redirect, url_for
+
+from app import (CHAT_QUEUE_TIMEOUT, EMBEDDER_WARMUP, QUEUE_HEARTBEAT, _save_ai_message, _start_chat_turn, app,
+                 ollama)
+from services.auth_service import AuthService
+
+SPOOL_SIZE = 1024 * 1024  # 请求体超过该大小时暂存到临时文件（上传文件）
+
+wsgi_application = WsgiToAsgi(app)
+
+
+def _environ(scope: dict, body) -> dict:
+    """按ASGI scope构造WSGI environ，使Flask的请求上下文、会话和表单解析照常工作"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin1').upper().replace('-', '_')
+        key = name if name in ('CONTENT_TYPE', 'CONTENT_LENGTH') else f'HTTP_{name}'
+        value = value.decode('latin1')
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def _read_body(receive):
+    """读取完整的请求体；客户端提前断开时返回None"""
+    body = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            body.close()
+            return None
+        body.write(message.get('body', b''))
+        if not message.get('more_body'):
+            body.seek(0)
+            return body
+
+
+def _run_in_request(environ: dict, fn):
+    """在请求上下文中依次执行 before_request 钩子、登录检查和 fn（在线程池中调用）
+
+    fn 返回 (结果, 响应)；响应经过 after_request 钩子处理（Server-Timing、会话Cookie），
+    abort 和异常按Flask的错误处理转换为响应，此时结果为None。
+    """
+    with app.request_context(environ):
+        result = None
+        try:
+            response = app.preprocess_request()
+            if response is None:
+                if not AuthService.get_current_user():
+                    response = redirect(url_for('login'))
+                else:
+                    result, response = fn()
+        except Exception as e:
+            try:
+                response = app.handle_user_exception(e)
+            except Exception as e:
+                response = app.handle_exception(e)
+        return result, app.process_response(app.make_response(response))
+
+
+def _begin_chat():
+    """排队并保存用户消息，返回后续生成需要的状态（不含ORM对象）"""
+    user, model, ticket, turn = _start_chat_turn()
+    conversation_id, message_content, file_path, user_message, document_job = turn
+    return {
+        "user_id": user.id,
+        "model": model,
+        "ticket": ticket,
+        "conversation_id": conversation_id,
+        "message": message_content,
+        "file_path": file_path,
+        "user_message": user_message.to_dict() if user_message.id else None,
+        "document_job_id": document_job.id if document_job else None,
+        "document": document_job.to_dict() if document_job else None
+    }
+
+
+def _begin_json():
+    # 响应头先经过 after_request 处理，回答生成后再填入响应体
+    return _begin_chat(), app.response_class(mimetype='application/json')
+
+
+def _begin_stream():
+    return _begin_chat(), app.response_class(
+        mimetype='application/x-ndjson',
+        # 禁止反向代理缓冲，保证token能及时到达浏览器
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+def _finish_chat(turn: dict, content: str) -> dict:
+    with app.app_context():
+        return _save_ai_message(turn["user_id"], turn["conversation_id"], content, turn["file_path"]).to_dict()
+
+
+async def _start(send, response, more_body: bool = False):
+    headers = [(k.lower().encode('latin1'), v.encode('latin1')) for k, v in response.headers.items()]
+    await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+    if not more_body:
+        await send({'type': 'http.response.body', 'body': response.get_data()})
+
+
+async def _wait_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+def _line(event: dict) -> bytes:
+    return (json.dumps(event, ensure_ascii=False) + "\n").encode('utf-8')
+
+
+async def _chat(scope, receive, send):
+    """POST /chat：等待完整回答后一次返回，响应格式与同步接口相同"""
+    body = await _read_body(receive)
+    if body is None:
+        return
+    loop = asyncio.get_running_loop()
+    environ = _environ(scope, body)
+    turn, response = await loop.run_in_executor(None, _run_in_request, environ, _begin_json)
+    body.close()
+    if turn is None:
+        await _start(send, response)
+        return
+
+    ticket = turn["ticket"]
+    try:
+        if await ticket.wait_async(CHAT_QUEUE_TIMEOUT):
+            model_response = await ollama.agenerate_response(
+                prompt=turn["message"],
+                user_id=turn["user_id"],
+                conversation_id=turn["conversation_id"],
+                document_job_id=turn["document_job_id"],
+                model=turn["model"]
+            )
+        else:
+            model_response = "错误：排队等待超时，请稍后重试"
+    finally:
+        ticket.release()
+
+    ai_message = await loop.run_in_executor(None, _finish_chat, turn, model_response)
+    response.set_data(json.dumps({
+        "success": True,
+        "conversation_id": turn["conversation_id"],
+        "user_message": turn["user_message"],
+        "model_response": ai_message,
+        "document": turn["document"]
+    }, ensure_ascii=False))
+    await _start(send, response)
+
+
+async def _chat_stream(scope, receive, send):
+    """POST /chat/stream：以NDJSON逐行推送 meta / queued / token / done 事件，客户端断开时中止生成"""
+    body = await _read_body(receive)
+    if body is None:
+        return
+    loop = asyncio.get_running_loop()
+    environ = _environ(scope, body)
+    turn, response = await loop.run_in_executor(None, _run_in_request, environ, _begin_stream)
+    body.close()
+    if turn is None:
+        await _start(send, response)
+        return
+
+    ticket = turn["ticket"]
+
+    async def produce():
+        await _start(send, response, more_body=True)
+
+        async def emit(event: dict):
+            await send({'type': 'http.response.body', 'body': _line(event), 'more_body': True})
+
+        await emit({
+            "type": "meta",
+            "conversation_id": turn["conversation_id"],
+            "user_message": turn["user_message"],
+            "document": turn["document"]
+        })
+
+        # 排队期间定时推送当前位置
+        while not ticket.granted.is_set() and time.monotonic() - ticket.enqueued_at < CHAT_QUEUE_TIMEOUT:
+            await emit({"type": "queued", "position": ticket.position()})
+            await ticket.wait_async(QUEUE_HEARTBEAT)
+
+        parts = []
+        if ticket.granted.is_set():
+            tokens = ollama.astream_response(
+                prompt=turn["message"],
+                user_id=turn["user_id"],
+                conversation_id=turn["conversation_id"],
+                document_job_id=turn["document_job_id"],
+                model=turn["model"]
+            )
+            try:
+                async for token in tokens:
+                    parts.append(token)
+                    await emit({"type": "token", "content": token})
+            finally:
+                # 被取消时立即关闭Ollama的流式响应
+                await tokens.aclose()
+        else:
+            parts.append("错误：排队等待超时，请稍后重试")
+            await emit({"type": "token", "content": parts[0]})
+        # 生成结束后立即归还名额，不等保存消息
+        ticket.release()
+
+        ai_message = await loop.run_in_executor(None, _finish_chat, turn, "".join(parts))
+        await emit({"type": "done", "conversation_id": turn["conversation_id"], "model_response": ai_message})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    producer = asyncio.ensure_future(produce())
+    watcher = asyncio.ensure_future(_wait_disconnect(receive))
+    try:
+        done, _ = await asyncio.wait({producer, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        if producer in done:
+            producer.result()
+        else:
+            # 客户端断开：仍在排队的请求移出队列，正在生成的请求停止读取Ollama输出
+            producer.cancel()
+            await asyncio.gather(producer, return_exceptions=True)
+    finally:
+        watcher.cancel()
+        ticket.release()
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            if EMBEDDER_WARMUP:
+                ollama.embedder.warm_up_async()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await ollama.aclose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+# 由协程处理的路由，(方法, 路径) -> 处理函数
+ASYNC_ROUTES = {
+    ('POST', '/chat'): _chat,
+    ('POST', '/chat/stream'): _chat_stream,
+}
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    handler = ASYNC_ROUTES.get((scope.get('method'), scope.get('path'))) if scope['type'] == 'http' else None
+    if handler is None:
+        await wsgi_application(scope, receive, send)
+        return
+    await handler(scope, receive, send)
@@ -0,0 +1,59 @@
+"""Add message content hash and request id for idempotent submissions
+
+Revision ID: 428fabb461c5
+Revises: f42fd03ad662
+Create Date: 2026-10-18 11:03:27.184903
+
+"""
+import hashlib
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '428fabb461c5'
+down_revision = 'f42fd03ad662'
+branch_labels = None
+depends_on = None
+
+BACKFILL_BATCH_SIZE = 500
+
+
+def upgrade():
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('content_hash', sa.String(length=64), nullable=True))
+        batch_op.add_column(sa.Column('request_id', sa.String(length=64), nullable=True))
+
+    # 分批回填已有消息的内容哈希
+    bind = op.get_bind()
+    message = sa.table('message', sa.column('id', sa.Integer), sa.column('content', sa.Text),
+                       sa.column('content_hash', sa.String))
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(message.c.id, message.c.content)
+            .where(message.c.id > last_id)
+            .order_by(message.c.id)
+            .limit(BACKFILL_BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        bind.execute(
+            message.update().where(message.c.id == sa.bindparam('row_id')).values(content_hash=sa.bindparam('hash')),
+            [{'row_id': row.id, 'hash': hashlib.sha256((row.content or '').encode('utf-8')).hexdigest()}
+             for row in rows]
+        )
+        last_id = rows[-1].id
+
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.create_index('ix_message_conversation_content_hash', ['conversation_id', 'content_hash'], unique=False)
+        batch_op.create_index('uq_message_conversation_request_id', ['conversation_id', 'request_id'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.drop_index('uq_message_conversation_request_id')
+        batch_op.drop_index('ix_message_conversation_content_hash')
+        batch_op.drop_column('request_id')
+        batch_op.drop_column('content_hash')
@@ -0,0 +1,28 @@
+"""Add rolling summary columns to conversation_thread
+
+Revision ID: b8d4f2a6c913
+Revises: 7c3e9a1d2b64
+Create Date: 2026-10-18 21:36:12.408215
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8d4f2a6c913'
+down_revision = '7c3e9a1d2b64'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('conversation_thread', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('summary', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('summary_message_count', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade():
+    with op.batch_alter_table('conversation_thread', schema=None) as batch_op:
+        batch_op.drop_column('summary_message_count')
+        batch_op.drop_column('summary')
@@ -0,0 +1,50 @@
+"""Add indexes and denormalized conversation stats
+
+Revision ID: f42fd03ad662
+Revises: fc5c216f38f8
+Create Date: 2026-10-18 10:12:41.530217
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f42fd03ad662'
+down_revision = 'fc5c216f38f8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('conversation_thread', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('last_activity', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('message_count', sa.Integer(), nullable=False, server_default='0'))
+
+    # 回填已有会话的最后活跃时间和消息数
+    op.execute("""
+        UPDATE conversation_thread SET
+            message_count = (SELECT COUNT(*) FROM message WHERE message.conversation_id = conversation_thread.id),
+            last_activity = COALESCE(
+                (SELECT MAX(timestamp) FROM message WHERE message.conversation_id = conversation_thread.id),
+                created_at
+            )
+    """)
+
+    with op.batch_alter_table('conversation_thread', schema=None) as batch_op:
+        batch_op.create_index('ix_conversation_thread_user_activity', ['user_id', 'last_activity', 'id'], unique=False)
+
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.create_index('ix_message_conversation_timestamp', ['conversation_id', 'timestamp'], unique=False)
+        batch_op.create_index('ix_message_user_id', ['user_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.drop_index('ix_message_user_id')
+        batch_op.drop_index('ix_message_conversation_timestamp')
+
+    with op.batch_alter_table('conversation_thread', schema=None) as batch_op:
+        batch_op.drop_index('ix_conversation_thread_user_activity')
+        batch_op.drop_column('message_count')
+        batch_op.drop_column('last_activity')
@@ -0,0 +1,52 @@
+from datetime import datetime
+from models.user import db
+
+class DocumentJob(db.Model):
+    """上传文档的后台处理任务：解析、分块并写入会话的向量记忆"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation_thread.id'), nullable=False)
+    filename = db.Column(db.String(200), nullable=False)
+    file_path = db.Column(db.String(500), nullable=False)
+    content_hash = db.Column(db.String(64))  # 文件内容的SHA-256，相同内容的文档共用分块和向量缓存
+    status = db.Column(db.String(20), nullable=False, default=QUEUED)
+    stage = db.Column(db.String(20))  # parsing / embedding / indexing
+    processed_chunks = db.Column(db.Integer, nullable=False, default=0)
+    total_chunks = db.Column(db.Integer)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_document_job_status', 'status', 'updated_at'),
+        db.Index('ix_document_job_conversation', 'conversation_id'),
+    )
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (self.DONE, self.FAILED)
+
+    def to_dict(self):
+        progress = None
+        if self.total_chunks:
+            progress = round(self.processed_chunks / self.total_chunks, 3)
+        elif self.status == self.DONE:
+            progress = 1.0
+        return {
+            "id": self.id,
+            "conversation_id": self.conversation_id,
+            "filename": self.filename,
+            "status": self.status,
+            "stage": self.stage,
+            "processed_chunks": self.processed_chunks,
+            "total_chunks": self.total_chunks,
+            "progress": progress,
+            "error": self.error,
+            "created_at": self.created_at.isoformat(),
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None
+        }
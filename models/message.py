@@ -1,13 +1,36 @@
+import hashlib
 from datetime import datetime
+from sqlalchemy import event
 from models.user import db
 
 class ConversationThread(db.Model):
+    DEFAULT_TITLE = "新对话"  # 第一轮问答后由后台任务替换为生成的标题
+
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # 冗余字段，插入消息时维护，避免加载会话列表时聚合整张消息表
+    last_activity = db.Column(db.DateTime, default=datetime.utcnow)
+    message_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # 较早消息的滚动摘要，及摘要覆盖的消息数（按时间顺序的前 summary_message_count 条）
+    summary = db.Column(db.Text)
+    summary_message_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     messages = db.relationship('Message', backref='thread', lazy=True)
 
+    __table_args__ = (
+        db.Index('ix_conversation_thread_user_activity', 'user_id', 'last_activity', 'id'),
+    )
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "title": self.title,
+            "created_at": self.created_at.isoformat(),
+            "last_activity": self.last_activity.isoformat() if self.last_activity else None,
+            "message_count": self.message_count
+        }
+
 class Message(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.Text, nullable=False)
@@ -16,6 +39,21 @@ class Message(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     conversation_id = db.Column(db.Integer, db.ForeignKey('conversation_thread.id'), nullable=False)
     file_path = db.Column(db.String(200))
+    # 内容的SHA-256，用于按索引判断重复消息，避免比较大段文本
+    content_hash = db.Column(db.String(64))
+    # 客户端提交时生成的请求ID，同一会话内唯一，用于拒绝重复提交
+    request_id = db.Column(db.String(64))
+
+    __table_args__ = (
+        db.Index('ix_message_conversation_timestamp', 'conversation_id', 'timestamp'),
+        db.Index('ix_message_user_id', 'user_id'),
+        db.Index('ix_message_conversation_content_hash', 'conversation_id', 'content_hash'),
+        db.Index('uq_message_conversation_request_id', 'conversation_id', 'request_id', unique=True),
+    )
+
+    @staticmethod
+    def hash_content(content: str) -> str:
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
 
     def to_dict(self):
         return {
@@ -26,3 +64,23 @@ class Message(db.Model):
             "conversation_id": self.conversation_id,
             "file_path": self.file_path
         }
+
+
+@event.listens_for(Message, 'before_insert')
+def _set_content_hash(mapper, connection, target):
+    if target.content_hash is None and target.content is not None:
+        target.content_hash = Message.hash_content(target.content)
+
+
+@event.listens_for(Message, 'after_insert')
+def _update_thread_stats(mapper, connection, target):
+    """插入消息时在同一事务内更新会话的最后活跃时间和消息数"""
+    threads = ConversationThread.__table__
+    connection.execute(
+        threads.update()
+        .where(threads.c.id == target.conversation_id)
+        .values(
+            message_count=threads.c.message_count + 1,
+            last_activity=target.timestamp
+        )
+    )
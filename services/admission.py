@@ -0,0 +1,195 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, List, Optional
+
+
+class QueueFull(RuntimeError):
+    """等待队列已满（总量或该用户的排队数达到上限）"""
+
+    def __init__(self, message: str, position: int, retry_after: int):
+        super().__init__(message)
+        self.position = position
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """一次生成请求的排队凭证：排队 -> 获准执行 -> 释放"""
+
+    def __init__(self, controller: "AdmissionController", user_id: int):
+        self.controller = controller
+        self.user_id = user_id
+        self.granted = threading.Event()
+        self.released = False
+        self.enqueued_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self._callbacks: List[Callable[[], None]] = []
+
+    def wait(self, timeout: float = None) -> bool:
+        """等待获准执行，返回是否已获准"""
+        return self.granted.wait(timeout)
+
+    async def wait_async(self, timeout: float = None) -> bool:
+        """wait 的异步版本：获准时由调度线程唤醒事件循环，等待期间不占用线程"""
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+
+        def wake():
+            loop.call_soon_threadsafe(event.set)
+
+        self.controller.on_granted(self, wake)
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            # 超时或被取消时注销回调，排队期间反复心跳等待不会累积回调
+            self.controller.remove_callback(self, wake)
+        return self.granted.is_set()
+
+    def position(self) -> int:
+        """当前排在第几位（已获准执行时为0）"""
+        return self.controller.position(self)
+
+    def release(self):
+        """执行结束或客户端放弃时调用（可重复调用）：未获准的从队列中移除，已获准的归还名额"""
+        self.controller.release(self)
+
+
+class AdmissionController:
+    """生成请求的准入控制
+
+    - 同时执行的生成请求不超过 max_active，每个用户不超过 max_per_user
+    - 超出的请求按用户分队列排队，各用户之间轮转调度，单个用户的大量请求不会挤占其他用户
+    - 排队总数或单个用户的排队数达到上限时直接拒绝（由调用方返回429和预计的排队位置）
+    """
+
+    def __init__(self, max_active: int = 8, max_per_user: int = 2, max_queue: int = 32,
+                 max_queue_per_user: int = 4):
+        self.max_active = max_active
+        self.max_per_user = max_per_user
+        self.max_queue = max_queue
+        self.max_queue_per_user = max_queue_per_user
+        self._waiting: "OrderedDict[int, Deque[Ticket]]" = OrderedDict()  # 按轮转顺序排列的各用户队列
+        self._active: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._avg_seconds = 10.0  # 单个生成请求耗时的指数滑动平均，用于估算 Retry-After
+        self.admitted = 0
+        self.rejected = 0
+        self.cancelled = 0
+
+    @property
+    def active(self) -> int:
+        return sum(self._active.values())
+
+    @property
+    def queued(self) -> int:
+        return sum(len(q) for q in self._waiting.values())
+
+    def enter(self, user_id: int) -> Ticket:
+        """登记一个生成请求；有空闲名额时立即获准，否则排队；队列已满时抛出 QueueFull"""
+        ticket = Ticket(self, user_id)
+        with self._lock:
+            queue = self._waiting.get(user_id)
+            queued = self.queued
+            if queued >= self.max_queue or (queue is not None and len(queue) >= self.max_queue_per_user):
+                self.rejected += 1
+                position = queued + 1
+                raise QueueFull("请求过多，请稍后再试", position, self._retry_after(position))
+            if queue is None:
+                queue = self._waiting[user_id] = deque()
+            queue.append(ticket)
+            self._dispatch()
+        return ticket
+
+    def position(self, ticket: Ticket) -> int:
+        with self._lock:
+            if ticket.granted.is_set() or ticket.released:
+                return 0
+            queue = self._waiting.get(ticket.user_id)
+            if queue is None or ticket not in queue:
+                return 0
+            # 轮转调度下，排在本用户第 i 位的请求之前，其他每个用户最多先执行 i+1 个
+            index = queue.index(ticket)
+            ahead = sum(min(len(q), index + 1) for uid, q in self._waiting.items() if uid != ticket.user_id)
+            return ahead + index + 1
+
+    def on_granted(self, ticket: Ticket, callback: Callable[[], None]):
+        """获准执行时调用 callback（已获准则立即调用）"""
+        with self._lock:
+            if not ticket.granted.is_set():
+                ticket._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, ticket: Ticket, callback: Callable[[], None]):
+        """注销尚未调用的 on_granted 回调"""
+        with self._lock:
+            if callback in ticket._callbacks:
+                ticket._callbacks.remove(callback)
+
+    def release(self, ticket: Ticket):
+        with self._lock:
+            if ticket.released:
+                return
+            ticket.released = True
+            if ticket.granted.is_set():
+                count = self._active.get(ticket.user_id, 0) - 1
+                if count > 0:
+                    self._active[ticket.user_id] = count
+                else:
+                    self._active.pop(ticket.user_id, None)
+                elapsed = time.monotonic() - ticket.started_at
+                self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * elapsed
+            else:
+                queue = self._waiting.get(ticket.user_id)
+                if queue is not None and ticket in queue:
+                    queue.remove(ticket)
+                    if not queue:
+                        del self._waiting[ticket.user_id]
+                ticket._callbacks.clear()
+                self.cancelled += 1
+            self._dispatch()
+
+    def _dispatch(self):
+        """按用户轮转，把空闲名额分给排队中的请求（调用方需持有锁）"""
+        while self.active < self.max_active:
+            for user_id, queue in self._waiting.items():
+                if self._active.get(user_id, 0) < self.max_per_user:
+                    break
+            else:
+                return  # 排队中的用户都已达到单用户并发上限
+            ticket = queue.popleft()
+            if queue:
+                self._waiting.move_to_end(user_id)  # 该用户本轮已调度，排到队尾
+            else:
+                del self._waiting[user_id]
+            self._active[user_id] = self._active.get(user_id, 0) + 1
+            ticket.started_at = time.monotonic()
+            self.admitted += 1
+            ticket.granted.set()
+            for callback in ticket._callbacks:
+                try:
+                    callback()
+                except RuntimeError as e:  # 等待方的事件循环已关闭
+                    print(f"[DEBUG] 唤醒排队请求失败: {e}")
+            ticket._callbacks.clear()
+
+    def _retry_after(self, position: int) -> int:
+        """按平均耗时估算排到 position 需要的秒数（调用方需持有锁）"""
+        return max(1, round(position * self._avg_seconds / self.max_active))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "active": self.active,
+                "queued": self.queued,
+                "max_active": self.max_active,
+                "max_per_user": self.max_per_user,
+                "max_queue": self.max_queue,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "cancelled": self.cancelled,
+                "avg_seconds": round(self._avg_seconds, 2)
+            }
@@ -1,8 +1,15 @@
-from flask import session, redirect, url_for, request, render_template
+from flask import g, session, redirect, url_for, request, render_template
+from sqlalchemy import event
+from sqlalchemy.orm import make_transient_to_detached
 from models.user import User, db
 from functools import wraps
+from .ttl_cache import TTLCache
 
 class AuthService:
+    # 用户记录缓存：user_id -> 脱离数据库会话的 User 副本；
+    # 用户信息变更、删除或登出时失效，TTL 限制多进程部署下其他进程中副本的过期时间
+    user_cache = TTLCache(max_entries=4096, ttl=60)
+
     @staticmethod
     def register_user(username, email, password):
         if User.query.filter_by(username=username).first():
@@ -22,17 +29,42 @@ class AuthService:
         if not user or not user.check_password(password):
             return False, "用户名或密码错误"
         session['user_id'] = user.id
+        g.pop('current_user', None)
         return True, "登录成功"
 
     @staticmethod
     def logout_user():
-        session.pop('user_id', None)
+        user_id = session.pop('user_id', None)
+        g.pop('current_user', None)
+        if user_id is not None:
+            AuthService.invalidate_user(user_id)
 
     @staticmethod
     def get_current_user():
-        if 'user_id' in session:
-            return User.query.get(session['user_id'])
-        return None
+        """当前登录用户，每个请求只解析一次并保存在 flask.g 上"""
+        if 'current_user' not in g:
+            user_id = session.get('user_id')
+            g.current_user = AuthService._load_user(user_id) if user_id is not None else None
+        return g.current_user
+
+    @staticmethod
+    def _load_user(user_id):
+        """优先从缓存获取用户记录，合并到当前数据库会话时不查询数据库"""
+        cached = AuthService.user_cache.get(user_id)
+        if cached is not None:
+            return db.session.merge(cached, load=False)
+
+        user = db.session.get(User, user_id)
+        if user is not None:
+            # 缓存一份副本，请求中使用的实例仍绑定在当前会话上
+            snapshot = User(**{column.key: getattr(user, column.key) for column in User.__table__.columns})
+            make_transient_to_detached(snapshot)
+            AuthService.user_cache.set(user_id, snapshot)
+        return user
+
+    @staticmethod
+    def invalidate_user(user_id):
+        AuthService.user_cache.delete(user_id)
 
     @staticmethod
     def handle_login():
@@ -66,3 +98,10 @@ class AuthService:
                 return redirect(url_for('login'))
             return f(*args, **kwargs)
         return decorated_function
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _invalidate_cached_user(mapper, connection, target):
+    """用户信息修改或删除后清除缓存的副本"""
+    AuthService.invalidate_user(target.id)
@@ -0,0 +1,123 @@
+import hashlib
+import json
+import os
+import tempfile
+from typing import BinaryIO, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+
+def hash_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """流式计算文件的 SHA-256"""
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk_size), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+class BlobStore:
+    """按内容寻址的上传文件存储
+
+    文件以 SHA-256 命名并按哈希前缀分目录保存（uploads/ab/cd/<sha256>.pdf），
+    保存时边读边计算哈希，不把整个上传读入内存；相同内容只保存一份。
+    """
+
+    def __init__(self, root: str, chunk_size: int = 1024 * 1024):
+        self.root = root
+        self.chunk_size = chunk_size
+        os.makedirs(os.path.join(root, 'tmp'), exist_ok=True)
+
+    def path_for(self, digest: str, suffix: str = '') -> str:
+        return os.path.join(self.root, digest[:2], digest[2:4], digest + suffix.lower())
+
+    def save(self, stream: BinaryIO, suffix: str = '') -> Tuple[str, str, bool]:
+        """保存上传流，返回 (内容哈希, 文件路径, 是否为新文件)"""
+        sha256 = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.join(self.root, 'tmp'))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    block = stream.read(self.chunk_size)
+                    if not block:
+                        break
+                    sha256.update(block)
+                    f.write(block)
+
+            digest = sha256.hexdigest()
+            path = self.path_for(digest, suffix)
+            if os.path.exists(path):
+                os.remove(tmp_path)
+                return digest, path, False
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+            return digest, path, True
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+class DocumentCache:
+    """按文档内容哈希缓存分块结果和向量，相同文档（不论由哪个用户上传）只解析和向量化一次
+
+    每个文档一个目录：chunks.jsonl（分块原文）、vectors.f32（float32向量）、meta.json（完成标记）。
+    """
+
+    def __init__(self, root: str, dim: int = 384):
+        self.root = root
+        self.dim = dim
+
+    def _dir(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest)
+
+    def lookup(self, digest: str) -> Optional[int]:
+        """已缓存时返回块数"""
+        meta_path = os.path.join(self._dir(digest), 'meta.json')
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            return json.load(f)['chunks']
+
+    def staging_paths(self, digest: str) -> Tuple[str, str]:
+        """返回本次写入使用的临时分块和向量文件路径（每次调用唯一，支持并发写入同一文档）"""
+        directory = self._dir(digest)
+        os.makedirs(directory, exist_ok=True)
+        token = os.urandom(4).hex()
+        return (os.path.join(directory, f'chunks.{token}.tmp'),
+                os.path.join(directory, f'vectors.{token}.tmp'))
+
+    def commit(self, digest: str, chunks_path: str, vectors_path: str, count: int):
+        directory = self._dir(digest)
+        os.replace(chunks_path, os.path.join(directory, 'chunks.jsonl'))
+        os.replace(vectors_path, os.path.join(directory, 'vectors.f32'))
+        meta_tmp = os.path.join(directory, f'meta.{os.urandom(4).hex()}.tmp')
+        with open(meta_tmp, 'w', encoding='utf-8') as f:
+            json.dump({'chunks': count, 'dim': self.dim}, f)
+        # 最后写入完成标记，保证读取方看到的总是完整的数据
+        os.replace(meta_tmp, os.path.join(directory, 'meta.json'))
+
+    @staticmethod
+    def discard(*paths: str):
+        for path in paths:
+            if path and os.path.exists(path):
+                os.remove(path)
+
+    def iter_batches(self, digest: str, batch_size: int = 64) -> Iterator[Tuple[List[str], np.ndarray]]:
+        """按批读取缓存的分块及其向量（向量文件通过内存映射读取）"""
+        directory = self._dir(digest)
+        vectors_path = os.path.join(directory, 'vectors.f32')
+        count = os.path.getsize(vectors_path) // (self.dim * 4)
+        vectors = np.memmap(vectors_path, dtype='float32', mode='r', shape=(count, self.dim)) if count else None
+
+        batch: List[str] = []
+        start = 0
+        with open(os.path.join(directory, 'chunks.jsonl'), 'r', encoding='utf-8') as f:
+            for line in f:
+                batch.append(json.loads(line))
+                if len(batch) >= batch_size:
+                    yield batch, np.array(vectors[start:start + len(batch)])
+                    start += len(batch)
+                    batch = []
+        if batch:
+            yield batch, np.array(vectors[start:start + len(batch)])
@@ -0,0 +1,195 @@
+import hashlib
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, List
+
+import numpy as np
+
+from .metrics import metrics
+
+
+class EmbeddingService:
+    """文本向量化服务
+
+    - 同一次调用内相同文本只计算一次
+    - 按内容哈希缓存向量（LRU）
+    - 后台线程把多个请求的文本合并成小批量，最多等待 max_wait_ms 凑批，减少单条前向计算
+    - 模型（及torch等依赖）在首次使用或 warm_up() 时才加载，不拖慢应用启动
+    """
+
+    def __init__(self, model_name: str = 'paraphrase-multilingual-MiniLM-L12-v2', dim: int = 384,
+                 max_batch_size: int = 32, max_wait_ms: float = 5, cache_size: int = 10000):
+        self.model_name = model_name
+        self.dim = dim
+        self._model = None
+        self._model_lock = threading.Lock()
+        self.load_seconds = None
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.cache_size = cache_size
+
+        self._cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._pending: Dict[str, Future] = {}
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self._warmup_thread = None
+
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "requests": 0,
+            "texts": 0,
+            "cache_hits": 0,
+            "cache_misses": 0,
+            "batches": 0,
+            "batched_texts": 0,
+            "max_batch_size": 0,
+        }
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    start = time.perf_counter()
+                    from sentence_transformers import SentenceTransformer
+                    self._model = SentenceTransformer(self.model_name)
+                    self.load_seconds = time.perf_counter() - start
+                    print(f"[STARTUP] 向量模型 {self.model_name} 加载耗时 {self.load_seconds:.2f}s")
+        return self._model
+
+    @property
+    def ready(self) -> bool:
+        return self._model is not None
+
+    def warm_up(self):
+        """加载模型并完成一次前向计算"""
+        self.model.encode(["warm up"])
+
+    def warm_up_async(self):
+        """在后台线程中预热，重复调用只会启动一次"""
+        with self._worker_lock:
+            if self._warmup_thread is not None:
+                return
+            self._warmup_thread = threading.Thread(target=self._warm_up_in_background, name='embedding-warmup',
+                                                   daemon=True)
+            self._warmup_thread.start()
+
+    def _warm_up_in_background(self):
+        try:
+            self.warm_up()
+        except Exception as e:
+            print(f"[STARTUP] 向量模型预热失败: {e}")
+            # 允许下一次请求重新触发预热
+            with self._worker_lock:
+                self._warmup_thread = None
+
+    @staticmethod
+    def _key(text: str) -> str:
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """返回与 texts 一一对应的向量矩阵"""
+        keys = [self._key(t) for t in texts]
+        unique: Dict[str, str] = dict(zip(keys, texts))
+
+        vectors: Dict[str, np.ndarray] = {}
+        futures: Dict[str, Future] = {}
+        submit = []
+        with self._cache_lock:
+            for key, text in unique.items():
+                vec = self._cache.get(key)
+                if vec is not None:
+                    self._cache.move_to_end(key)
+                    vectors[key] = vec
+                elif key in self._pending:
+                    # 其他请求正在计算同一文本，直接等待其结果
+                    futures[key] = self._pending[key]
+                else:
+                    future = Future()
+                    self._pending[key] = future
+                    futures[key] = future
+                    submit.append((key, text, future))
+
+        if submit:
+            self._ensure_worker()
+            for item in submit:
+                self._queue.put(item)
+        for key, future in futures.items():
+            vectors[key] = future.result()
+
+        with self._stats_lock:
+            self._stats["requests"] += 1
+            self._stats["texts"] += len(texts)
+            self._stats["cache_hits"] += len(unique) - len(futures)
+            self._stats["cache_misses"] += len(futures)
+
+        if not texts:
+            return np.empty((0, self.dim), dtype='float32')
+        return np.vstack([vectors[key] for key in keys]).astype('float32')
+
+    def stats(self) -> Dict[str, float]:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        lookups = stats["cache_hits"] + stats["cache_misses"]
+        stats["cache_hit_rate"] = stats["cache_hits"] / lookups if lookups else 0.0
+        stats["avg_batch_size"] = stats["batched_texts"] / stats["batches"] if stats["batches"] else 0.0
+        with self._cache_lock:
+            stats["cache_entries"] = len(self._cache)
+        stats["queued"] = self._queue.qsize()
+        return stats
+
+    def _ensure_worker(self):
+        if self._worker is not None:
+            return
+        with self._worker_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name='embedding-batcher', daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            # 在等待窗口内继续收集其他请求的文本
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._encode_batch(batch)
+
+    def _encode_batch(self, batch: List[tuple]):
+        texts = [text for _, text, _ in batch]
+        try:
+            with metrics.timer("embedding"):
+                vectors = np.asarray(self.model.encode(texts), dtype='float32')
+        except Exception as e:
+            with self._cache_lock:
+                for key, _, _ in batch:
+                    self._pending.pop(key, None)
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+
+        with self._cache_lock:
+            for (key, _, _), vec in zip(batch, vectors):
+                self._cache[key] = vec
+                self._pending.pop(key, None)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        with self._stats_lock:
+            self._stats["batches"] += 1
+            self._stats["batched_texts"] += len(batch)
+            self._stats["max_batch_size"] = max(self._stats["max_batch_size"], len(batch))
+
+        for (_, _, future), vec in zip(batch, vectors):
+            future.set_result(vec)
@@ -0,0 +1,142 @@
+import json
+import re
+from pathlib import Path
+from typing import Iterable, Iterator, List
+
+# 句子结束符（中英文），分块时优先在这些位置断开
+_SENTENCE_END = re.compile(r'[。！？；!?;]|\.(?=\s)|\n')
+
+SUPPORTED_SUFFIXES = ('.pdf', '.doc', '.docx', '.txt', '.md', '.markdown')
+
+
+def iter_document_text(file_path: Path, block_size: int = 64 * 1024) -> Iterator[str]:
+    """逐页/逐段读取文档文本，不把整份文件读入内存"""
+    file_path = Path(file_path)
+    suffix = file_path.suffix.lower()
+
+    if suffix == '.pdf':
+        from PyPDF2 import PdfReader  # 文档解析库只在处理文件时才导入
+
+        with open(file_path, 'rb') as f:
+            reader = PdfReader(f)
+            for page in reader.pages:
+                text = page.extract_text() or ''
+                if text.strip():
+                    yield text
+
+    elif suffix in ('.doc', '.docx'):
+        from docx import Document
+
+        doc = Document(file_path)
+        for para in doc.paragraphs:
+            if para.text.strip():
+                yield para.text + '\n'
+
+    elif suffix in ('.txt', '.md', '.markdown'):
+        with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+            while True:
+                block = f.read(block_size)
+                if not block:
+                    break
+                yield block
+
+    else:
+        raise ValueError(f"不支持的文件类型：{file_path.name}")
+
+
+def _split_sentences(text: str):
+    """切分出完整的句子（保留结束符），返回 (句子列表, 末尾未结束的部分)"""
+    sentences = []
+    start = 0
+    for match in _SENTENCE_END.finditer(text):
+        sentences.append(text[start:match.end()])
+        start = match.end()
+    return sentences, text[start:]
+
+
+def chunk_text(segments: Iterable[str], chunk_size: int = 800, overlap: int = 150) -> Iterator[str]:
+    """按句子边界把文本流切分为不超过 chunk_size 字符的块，相邻块之间保留约 overlap 字符的重叠"""
+    current: List[str] = []
+    length = 0
+    remainder = ''
+
+    def sentences_of(segment_iter):
+        nonlocal remainder
+        for segment in segment_iter:
+            # 上一段末尾未结束的半句话拼到本段开头
+            sentences, remainder = _split_sentences(remainder + segment)
+            yield from sentences
+        if remainder:
+            yield remainder
+
+    for sentence in sentences_of(segments):
+        if not sentence.strip():
+            continue
+        # 超长句子按长度硬切，先输出已累积的内容以保持顺序
+        if len(sentence) > chunk_size and current:
+            yield ''.join(current).strip()
+            current, length = [], 0
+        while len(sentence) > chunk_size:
+            yield sentence[:chunk_size].strip()
+            sentence = sentence[chunk_size - overlap:]
+
+        if length + len(sentence) > chunk_size and current:
+            yield ''.join(current).strip()
+            # 保留末尾若干句作为下一块的开头
+            tail: List[str] = []
+            tail_length = 0
+            for s in reversed(current):
+                if tail_length + len(s) > overlap:
+                    break
+                tail.insert(0, s)
+                tail_length += len(s)
+            current, length = tail, tail_length
+
+        current.append(sentence)
+        length += len(sentence)
+
+    if current and ''.join(current).strip():
+        yield ''.join(current).strip()
+
+
+def iter_document_chunks(file_path: Path, chunk_size: int = 800, overlap: int = 150) -> Iterator[str]:
+    """流式提取并切分文档，分块只包含文档内容，与文件名无关，可按内容哈希在用户之间复用"""
+    yield from chunk_text(iter_document_text(file_path), chunk_size, overlap)
+
+
+def label_chunk(filename: str, index: int, chunk: str) -> str:
+    """写入记忆前给分块加上文件名前缀，便于模型说明信息来源"""
+    return f"【文件 {filename} 第{index}段】{chunk}"
+
+
+def parse_document_to_file(file_path: Path, output_path: Path, chunk_size: int = 800, overlap: int = 150) -> int:
+    """解析并切分文档，分块逐行写入 JSONL 文件，返回块数
+
+    供后台任务在独立进程中执行（CPU密集的PDF解析不占用Web进程的GIL），结果经文件交给父进程：
+        python -m services.file_service <文档路径> <输出路径>
+    """
+    count = 0
+    with open(output_path, 'w', encoding='utf-8') as f:
+        for chunk in iter_document_chunks(file_path, chunk_size, overlap):
+            f.write(json.dumps(chunk, ensure_ascii=False) + '\n')
+            count += 1
+    return count
+
+
+def iter_chunk_file(path: Path, batch_size: int = 64) -> Iterator[List[str]]:
+    """按批读取 parse_document_to_file 写出的分块"""
+    batch: List[str] = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            batch.append(json.loads(line))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+if __name__ == '__main__':
+    import sys
+
+    print(parse_document_to_file(Path(sys.argv[1]), Path(sys.argv[2])))
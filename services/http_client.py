@@ -0,0 +1,117 @@
+import threading
+import time
+from typing import Callable
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+def create_session(pool_size: int = 10, max_retries: int = 2, backoff_factor: float = 0.2) -> requests.Session:
+    """创建带连接池的会话，复用keep-alive连接
+
+    只在建立连接失败时按指数退避重试（此时请求尚未发出，重试是安全的），
+    读超时和HTTP错误状态不重试，交由调用方处理。
+    """
+    retry = Retry(
+        total=max_retries,
+        connect=max_retries,
+        read=0,
+        status=0,
+        other=0,
+        backoff_factor=backoff_factor,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def create_async_client(pool_size: int = 10, max_retries: int = 2):
+    """创建异步HTTP客户端（ASGI模式使用），与 create_session 一样复用连接、只重试建立连接失败"""
+    import httpx  # 仅异步模式需要
+
+    transport = httpx.AsyncHTTPTransport(
+        retries=max_retries,
+        limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+    )
+    return httpx.AsyncClient(transport=transport)
+
+
+def async_timeout(timeout):
+    """把 requests 风格的超时（秒数或 (连接, 读取) 元组）转换为 httpx.Timeout"""
+    import httpx
+
+    if isinstance(timeout, tuple):
+        connect, read = timeout
+        return httpx.Timeout(read, connect=connect)
+    return httpx.Timeout(timeout)
+
+
+class CircuitBreaker:
+    """熔断器：缓存后端健康状态，代替每次请求前的健康检查
+
+    连续失败达到 failure_threshold 次后熔断，此后请求直接失败；
+    熔断期间由后台线程每隔 probe_interval 秒调用 probe 探测，成功后恢复。
+    """
+
+    def __init__(self, probe: Callable[[], bool], failure_threshold: int = 3,
+                 probe_interval: float = 5, name: str = 'backend'):
+        self.probe = probe
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+        self.name = name
+        self._failures = 0
+        self._open = False
+        self._opened_at = None
+        self._prober = None
+        self._lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        return not self._open
+
+    def state(self) -> dict:
+        with self._lock:
+            return {
+                "open": self._open,
+                "consecutive_failures": self._failures,
+                "opened_at": self._opened_at
+            }
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._open = False
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._open or self._failures < self.failure_threshold:
+                return
+            self._open = True
+            self._opened_at = time.time()
+            print(f"[DEBUG] {self.name} 连续失败 {self._failures} 次，已熔断")
+            if self._prober is None:
+                self._prober = threading.Thread(target=self._probe_loop, name=f'{self.name}-probe', daemon=True)
+                self._prober.start()
+
+    def _probe_loop(self):
+        while True:
+            time.sleep(self.probe_interval)
+            try:
+                healthy = self.probe()
+            except Exception:
+                healthy = False
+            with self._lock:
+                if healthy:
+                    print(f"[DEBUG] {self.name} 探测成功，恢复服务")
+                    self._failures = 0
+                    self._open = False
+                    self._opened_at = None
+                if not self._open:
+                    self._prober = None
+                    return
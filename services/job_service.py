@@ -0,0 +1,266 @@
+import os
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from models.document import DocumentJob
+from models.user import db
+from .blob_store import DocumentCache, hash_file
+from .file_service import SUPPORTED_SUFFIXES, iter_chunk_file, label_chunk
+from .metrics import metrics
+
+# 项目根目录，解析子进程以 python -m services.file_service 方式运行
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class DocumentJobQueue:
+    """上传文档的本地后台任务队列
+
+    任务状态保存在 document_job 表中，无需外部消息队列：
+    - 文档解析和分块在独立的子进程中执行（CPU密集），同时运行的子进程数不超过 workers
+    - 向量化和写入记忆在线程中按批执行，并持续更新进度
+    - 分块和向量按文档内容哈希缓存，重复上传的文档直接复用，不再解析和向量化
+    - 多个worker进程通过原子地更新任务状态来认领任务，进程重启后恢复未完成的任务
+    """
+
+    def __init__(self, memory, cache: DocumentCache, workers: int = 2, batch_size: int = 64,
+                 parse_timeout: int = 600, stale_after: int = 900):
+        self.memory = memory
+        self.cache = cache
+        self.batch_size = batch_size
+        self.parse_timeout = parse_timeout
+        self.stale_after = stale_after  # 运行中任务超过该秒数未更新视为所在进程已退出
+        self.app = None
+        self._workers = workers
+        self._executor = None
+        self._events: Dict[int, threading.Event] = {}
+        self._lock = threading.Lock()
+        self._recovered = False
+
+    def init_app(self, app):
+        self.app = app
+
+    def _ensure_started(self):
+        if self._executor is not None:
+            return
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix='document-job')
+
+    def submit(self, user_id: int, conversation_id: int, file_path: str, filename: str,
+               content_hash: Optional[str] = None) -> DocumentJob:
+        """创建任务并立即返回，处理在后台进行"""
+        job = self.create(user_id, conversation_id, file_path, filename, content_hash)
+        db.session.commit()
+        self.start(job.id)
+        return job
+
+    def create(self, user_id: int, conversation_id: int, file_path: str, filename: str,
+               content_hash: Optional[str] = None) -> DocumentJob:
+        """只把任务加入当前事务，由调用方提交后再调用 start"""
+        job = DocumentJob(
+            user_id=user_id,
+            conversation_id=conversation_id,
+            file_path=file_path,
+            filename=filename,
+            content_hash=content_hash,
+            status=DocumentJob.QUEUED
+        )
+        db.session.add(job)
+        return job
+
+    def start(self, job_id: int):
+        """任务已提交到数据库后开始后台处理"""
+        self._enqueue(job_id)
+
+    def recover(self):
+        """重新入队排队中以及长时间未更新的运行中任务（首次调用时执行一次）"""
+        if self._recovered:
+            return
+        stale_before = datetime.utcnow() - timedelta(seconds=self.stale_after)
+        try:
+            jobs = DocumentJob.query.with_entities(DocumentJob.id).filter(db.or_(
+                DocumentJob.status == DocumentJob.QUEUED,
+                db.and_(DocumentJob.status == DocumentJob.RUNNING, DocumentJob.updated_at < stale_before)
+            )).all()
+        except Exception as e:
+            # 不影响当前请求，下次调用时重试
+            print(f"[DEBUG] 恢复文档任务失败: {e}")
+            db.session.rollback()
+            return
+        # 查询成功后才标记，查询失败（如数据库暂时不可用）时下次调用会重试
+        self._recovered = True
+        for job in jobs:
+            self._enqueue(job.id)
+
+    @property
+    def pending(self) -> int:
+        """本进程中排队或处理中的任务数"""
+        with self._lock:
+            return len(self._events)
+
+    def wait(self, job_id: int, timeout: float) -> bool:
+        """等待本进程中的任务完成，返回是否已完成"""
+        with self._lock:
+            event = self._events.get(job_id)
+        if event is None:
+            return False
+        return event.wait(timeout)
+
+    def get(self, job_id: int, user_id: int) -> Optional[DocumentJob]:
+        return DocumentJob.query.filter_by(id=job_id, user_id=user_id).first()
+
+    def _enqueue(self, job_id: int):
+        self._ensure_started()
+        with self._lock:
+            self._events.setdefault(job_id, threading.Event())
+        self._executor.submit(self._run, job_id)
+
+    def _claim(self, job_id: int) -> bool:
+        """原子地把任务标记为运行中，避免多个进程重复处理"""
+        stale_before = datetime.utcnow() - timedelta(seconds=self.stale_after)
+        claimed = DocumentJob.query.filter(
+            DocumentJob.id == job_id,
+            db.or_(
+                DocumentJob.status == DocumentJob.QUEUED,
+                db.and_(DocumentJob.status == DocumentJob.RUNNING, DocumentJob.updated_at < stale_before)
+            )
+        ).update({
+            "status": DocumentJob.RUNNING,
+            "stage": "parsing",
+            "processed_chunks": 0,
+            "error": None,
+            "updated_at": datetime.utcnow()
+        }, synchronize_session=False)
+        db.session.commit()
+        return claimed == 1
+
+    def _update(self, job_id: int, **values):
+        values["updated_at"] = datetime.utcnow()
+        DocumentJob.query.filter_by(id=job_id).update(values, synchronize_session=False)
+        db.session.commit()
+
+    def _run(self, job_id: int):
+        with self.app.app_context():
+            try:
+                with metrics.timer("document_job"):
+                    self._process(job_id)
+            except Exception as e:
+                db.session.rollback()
+                print(f"[DEBUG] 文档任务 {job_id} 失败: {e}")
+                self._update(job_id, status=DocumentJob.FAILED, error=str(e))
+            finally:
+                db.session.remove()
+                with self._lock:
+                    event = self._events.pop(job_id, None)
+                if event is not None:
+                    event.set()
+
+    def _parse(self, file_path: str, chunk_path: str) -> int:
+        """在全新的子进程中解析文档，不继承Web进程的线程和连接"""
+        result = subprocess.run(
+            [sys.executable, '-m', 'services.file_service', file_path, chunk_path],
+            cwd=PROJECT_ROOT,
+            capture_output=True,
+            text=True,
+            timeout=self.parse_timeout
+        )
+        if result.returncode != 0:
+            error = result.stderr.strip().splitlines()
+            raise RuntimeError(error[-1] if error else f"文档解析进程退出码 {result.returncode}")
+        return int(result.stdout.strip().splitlines()[-1])
+
+    def _process(self, job_id: int):
+        if not self._claim(job_id):
+            return
+        job = db.session.get(DocumentJob, job_id)
+        if os.path.splitext(job.file_path)[1].lower() not in SUPPORTED_SUFFIXES:
+            raise ValueError(f"不支持的文件类型：{job.filename}")
+
+        digest = job.content_hash or hash_file(job.file_path)
+        total = self.cache.lookup(digest)
+        if total is not None:
+            print(f"[DEBUG] 文档任务 {job_id} 命中分块缓存 {digest[:12]}，共 {total} 块")
+            self._update(job_id, stage="indexing", total_chunks=total)
+            processed = 0
+            for batch, vectors in self.cache.iter_batches(digest, self.batch_size):
+                self._add(job, processed, batch, vectors)
+                processed += len(batch)
+                self._update(job_id, processed_chunks=processed)
+        else:
+            self._parse_and_embed(job, digest)
+
+        self._update(job_id, status=DocumentJob.DONE, stage=None)
+
+    def _parse_and_embed(self, job: DocumentJob, digest: str):
+        """解析并向量化文档，同时写入会话记忆和按内容哈希的分块缓存"""
+        chunk_path, vectors_path = self.cache.staging_paths(digest)
+        try:
+            with metrics.timer("document_parse"):
+                total = self._parse(job.file_path, chunk_path)
+            self._update(job.id, stage="embedding", total_chunks=total)
+
+            processed = 0
+            with open(vectors_path, 'wb') as f:
+                for batch in iter_chunk_file(chunk_path, self.batch_size):
+                    vectors = self.memory.embed_fn(batch)
+                    f.write(vectors.astype('float32').tobytes())
+                    self._add(job, processed, batch, vectors)
+                    processed += len(batch)
+                    self._update(job.id, processed_chunks=processed)
+            self.cache.commit(digest, chunk_path, vectors_path, total)
+        finally:
+            self.cache.discard(chunk_path, vectors_path)
+
+    @staticmethod
+    def _labels(job: DocumentJob, offset: int, chunks) -> List[str]:
+        return [label_chunk(job.filename, offset + i, chunk) for i, chunk in enumerate(chunks, 1)]
+
+    def _add(self, job: DocumentJob, offset: int, chunks, vectors):
+        """分块加上本次上传的文件名后写入会话记忆，向量复用按原文计算的结果"""
+        self.memory.add_vectors(job.user_id, job.conversation_id, self._labels(job, offset, chunks), vectors)
+
+    def iter_indexed(self, user_id: int, conversation_id: int) -> Iterator[Tuple[List[str], np.ndarray]]:
+        """按批返回会话中已完成文档的分块及缓存的向量，用于会话记忆被淘汰后重建（不重新解析和向量化）"""
+        jobs = DocumentJob.query.filter_by(
+            user_id=user_id, conversation_id=conversation_id, status=DocumentJob.DONE
+        ).order_by(DocumentJob.id.asc()).all()
+        for job in jobs:
+            yield from self._iter_chunks(job)
+
+    def _iter_chunks(self, job: DocumentJob) -> Iterator[Tuple[List[str], np.ndarray]]:
+        """按批返回文档写入会话记忆的分块（加上文件名后的原文）及其向量"""
+        digest = job.content_hash
+        if not digest and os.path.exists(job.file_path):
+            digest = hash_file(job.file_path)
+        if not digest or self.cache.lookup(digest) is None:
+            print(f"[DEBUG] 文档 {job.filename} 的分块缓存不存在，跳过")
+            return
+        offset = 0
+        for batch, vectors in self.cache.iter_batches(digest, self.batch_size):
+            yield self._labels(job, offset, batch), vectors
+            offset += len(batch)
+
+    def delete(self, job: DocumentJob) -> int:
+        """删除已结束的文档任务，并从会话记忆中删除其分块，返回删除的分块数"""
+        # 同一会话中重复上传的同名同内容文档共用分块，仍有其他副本时保留
+        shared = DocumentJob.query.filter(
+            DocumentJob.id != job.id,
+            DocumentJob.conversation_id == job.conversation_id,
+            DocumentJob.filename == job.filename,
+            DocumentJob.content_hash == job.content_hash,
+            DocumentJob.status == DocumentJob.DONE
+        ).first() if job.content_hash else None
+        chunks = [] if shared else [text for texts, _ in self._iter_chunks(job) for text in texts]
+        user_id, conversation_id = job.user_id, job.conversation_id
+        db.session.delete(job)
+        db.session.commit()
+        # 先删除任务再删除分块，期间重建的会话记忆不会再读入该文档
+        if not chunks:
+            return 0
+        return self.memory.remove(user_id, conversation_id, chunks)
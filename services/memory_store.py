@@ -0,0 +1,527 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from .metrics import metrics
+from .vector_index import VectorIndex, normalize
+
+try:
+    import fcntl
+except ImportError:  # Windows：没有 flock，改用 msvcrt 的字节范围锁
+    fcntl = None
+    import msvcrt
+
+MemoryKey = Tuple[int, int]
+
+
+@contextmanager
+def file_lock(path: str, exclusive: bool):
+    """跨进程文件锁
+
+    POSIX 上使用 flock，支持共享锁；Windows 上用 msvcrt.locking 锁住文件的第一个字节，
+    只有独占锁（共享锁也按独占处理，只是读取时不能并发，结果相同）。
+    """
+    with open(path, 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            return
+
+        f.seek(0)
+        while True:
+            try:
+                # LK_LOCK 最多重试10秒，仍被占用时抛出 OSError，继续等待
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                break
+            except OSError:
+                continue
+        try:
+            yield
+        finally:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class ConversationMemory:
+    """单个会话的向量记忆：向量矩阵及其对应的原文
+
+    指定 path 时向量以float32追加写入 vectors.f32、原文逐行写入 texts.jsonl，
+    读取时通过内存映射加载，多个worker进程共享同一份页缓存，重启后无需重新计算向量。
+    向量写入前归一化，检索按余弦相似度；每条记录的id即其行号，只追加、不复用，
+    删除的id追加写入 deleted.ids，检索时过滤。
+    删除的记录达到 COMPACT_RATIO（且不少于 COMPACT_MIN 条）时压缩：去掉已删除的行重写文件并重建索引，
+    id随之重新编号（generation 加一），因此调用方应按原文删除，不要长期保存id。
+    """
+
+    VECTORS_FILE = 'vectors.f32'
+    TEXTS_FILE = 'texts.jsonl'
+    DELETED_FILE = 'deleted.ids'
+    INDEX_FILE = 'index.faiss'
+    GENERATION_FILE = 'generation'  # 压缩次数，其他进程据此发现文件已被重写
+    NORMALIZED_FILE = '.normalized'  # 标记向量文件已归一化（旧版本写入的是原始向量）
+    LOCK_FILE = '.lock'
+    COMPACT_RATIO = 0.2
+    COMPACT_MIN = 64
+
+    def __init__(self, dim: int, path: Optional[str] = None, index_options: Optional[dict] = None):
+        self.dim = dim
+        self.path = path
+        self.index_options = index_options or {}
+        self.lock = threading.Lock()
+        self._rebuilding = False
+        self._generation = 0
+        self._reset()
+        if path:
+            os.makedirs(path, exist_ok=True)
+            self._normalize_legacy()
+            with self.lock:
+                self._refresh()
+
+    def _reset(self):
+        """清空已读入的数据，之后从文件开头重新读取（调用方需持有 self.lock）"""
+        self.texts: List[str] = []
+        self.hashes: Dict[str, int] = {}  # 未删除记录的原文哈希 -> id
+        self.deleted = set()
+        self.vectors = np.empty((0, self.dim), dtype='float32')
+        self.index = VectorIndex(self.dim, **self.index_options)
+        self._text_bytes = 0
+        self._texts_offset = 0
+        self._vectors_size = 0
+        self._deleted_offset = 0
+
+    @staticmethod
+    def _hash(text: str) -> str:
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def __len__(self):
+        return len(self.texts)
+
+    def _file_lock(self, exclusive: bool):
+        """跨进程文件锁，保证多个worker追加写入时向量与原文一一对应"""
+        return file_lock(os.path.join(self.path, self.LOCK_FILE), exclusive)
+
+    def _normalize_legacy(self):
+        """旧版本保存的原始向量就地归一化（只执行一次）"""
+        marker = os.path.join(self.path, self.NORMALIZED_FILE)
+        if os.path.exists(marker):
+            return
+        with self._file_lock(exclusive=True):
+            if os.path.exists(marker):
+                return
+            vectors_path = os.path.join(self.path, self.VECTORS_FILE)
+            count = os.path.getsize(vectors_path) // (self.dim * 4) if os.path.exists(vectors_path) else 0
+            if count:
+                vectors = np.memmap(vectors_path, dtype='float32', mode='r+', shape=(count, self.dim))
+                for start in range(0, count, 65536):
+                    vectors[start:start + 65536] = normalize(vectors[start:start + 65536])
+                vectors.flush()
+                del vectors
+            open(marker, 'w').close()
+
+    def _read_generation(self) -> int:
+        try:
+            with open(os.path.join(self.path, self.GENERATION_FILE)) as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def _refresh(self):
+        """读取其他进程追加的数据（调用方需持有 self.lock）"""
+        with self._file_lock(exclusive=False):
+            self._refresh_locked()
+
+    def _refresh_locked(self):
+        """同 _refresh，调用方还需持有文件锁"""
+        generation = self._read_generation()
+        if generation != self._generation:
+            # 其他进程压缩了文件，id已重新编号
+            self._generation = generation
+            self._reset()
+        vectors_path = os.path.join(self.path, self.VECTORS_FILE)
+        if os.path.exists(vectors_path) and os.path.getsize(vectors_path) != self._vectors_size:
+            self._refresh_rows(vectors_path)
+        # 删除记录引用的行已在上面读入
+        self._refresh_deleted()
+
+    def _refresh_rows(self, vectors_path: str):
+        texts_path = os.path.join(self.path, self.TEXTS_FILE)
+        with open(texts_path, 'rb') as f:
+            f.seek(self._texts_offset)
+            for line in f:
+                text = json.loads(line)
+                if len(self.texts) not in self.deleted:
+                    self.hashes[self._hash(text)] = len(self.texts)
+                self.texts.append(text)
+                self._text_bytes += len(line)
+            self._texts_offset = f.tell()
+
+        self._vectors_size = os.path.getsize(vectors_path)
+        count = self._vectors_size // (self.dim * 4)
+        self.vectors = np.memmap(vectors_path, dtype='float32', mode='r', shape=(count, self.dim))
+
+    def _refresh_deleted(self):
+        """读取其他进程追加的删除记录"""
+        deleted_path = os.path.join(self.path, self.DELETED_FILE)
+        if not os.path.exists(deleted_path) or os.path.getsize(deleted_path) == self._deleted_offset:
+            return
+        with open(deleted_path, 'rb') as f:
+            f.seek(self._deleted_offset)
+            data = f.read()
+        usable = len(data) - len(data) % 8
+        self._deleted_offset += usable
+        self._mark_deleted(np.frombuffer(data[:usable], dtype='int64').tolist())
+
+    def _mark_deleted(self, ids: List[int]):
+        for i in ids:
+            if i in self.deleted:
+                continue
+            self.deleted.add(i)
+            # 其他进程刚追加、本进程尚未读入的行，在读入时跳过其哈希
+            if i < len(self.texts):
+                h = self._hash(self.texts[i])
+                # 删除后重新写入的相同原文使用新的id
+                if self.hashes.get(h) == i:
+                    del self.hashes[h]
+
+    def add(self, texts: List[str], vectors: np.ndarray) -> List[int]:
+        """追加文本及其向量，返回分配的id"""
+        vectors = normalize(np.asarray(vectors).reshape(-1, self.dim))
+        with self.lock:
+            if not self.path:
+                start = len(self.texts)
+                self.vectors = np.vstack([self.vectors, vectors])
+                self.texts.extend(texts)
+                self.hashes.update((self._hash(t), start + i) for i, t in enumerate(texts))
+                self._text_bytes += sum(len(t.encode('utf-8')) for t in texts)
+                return list(range(start, start + len(texts)))
+
+            with self._file_lock(exclusive=True):
+                # 其他进程可能刚压缩过文件，先按当前的文件重新读入，返回的id才与文件一致
+                self._refresh_locked()
+                start = len(self.texts)
+                with open(os.path.join(self.path, self.TEXTS_FILE), 'ab') as f:
+                    for text in texts:
+                        f.write(json.dumps(text, ensure_ascii=False).encode('utf-8') + b'\n')
+                with open(os.path.join(self.path, self.VECTORS_FILE), 'ab') as f:
+                    f.write(vectors.tobytes())
+                self._refresh_locked()
+            return list(range(start, start + len(texts)))
+
+    def remove(self, ids: List[int]):
+        """按id删除记录：向量和原文暂时保留在文件中，检索时不再返回；删除的记录过多时压缩"""
+        with self.lock:
+            if self.path:
+                self._refresh()
+            self._remove(ids)
+
+    def remove_texts(self, texts: List[str]) -> int:
+        """按原文删除记录，返回删除的条数"""
+        with self.lock:
+            if self.path:
+                self._refresh()
+            ids = [self.hashes[h] for h in {self._hash(t) for t in texts} if h in self.hashes]
+            return self._remove(ids)
+
+    def _remove(self, ids: List[int]) -> int:
+        """（调用方需持有 self.lock）"""
+        ids = [int(i) for i in ids if 0 <= int(i) < len(self.texts) and int(i) not in self.deleted]
+        if not ids:
+            return 0
+        if self.path:
+            with self._file_lock(exclusive=True):
+                with open(os.path.join(self.path, self.DELETED_FILE), 'ab') as f:
+                    f.write(np.asarray(ids, dtype='int64').tobytes())
+                self._refresh_locked()
+                if self._should_compact():
+                    self._compact()
+        else:
+            self._mark_deleted(ids)
+            if self._should_compact():
+                self._compact()
+        return len(ids)
+
+    def _should_compact(self) -> bool:
+        return len(self.deleted) >= max(self.COMPACT_MIN, len(self.texts) * self.COMPACT_RATIO)
+
+    def _compact(self):
+        """去掉已删除的行，重写向量和原文并丢弃旧索引（调用方需持有 self.lock，磁盘模式下还需持有写锁）"""
+        keep = [i for i in range(len(self.texts)) if i not in self.deleted]
+        texts = [self.texts[i] for i in keep]
+        vectors = np.asarray(self.vectors[keep], dtype='float32').reshape(-1, self.dim)
+        print(f"[DEBUG] 压缩会话记忆：删除 {len(self.deleted)} 条，保留 {len(keep)} 条")
+        if not self.path:
+            self._generation += 1
+            self._reset()
+            self.vectors = vectors
+            self.texts = texts
+            self.hashes = {self._hash(t): i for i, t in enumerate(texts)}
+            self._text_bytes = sum(len(t.encode('utf-8')) for t in texts)
+            return
+
+        # 先写临时文件再替换；旧文件被其他进程映射时仍然有效，直到它们读到新的 generation。
+        # 向量文件最先替换：Windows 上被映射的文件不能替换，此时放弃压缩，其余文件保持不变
+        try:
+            self._replace(self.VECTORS_FILE, vectors.tobytes())
+        except PermissionError as e:
+            print(f"[DEBUG] 向量文件正被映射，暂不压缩会话记忆: {e}")
+            return
+        self._replace(self.TEXTS_FILE, b''.join(json.dumps(t, ensure_ascii=False).encode('utf-8') + b'\n'
+                                                for t in texts))
+        self._replace(self.DELETED_FILE, b'')
+        self._replace(self.GENERATION_FILE, str(self._generation + 1).encode())
+        # 旧的索引按旧行号建立，一并删除
+        for name in os.listdir(self.path):
+            if name.startswith('index.') and name.endswith('.faiss'):
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except FileNotFoundError:
+                    pass
+        self._refresh_locked()
+
+    def _replace(self, name: str, data: bytes):
+        target = os.path.join(self.path, name)
+        tmp = f"{target}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        try:
+            os.replace(tmp, target)
+        except OSError:
+            os.remove(tmp)
+            raise
+
+    def missing(self, texts: List[str]) -> List[str]:
+        """过滤出尚未存入记忆的文本（同一会话内按内容去重）"""
+        seen = set()
+        result = []
+        with self.lock:
+            if self.path:
+                self._refresh()
+            for text in texts:
+                h = self._hash(text)
+                if h not in self.hashes and h not in seen:
+                    seen.add(h)
+                    result.append(text)
+        return result
+
+    def search_scored(self, query_vec: np.ndarray, k: int) -> List[Tuple[str, float]]:
+        """检索最相近的 k 条文本，附带与查询的余弦相似度（供提示词按相关度取舍）"""
+        with self.lock:
+            if self.path:
+                self._refresh()
+            if len(self.texts) <= len(self.deleted):
+                return []
+            self._sync_index()
+            query = normalize(np.asarray(query_vec).reshape(1, -1))
+            # 已删除的记录不超过总数的 COMPACT_RATIO，多取一倍通常就够；不足 k 条时再扩大
+            fetch = 2 * k if self.deleted else k
+            while True:
+                with metrics.timer("vector_search"):
+                    ids, scores = self.index.search(self.vectors, query, fetch)
+                results = [(self.texts[i], float(score)) for i, score in zip(ids.tolist(), scores.tolist())
+                           if i < len(self.texts) and i not in self.deleted]
+                if len(results) >= k or fetch >= len(self.vectors):
+                    return results[:k]
+                fetch *= 4
+
+    def _index_path(self) -> Optional[str]:
+        if not self.path:
+            return None
+        # 每次压缩后id重新编号，旧索引不再可用，按 generation 区分文件
+        name = self.INDEX_FILE if self._generation == 0 else f"index.{self._generation}.faiss"
+        return os.path.join(self.path, name)
+
+    def _sync_index(self):
+        """让索引覆盖全部向量（调用方需持有 self.lock）
+
+        优先读取其他进程已保存的索引；规模跨过阈值需要换用其他索引时在后台重建，
+        重建完成前继续使用当前索引（或精确检索），检索不会被建索引阻塞。
+        """
+        index_path = self._index_path()
+        if self.index.index is None and index_path and self.index.load(index_path, self.vectors):
+            return
+        if self.index.needs_rebuild(len(self.vectors)):
+            self._rebuild_in_background()
+        self.index.extend(self.vectors)
+        if index_path and self.index.index is not None:
+            self.index.save(index_path)
+
+    def _rebuild_in_background(self):
+        """基于当前的向量快照建立新索引，完成后补上期间新增的行再替换（调用方需持有 self.lock）"""
+        if self._rebuilding:
+            return
+        self._rebuilding = True
+        snapshot = self.vectors  # 只追加不修改，快照在重建期间保持有效
+        generation = self._generation
+
+        def build():
+            try:
+                index = VectorIndex(self.dim, **self.index_options)
+                with metrics.timer("vector_index_build"):
+                    index.sync(snapshot)
+                with self.lock:
+                    if self._generation != generation:
+                        return  # 重建期间记忆被压缩，快照的行号已失效
+                    index.extend(self.vectors)
+                    self.index = index
+                    if self.path:
+                        index.save(self._index_path())
+                print(f"[DEBUG] 向量索引已重建为 {index.index_kind}，共 {len(snapshot)} 条")
+            except Exception as e:
+                print(f"[DEBUG] 向量索引重建失败: {e}")
+            finally:
+                self._rebuilding = False
+
+        threading.Thread(target=build, name='vector-index-build', daemon=True).start()
+
+    def nbytes(self) -> int:
+        """估算占用内存：向量 + 原文 + 索引"""
+        return len(self.texts) * self.dim * 4 + self._text_bytes + self.index.nbytes()
+
+
+class ConversationMemoryStore:
+    """按 (user_id, conversation_id) 隔离的向量记忆缓存
+
+    每个会话拥有独立索引，互不干扰；总内存超出预算时按LRU淘汰最久未使用的整个会话索引。
+    配置了 storage_dir 时向量持久化到磁盘，再次访问直接映射已有文件；
+    否则（或磁盘上尚无数据时）通过 loader 从消息表中重新加载用户消息，并通过 document_loader
+    按批读入已完成文档的分块及缓存的向量，重建的内容与运行时写入的一致。
+    index_options 传给每个会话的 VectorIndex（索引类型及按规模切换的阈值）。
+    """
+
+    def __init__(self, embed_fn: Callable[[List[str]], np.ndarray],
+                 loader: Callable[[int, int], List[str]],
+                 dim: int = 384, max_bytes: int = 256 * 1024 * 1024,
+                 storage_dir: Optional[str] = None, index_options: Optional[dict] = None,
+                 document_loader: Optional[Callable[[int, int], Iterable[Tuple[List[str], np.ndarray]]]] = None):
+        self.embed_fn = embed_fn
+        self.loader = loader
+        self.document_loader = document_loader
+        self.dim = dim
+        self.max_bytes = max_bytes
+        self.storage_dir = storage_dir
+        self.index_options = index_options or {}
+        self._memories: "OrderedDict[MemoryKey, ConversationMemory]" = OrderedDict()
+        self._sizes: Dict[MemoryKey, int] = {}
+        self._lock = threading.Lock()
+
+    def _path(self, key: MemoryKey) -> Optional[str]:
+        if not self.storage_dir:
+            return None
+        return os.path.join(self.storage_dir, str(key[0]), str(key[1]))
+
+    def get(self, user_id: int, conversation_id: int) -> ConversationMemory:
+        key = (user_id, conversation_id)
+        with self._lock:
+            memory = self._memories.get(key)
+            if memory is not None:
+                self._memories.move_to_end(key)
+                return memory
+
+        # 缓存未命中时在锁外加载或重建，避免阻塞其他会话
+        memory = ConversationMemory(self.dim, self._path(key), self.index_options)
+        if len(memory) == 0:
+            history = memory.missing([t for t in self.loader(user_id, conversation_id) if t and t.strip()])
+            if history:
+                memory.add(history, self.embed_fn(history))
+            if self.document_loader:
+                for texts, vectors in self.document_loader(user_id, conversation_id):
+                    self._add_new(memory, texts, vectors)
+
+        with self._lock:
+            # 并发重建时保留先写入的那一份
+            existing = self._memories.get(key)
+            if existing is not None:
+                self._memories.move_to_end(key)
+                return existing
+            self._memories[key] = memory
+            self._sizes[key] = memory.nbytes()
+            self._evict(keep=key)
+        return memory
+
+    def add(self, user_id: int, conversation_id: int, texts: List[str]) -> List[int]:
+        """写入文本，已存在的跳过；返回新写入记录的id"""
+        memory = self.get(user_id, conversation_id)
+        new_texts = memory.missing([t for t in texts if t and t.strip()])
+        if not new_texts:
+            return []
+        ids = memory.add(new_texts, self.embed_fn(new_texts))
+        self._touch((user_id, conversation_id), memory)
+        return ids
+
+    def add_vectors(self, user_id: int, conversation_id: int, texts: List[str], vectors: np.ndarray) -> List[int]:
+        """写入已计算好向量的文本（如缓存的文档分块），不再调用 embed_fn"""
+        memory = self.get(user_id, conversation_id)
+        ids = self._add_new(memory, texts, vectors)
+        if ids:
+            self._touch((user_id, conversation_id), memory)
+        return ids
+
+    @staticmethod
+    def _add_new(memory: ConversationMemory, texts: List[str], vectors: np.ndarray) -> List[int]:
+        positions = {}
+        for i, text in enumerate(texts):
+            positions.setdefault(text, i)
+        new_texts = memory.missing([t for t in texts if t and t.strip()])
+        if not new_texts:
+            return []
+        return memory.add(new_texts, np.asarray(vectors)[[positions[t] for t in new_texts]])
+
+    def remove(self, user_id: int, conversation_id: int, texts: List[str]) -> int:
+        """按原文删除记录（如删除文档时删除其分块），返回删除的条数"""
+        memory = self.get(user_id, conversation_id)
+        removed = memory.remove_texts(texts)
+        if removed:
+            self._touch((user_id, conversation_id), memory)
+        return removed
+
+    def search_scored(self, user_id: int, conversation_id: int, query_vec: np.ndarray,
+                      k: int = 3) -> List[Tuple[str, float]]:
+        memory = self.get(user_id, conversation_id)
+        size = memory.nbytes()
+        results = memory.search_scored(query_vec, k)
+        # 检索时可能新建了索引，按新的占用重新计算预算
+        if memory.nbytes() != size:
+            self._touch((user_id, conversation_id), memory)
+        return results
+
+    def drop(self, user_id: int, conversation_id: int):
+        """删除会话时一并释放其记忆及磁盘文件"""
+        key = (user_id, conversation_id)
+        with self._lock:
+            self._memories.pop(key, None)
+            self._sizes.pop(key, None)
+        path = self._path(key)
+        if path:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            return sum(self._sizes.values())
+
+    def _touch(self, key: MemoryKey, memory: ConversationMemory):
+        with self._lock:
+            if key not in self._memories:
+                return
+            self._sizes[key] = memory.nbytes()
+            self._memories.move_to_end(key)
+            self._evict(keep=key)
+
+    def _evict(self, keep: Optional[MemoryKey] = None):
+        """超出预算时淘汰最久未使用的会话索引（调用方需持有锁）"""
+        total = sum(self._sizes.values())
+        while total > self.max_bytes and len(self._memories) > 1:
+            key = next(iter(self._memories))
+            if key == keep:
+                break
+            self._memories.pop(key)
+            total -= self._sizes.pop(key, 0)
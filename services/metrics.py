@@ -0,0 +1,190 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from flask import g, has_app_context
+from sqlalchemy import event
+
+# 各阶段耗时直方图的桶（秒），覆盖毫秒级的向量检索到分钟级的文档解析
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# 生成速度直方图的桶（token/秒）
+RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 400)
+
+# 采集函数返回的样本：(指标名, 类型, 说明, 标签, 值)
+Sample = Tuple[str, str, str, Dict[str, str], float]
+
+_NULL_TIMER = nullcontext()
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    escaped = (f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+               for k, v in sorted(labels.items()))
+    return '{' + ','.join(escaped) + '}'
+
+
+class Histogram:
+    """按标签分组的累计直方图"""
+
+    def __init__(self, name: str, help_text: str, buckets: Iterable[float], label: str):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.label = label
+        self._series: Dict[str, List] = {}  # 标签值 -> [各桶计数, 总和, 次数]
+
+    def observe(self, key: str, value: float):
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[0][index] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels({self.label: key, "le": f"{bound:g}"})
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels({self.label: key, 'le': '+Inf'})} {count}")
+            lines.append(f"{self.name}_sum{_format_labels({self.label: key})} {total:.6f}")
+            lines.append(f"{self.name}_count{_format_labels({self.label: key})} {count}")
+        return lines
+
+
+class Metrics:
+    """进程内的指标收集，以Prometheus文本格式输出
+
+    - observe / timer 记录各阶段耗时到 llmwebui_stage_seconds 直方图；在请求上下文中同时记入
+      flask.g，用于生成 Server-Timing 响应头
+    - record_generation 记录Ollama返回的 prompt_eval / eval 计数和耗时
+    - 队列长度、缓存命中率等状态量由注册的采集函数在抓取时读取，平时没有开销
+    关闭（enabled=False）时各记录方法直接返回。
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.stages = Histogram('llmwebui_stage_seconds', '各处理阶段耗时（秒）', STAGE_BUCKETS, 'stage')
+        self.token_rate = Histogram('llmwebui_ollama_tokens_per_second', 'Ollama生成速度（eval_count/eval_duration）',
+                                    RATE_BUCKETS, 'model')
+        self._counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        self._counter_help: Dict[str, str] = {}
+        self._collectors: List[Callable[[], Iterable[Sample]]] = []
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.stages.observe(stage, seconds)
+        self.add_timing(stage, seconds)
+
+    def add_timing(self, stage: str, seconds: float):
+        """只记入当前请求的 Server-Timing（用于在线程池中执行、已计入直方图的阶段）"""
+        if self.enabled and has_app_context():
+            g.setdefault('server_timing', []).append((stage, seconds))
+
+    def timer(self, stage: str):
+        """计时上下文；关闭时返回空上下文"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return self._timed(stage)
+
+    @contextmanager
+    def _timed(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def inc(self, name: str, value: float = 1, help_text: str = '', **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+            if help_text:
+                self._counter_help.setdefault(name, help_text)
+
+    def record_generation(self, model: str, result: dict):
+        """记录Ollama最后一个响应块中的统计字段（时长单位为纳秒）"""
+        if not self.enabled:
+            return
+        if result.get("prompt_eval_duration"):
+            self.observe("ollama_prefill", result["prompt_eval_duration"] / 1e9)
+        if result.get("eval_duration"):
+            self.observe("ollama_generation", result["eval_duration"] / 1e9)
+            if result.get("eval_count"):
+                with self._lock:
+                    self.token_rate.observe(model, result["eval_count"] / (result["eval_duration"] / 1e9))
+        self.inc('llmwebui_ollama_tokens_total', result.get("prompt_eval_count", 0),
+                 'Ollama处理的token数', model=model, kind='prompt')
+        self.inc('llmwebui_ollama_tokens_total', result.get("eval_count", 0),
+                 'Ollama处理的token数', model=model, kind='eval')
+
+    def watch_commits(self, session_cls):
+        """记录每次 session.commit()（含flush）的耗时"""
+        @event.listens_for(session_cls, 'before_commit')
+        def before_commit(session):
+            if self.enabled:
+                session.info['commit_started'] = time.perf_counter()
+
+        @event.listens_for(session_cls, 'after_commit')
+        def after_commit(session):
+            started = session.info.pop('commit_started', None)
+            if started is not None:
+                self.observe('db_commit', time.perf_counter() - started)
+
+        @event.listens_for(session_cls, 'after_rollback')
+        def after_rollback(session):
+            session.info.pop('commit_started', None)
+
+    def register(self, collector: Callable[[], Iterable[Sample]]):
+        """注册状态量采集函数，在每次抓取 /metrics 时调用"""
+        self._collectors.append(collector)
+
+    def server_timing(self) -> str:
+        """当前请求各阶段耗时的 Server-Timing 头，同名阶段合并"""
+        totals: Dict[str, float] = {}
+        for stage, seconds in g.get('server_timing', []):
+            totals[stage] = totals.get(stage, 0.0) + seconds
+        return ', '.join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in totals.items())
+
+    def render(self) -> str:
+        with self._lock:
+            lines = self.stages.render() + self.token_rate.render()
+            counters = dict(self._counters)
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f"# HELP {name} {self._counter_help.get(name, name)}")
+            lines.append(f"# TYPE {name} counter")
+            for (counter_name, labels), value in sorted(counters.items()):
+                if counter_name == name:
+                    lines.append(f"{name}{_format_labels(dict(labels))} {value:g}")
+
+        samples: Dict[str, List[Sample]] = {}
+        for collector in self._collectors:
+            try:
+                for sample in collector():
+                    samples.setdefault(sample[0], []).append(sample)
+            except Exception as e:
+                print(f"[DEBUG] 指标采集失败: {e}")
+        for name, group in samples.items():
+            _, kind, help_text, _, _ = group[0]
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for _, _, _, labels, value in group:
+                lines.append(f"{name}{_format_labels(labels)} {value:g}")
+        return '\n'.join(lines) + '\n'
+
+
+# 进程内共享的指标实例，各服务直接记录
+metrics = Metrics()
@@ -0,0 +1,387 @@
+import threading
+import time
+import asyncio
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import requests
+
+from .http_client import CircuitBreaker, async_timeout, create_async_client, create_session
+
+
+class NoBackendAvailable(RuntimeError):
+    """没有可用（未熔断且提供所需模型）的Ollama实例"""
+
+
+class BackendBusy(RuntimeError):
+    """所有可用实例的并发都已占满，且等待超时"""
+
+
+def _normalize_model(name: str) -> str:
+    # Ollama 中不带标签的模型名等同于 :latest
+    return name if ':' in name else f"{name}:latest"
+
+
+class OllamaBackend:
+    """单个Ollama实例：独立的连接池、熔断器和并发上限"""
+
+    def __init__(self, url: str, max_concurrency: int = 4, pool_size: int = 10, max_retries: int = 2):
+        self.url = url.rstrip('/')
+        self.max_concurrency = max_concurrency
+        self.session = create_session(pool_size=max(pool_size, max_concurrency), max_retries=max_retries)
+        self.breaker = CircuitBreaker(self.check_connection, name=f'ollama@{self.url}')
+        self.models: Optional[set] = None  # 由 /api/tags 获得，未知时视为提供所有模型
+        self.missing_models = set()  # 请求时返回404的模型
+        self.outstanding = 0  # 正在处理的请求数（由 OllamaPool 在锁内维护）
+        self.requests = 0
+        self.failures = 0  # 由 OllamaPool 在锁内维护
+
+    def check_connection(self) -> bool:
+        """检查实例是否可用并更新其模型列表（供熔断器后台探测使用）"""
+        try:
+            response = self.session.get(f"{self.url}/api/tags", timeout=5)
+            if response.status_code != 200:
+                return False
+            self.models = {_normalize_model(m['name']) for m in response.json().get('models', []) if m.get('name')}
+            self.missing_models -= self.models
+            return True
+        except (requests.exceptions.RequestException, ValueError):
+            return False
+
+    def serves(self, model: Optional[str]) -> bool:
+        if not model:
+            return True
+        model = _normalize_model(model)
+        if model in self.missing_models:
+            return False
+        return self.models is None or model in self.models
+
+    def stats(self) -> dict:
+        return {
+            "url": self.url,
+            "available": self.breaker.available,
+            "outstanding": self.outstanding,
+            "max_concurrency": self.max_concurrency,
+            "requests": self.requests,
+            "failures": self.failures,
+            "models": sorted(self.models) if self.models is not None else None
+        }
+
+
+class OllamaPool:
+    """多个Ollama实例组成的后端池
+
+    - 按当前未完成请求数占并发上限的比例选择最空闲的实例（least outstanding requests）
+    - 每个实例的并发不超过其上限，全部占满时排队等待，超过 acquire_timeout 则放弃
+    - 连接失败、5xx 以及模型不存在（404）时换下一个实例重试；流式请求只在收到响应前切换；
+      读超时说明实例仍在生成，不换实例重试，也不计入熔断
+    - 各实例有独立熔断器，熔断的实例不再分配请求，由后台探测恢复
+    """
+
+    def __init__(self, backends: Sequence[OllamaBackend], acquire_timeout: float = 30):
+        if not backends:
+            raise ValueError("至少需要一个Ollama实例")
+        self.backends = list(backends)
+        self.acquire_timeout = acquire_timeout
+        self._cond = threading.Condition()
+        self._discovered = False
+
+    @classmethod
+    def from_spec(cls, spec: str, max_concurrency: int = 4, pool_size: int = 10,
+                  max_retries: int = 2, acquire_timeout: float = 30) -> "OllamaPool":
+        """由逗号分隔的地址列表创建，单个实例的并发上限可写在地址后，如
+        http://gpu1:11434=8,http://gpu2:11434=2
+        """
+        backends = []
+        for item in spec.split(','):
+            item = item.strip()
+            if not item:
+                continue
+            url, _, limit = item.partition('=')
+            backends.append(OllamaBackend(url, int(limit) if limit else max_concurrency, pool_size, max_retries))
+        return cls(backends, acquire_timeout)
+
+    @property
+    def available(self) -> bool:
+        return any(b.breaker.available for b in self.backends)
+
+    def check_connection(self) -> bool:
+        """探测所有实例并刷新模型列表，返回是否至少有一个实例可用"""
+        results = [b.check_connection() for b in self.backends]
+        return any(results)
+
+    def discover_async(self):
+        """在后台获取各实例提供的模型（仅首次调用时执行）"""
+        if self._discovered:
+            return
+        self._discovered = True
+        threading.Thread(target=self.check_connection, name='ollama-discover', daemon=True).start()
+
+    def stats(self) -> List[dict]:
+        with self._cond:
+            return [b.stats() for b in self.backends]
+
+    def _choose(self, model: Optional[str], exclude: Sequence[OllamaBackend]) -> Optional[OllamaBackend]:
+        """选出最空闲的实例（调用方需持有锁）；有候选但都已占满时返回 None"""
+        candidates = [b for b in self.backends
+                      if b not in exclude and b.breaker.available and b.serves(model)]
+        if not candidates:
+            raise NoBackendAvailable(f"没有可用的Ollama服务（模型 {model}）")
+        free = [b for b in candidates if b.outstanding < b.max_concurrency]
+        if not free:
+            return None
+        return min(free, key=lambda b: (b.outstanding / b.max_concurrency, b.outstanding))
+
+    def _lease(self, model: Optional[str], exclude: Sequence[OllamaBackend]) -> OllamaBackend:
+        """占用一个实例的一个并发名额，全部占满时等待"""
+        deadline = time.monotonic() + self.acquire_timeout
+        with self._cond:
+            while True:
+                backend = self._choose(model, exclude)
+                if backend is not None:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise BackendBusy("Ollama服务繁忙，请稍后再试")
+                self._cond.wait(remaining)
+            backend.outstanding += 1
+            backend.requests += 1
+        return backend
+
+    def _release(self, backend: OllamaBackend):
+        with self._cond:
+            backend.outstanding -= 1
+            self._cond.notify_all()
+
+    @staticmethod
+    def _classify(error: Exception) -> Tuple[Optional[int], bool]:
+        """返回 (HTTP状态码, 是否连接失败)
+
+        读超时不算连接失败：实例仍在生成（如长回答、预填充慢），换实例重试只会重复生成，
+        也不应让健康但繁忙的实例熔断；连接超时（ConnectTimeout）属于 ConnectionError，仍计为连接失败。
+        """
+        if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+            return error.response.status_code, False
+        return None, isinstance(error, requests.exceptions.ConnectionError)
+
+    @staticmethod
+    def _retryable_failure(status: Optional[int], transport_error: bool) -> bool:
+        """连接失败，或收到响应体之前返回5xx/404时换实例重试；其他错误（如读超时）只影响本次请求"""
+        if transport_error:
+            return True
+        return status is not None and (status >= 500 or status == 404)
+
+    def _retryable(self, error: Exception) -> bool:
+        return self._retryable_failure(*self._classify(error))
+
+    def _record(self, backend: OllamaBackend, model: Optional[str], error: Exception = None):
+        if error is None:
+            backend.breaker.record_success()
+            return
+        self._record_failure(backend, model, *self._classify(error))
+
+    def _record_failure(self, backend: OllamaBackend, model: Optional[str], status: Optional[int],
+                        transport_error: bool):
+        """根据失败类型更新实例的熔断器：连接失败和5xx计为实例故障，404记为该实例缺少模型，读超时只计入失败次数"""
+        # 计数和模型列表与 outstanding 一样在池的锁内修改，stats() 和选择实例时读到一致的值
+        with self._cond:
+            backend.failures += 1
+            if status == 404 and model:
+                backend.missing_models.add(_normalize_model(model))
+        if (status is not None and status >= 500) or transport_error:
+            backend.breaker.record_failure()
+
+    def _try_lease(self, model: Optional[str], exclude: Sequence[OllamaBackend]) -> Optional[OllamaBackend]:
+        """不等待地占用一个实例的并发名额，全部占满时返回 None"""
+        with self._cond:
+            backend = self._choose(model, exclude)
+            if backend is not None:
+                backend.outstanding += 1
+                backend.requests += 1
+            return backend
+
+    def post(self, path: str, payload: dict, timeout=30) -> requests.Response:
+        """发送非流式请求，失败时切换实例重试"""
+        model = payload.get("model")
+        tried: List[OllamaBackend] = []
+        last_error = None
+        while True:
+            try:
+                backend = self._lease(model, tried)
+            except NoBackendAvailable:
+                raise last_error or NoBackendAvailable(f"没有可用的Ollama服务（模型 {model}）")
+            try:
+                tried.append(backend)
+                try:
+                    response = backend.session.post(f"{backend.url}{path}", json=payload, timeout=timeout)
+                    response.raise_for_status()
+                except Exception as e:
+                    self._record(backend, model, e)
+                    if not self._retryable(e):
+                        raise
+                    print(f"[DEBUG] {backend.url} 请求失败，尝试其他实例: {e}")
+                    last_error = e
+                    continue
+                self._record(backend, model)
+                return response
+            finally:
+                self._release(backend)
+
+    @contextmanager
+    def stream(self, path: str, payload: dict, timeout=(5, 60)) -> Iterator[requests.Response]:
+        """发送流式请求，在整个读取过程中占用实例；只在收到响应前切换实例"""
+        model = payload.get("model")
+        tried: List[OllamaBackend] = []
+        last_error = None
+        while True:
+            try:
+                backend = self._lease(model, tried)
+            except NoBackendAvailable:
+                raise last_error or NoBackendAvailable(f"没有可用的Ollama服务（模型 {model}）")
+            try:
+                tried.append(backend)
+                try:
+                    response = backend.session.post(f"{backend.url}{path}", json=payload, stream=True,
+                                                    timeout=timeout)
+                    response.raise_for_status()
+                except Exception as e:
+                    self._record(backend, model, e)
+                    if not self._retryable(e):
+                        raise
+                    print(f"[DEBUG] {backend.url} 请求失败，尝试其他实例: {e}")
+                    last_error = e
+                    continue
+                self._record(backend, model)
+                with response:
+                    try:
+                        yield response
+                    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                        # 输出过程中断开，已发给客户端的内容无法撤回，不再切换实例
+                        self._record(backend, model, e)
+                        raise
+                return
+            finally:
+                self._release(backend)
+
+
+class AsyncOllamaPool:
+    """OllamaPool 的异步接口（ASGI模式使用）
+
+    与同步接口共享实例选择、并发名额和熔断状态；等待名额和读取输出都不占用线程，
+    一个进程可以同时挂起大量等待生成的请求。
+    """
+
+    def __init__(self, pool: OllamaPool, pool_size: int = 100, max_retries: int = 2):
+        self.pool = pool
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self._clients: Dict[str, object] = {}
+
+    def _client(self, backend: OllamaBackend):
+        client = self._clients.get(backend.url)
+        if client is None:
+            client = self._clients[backend.url] = create_async_client(self.pool_size, self.max_retries)
+        return client
+
+    async def _lease(self, model: Optional[str], exclude: Sequence[OllamaBackend]) -> OllamaBackend:
+        """占用一个实例的并发名额，全部占满时以递增的间隔重试，不阻塞事件循环"""
+        deadline = time.monotonic() + self.pool.acquire_timeout
+        delay = 0.01
+        while True:
+            backend = self.pool._try_lease(model, exclude)
+            if backend is not None:
+                return backend
+            if time.monotonic() >= deadline:
+                raise BackendBusy("Ollama服务繁忙，请稍后再试")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.2)
+
+    @staticmethod
+    def _classify(error: Exception) -> Tuple[Optional[int], bool]:
+        import httpx
+
+        if isinstance(error, httpx.HTTPStatusError):
+            return error.response.status_code, False
+        # 与同步接口一致：读写超时不算连接失败，连接超时算
+        if isinstance(error, httpx.TimeoutException):
+            return None, isinstance(error, httpx.ConnectTimeout)
+        return None, isinstance(error, httpx.TransportError)
+
+    async def post(self, path: str, payload: dict, timeout=30) -> dict:
+        """发送非流式请求并返回解析后的JSON，失败时切换实例重试"""
+        model = payload.get("model")
+        tried: List[OllamaBackend] = []
+        last_error = None
+        while True:
+            try:
+                backend = await self._lease(model, tried)
+            except NoBackendAvailable:
+                raise last_error or NoBackendAvailable(f"没有可用的Ollama服务（模型 {model}）")
+            try:
+                tried.append(backend)
+                try:
+                    response = await self._client(backend).post(f"{backend.url}{path}", json=payload,
+                                                                timeout=async_timeout(timeout))
+                    response.raise_for_status()
+                except Exception as e:
+                    status, transport_error = self._classify(e)
+                    self.pool._record_failure(backend, model, status, transport_error)
+                    if not self.pool._retryable_failure(status, transport_error):
+                        raise
+                    print(f"[DEBUG] {backend.url} 请求失败，尝试其他实例: {e}")
+                    last_error = e
+                    continue
+                backend.breaker.record_success()
+                return response.json()
+            finally:
+                self.pool._release(backend)
+
+    @asynccontextmanager
+    async def stream(self, path: str, payload: dict, timeout=(5, 60)) -> AsyncIterator[AsyncIterator[str]]:
+        """发送流式请求，产出逐行读取的迭代器；只在收到响应前切换实例"""
+        import httpx
+
+        model = payload.get("model")
+        tried: List[OllamaBackend] = []
+        last_error = None
+        while True:
+            try:
+                backend = await self._lease(model, tried)
+            except NoBackendAvailable:
+                raise last_error or NoBackendAvailable(f"没有可用的Ollama服务（模型 {model}）")
+            try:
+                tried.append(backend)
+                client = self._client(backend)
+                request = client.build_request("POST", f"{backend.url}{path}", json=payload,
+                                               timeout=async_timeout(timeout))
+                response = None
+                try:
+                    response = await client.send(request, stream=True)
+                    response.raise_for_status()
+                except Exception as e:
+                    if response is not None:
+                        await response.aclose()
+                    status, transport_error = self._classify(e)
+                    self.pool._record_failure(backend, model, status, transport_error)
+                    if not self.pool._retryable_failure(status, transport_error):
+                        raise
+                    print(f"[DEBUG] {backend.url} 请求失败，尝试其他实例: {e}")
+                    last_error = e
+                    continue
+                backend.breaker.record_success()
+                try:
+                    yield response.aiter_lines()
+                except httpx.TransportError as e:
+                    # 输出过程中断开，已发给客户端的内容无法撤回，不再切换实例
+                    self.pool._record_failure(backend, model, *self._classify(e))
+                    raise
+                finally:
+                    await response.aclose()
+                return
+            finally:
+                self.pool._release(backend)
+
+    async def aclose(self):
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
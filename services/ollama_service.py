@@ -1,106 +1,553 @@
-import requests
-from typing import List, Dict
-from pathlib import Path
-import hashlib
+import asyncio
+import json
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import AsyncIterator, List, Dict, Iterator, Optional, Tuple
+from flask import current_app, has_app_context
 import numpy as np
-import faiss
-from PyPDF2 import PdfReader
-from docx import Document
-from sentence_transformers import SentenceTransformer
+from .embedding_service import EmbeddingService
+from .blob_store import DocumentCache
+from .job_service import DocumentJobQueue
+from .prompt_builder import PromptBuilder, TokenCounter
+from .response_cache import ResponseCache
+from .ollama_pool import AsyncOllamaPool, OllamaPool
+from .memory_store import ConversationMemoryStore
+from .metrics import metrics
 from .searxng_service import SearXNGService
-from models.message import Message
-from models.user import db
+from .summary_service import ConversationSummarizer
+from models.document import DocumentJob
+from models.message import ConversationThread, Message
 
 
 class OllamaService:
-    def __init__(self, base_url: str = "http://localhost:11434"):
-        self.base_url = base_url
+    PARALLEL_STAGES = 2  # 每个生成请求同时在线程池中执行的预处理阶段数（搜索、检索）
+
+    def __init__(self, base_url: str = "http://localhost:11434", memory_budget_mb: int = 256,
+                 vector_store_dir: str = None, document_cache_dir: str = 'document_cache',
+                 tokenizer_name: str = None, prompt_budget: int = None, pipeline_workers: int = None,
+                 max_active: int = 8, background_workers: int = 2,
+                 pool_size: int = 10, max_retries: int = 2, backend_concurrency: int = 4,
+                 models: List[str] = None, response_cache: dict = None,
+                 search_url: str = "http://localhost:8080", vector_index: dict = None, summary: dict = None):
+        # base_url 可以是逗号分隔的多个Ollama实例，请求分配给最空闲的实例，失败时切换；
+        # 每个实例复用keep-alive连接，并有独立的熔断器，生成前不再额外请求一次健康检查
+        self.pool = OllamaPool.from_spec(base_url, max_concurrency=backend_concurrency,
+                                         pool_size=pool_size, max_retries=max_retries)
+        self._pool_options = {"pool_size": pool_size, "max_retries": max_retries}
+        self._async_pool = None  # ASGI模式下使用的非阻塞客户端，首次使用时创建
+        self.app = None  # 在没有应用上下文的协程中提交预处理阶段时使用
+        self.model = "deepseek-r1:1.5b"
+        # 请求可选择的模型，第一个为默认模型
+        self.models = list(models) if models else [self.model]
+        self.model = self.models[0]
+        self.stream_read_timeout = 60  # 流式响应中两段输出之间的最长等待时间（秒）
         self.context_window = 8192  # 扩大上下文窗口
-        self.max_context_items = 10  # 新增最大上下文条目限制
-        self.conversation_history: List[Dict] = []
-        self.searxng = SearXNGService()
+        self.max_context_items = 10  # 新增最大上下文条目限制（提示词中最多保留的最近对话条数）
+        self.response_reserve = 1024  # 上下文窗口中为模型回答预留的token数
+        self.retrieval_k = 5  # 每轮从会话记忆中检索的条目数（历史消息与文档分块）
+        self.searxng = SearXNGService(search_url, pool_size=pool_size, max_retries=max_retries)
+
+        # 生成前的预处理阶段并行执行，各阶段的截止时间（秒），从请求开始计算。
+        # 检索可能等待文档索引数秒，线程数按同时生成的请求数（max_active）乘阶段数确定，
+        # 避免阶段在队列中排队时就已超过截止时间、上下文被静默丢弃
+        self.executor = ThreadPoolExecutor(max_workers=pipeline_workers or max_active * self.PARALLEL_STAGES,
+                                           thread_name_prefix='pipeline')
+        # 写入会话记忆、回答缓存等不影响当前请求的工作使用单独的线程池，不占用有截止时间的阶段
+        self.background = ThreadPoolExecutor(max_workers=background_workers, thread_name_prefix='pipeline-bg')
+        self.stage_timeouts = {
+            "file": 5,  # 等待上传文档索引完成的时间，超时后文档继续在后台处理
+            "search": 3,
+            "retrieval": 10,
+        }
+
+        # 初始化向量数据库（向量化请求会被合并成小批量并按内容缓存）
+        self.embedder = EmbeddingService('paraphrase-multilingual-MiniLM-L12-v2', dim=384)
+        # 每个会话独立的向量记忆，超出内存预算时按LRU淘汰整个会话索引
+        self.memory = ConversationMemoryStore(
+            embed_fn=self._generate_embeddings,
+            loader=self._load_history,
+            document_loader=self._load_documents,
+            dim=self.embedder.dim,  # 匹配模型维度
+            max_bytes=memory_budget_mb * 1024 * 1024,
+            storage_dir=vector_store_dir,  # 向量持久化目录，为空时仅保存在内存中
+            index_options=vector_index  # 索引类型及按规模切换的阈值，见 VectorIndex
+        )
+        # 相同问题的回答缓存（默认关闭），参数见 ResponseCache
+        self.response_cache = ResponseCache(self._generate_embeddings, **(response_cache or {}))
+        # 提示词按token预算组装，默认为上下文窗口减去回答预留
+        self.prompt_builder = PromptBuilder(
+            TokenCounter(tokenizer_name),
+            budget=prompt_budget or self.context_window - self.response_reserve
+        )
+        # 上传文档在后台解析、分块并写入会话记忆，分块和向量按文档内容哈希缓存
+        self.documents = DocumentJobQueue(self.memory, DocumentCache(document_cache_dir, dim=self.embedder.dim))
+        # 较早的消息在后台合并成滚动摘要，并为新会话生成标题，参数见 ConversationSummarizer
+        self.summaries = ConversationSummarizer(self._complete, keep_recent=self.max_context_items, **(summary or {}))
+
+    def init_app(self, app):
+        self.app = app
+        self.documents.init_app(app)
+        self.summaries.init_app(app)
 
-        # 初始化向量数据库
-        self.embedder = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
-        self.index = faiss.IndexFlatL2(384)  # 匹配模型维度
-        self.context_vectors = []
+    @property
+    def async_pool(self) -> AsyncOllamaPool:
+        """与 self.pool 共享实例选择、并发限制和熔断状态的异步客户端"""
+        if self._async_pool is None or self._async_pool.pool is not self.pool:
+            self._async_pool = AsyncOllamaPool(self.pool, **self._pool_options)
+        return self._async_pool
+
+    async def aclose(self):
+        """关闭异步客户端的连接（ASGI应用退出时调用）"""
+        if self._async_pool is not None:
+            await self._async_pool.aclose()
+        await self.searxng.aclose()
 
     def check_connection(self) -> bool:
-        """检查Ollama服务是否可用"""
-        try:
-            response = requests.get(f"{self.base_url}/", timeout=5)
-            return response.status_code == 200
-        except requests.exceptions.RequestException:
-            return False
+        """检查是否至少有一个Ollama实例可用，同时刷新各实例提供的模型"""
+        return self.pool.check_connection()
 
     def _generate_embedding(self, text: str) -> np.ndarray:
         return self.embedder.encode([text])[0]
 
-    def _update_vector_db(self, text: str):
-        vector = self._generate_embedding(text).reshape(1, -1)
-        self.index.add(vector)
-        self.context_vectors.append(text)
+    def _generate_embeddings(self, texts: List[str]) -> np.ndarray:
+        return self.embedder.encode(texts)
+
+    @staticmethod
+    def _load_history(user_id: int, conversation_id: int) -> List[str]:
+        """缓存未命中时从消息表加载用户消息，用于重建向量记忆（与运行时一样只写入用户的提问，不含回答）"""
+        messages = Message.query.with_entities(Message.content).filter_by(
+            user_id=user_id,
+            conversation_id=conversation_id,
+            is_user=True
+        ).order_by(Message.timestamp.asc()).all()
+        return [m.content for m in messages]
 
-    def _get_relevant_context(self, query: str, k: int = 3) -> List[str]:
-        query_vec = self._generate_embedding(query).reshape(1, -1)
-        _, indices = self.index.search(query_vec, k)
-        return [self.context_vectors[i] for i in indices[0] if i < len(self.context_vectors)]
+    def _load_documents(self, user_id: int, conversation_id: int):
+        """重建向量记忆时读入已完成文档的分块（向量来自分块缓存）"""
+        return self.documents.iter_indexed(user_id, conversation_id)
 
-    def _manage_context(self, new_message: str):
-        self._update_vector_db(new_message)
-        if len(self.context_vectors) > 20:
-            self.index.remove_ids(np.array([0]))
-            self.context_vectors.pop(0)
+    @staticmethod
+    def _load_summary(user_id: int, conversation_id: int) -> Tuple[str, int]:
+        """返回 (会话摘要, 摘要之后的消息数)"""
+        thread = ConversationThread.query.with_entities(
+            ConversationThread.summary, ConversationThread.summary_message_count, ConversationThread.message_count
+        ).filter_by(id=conversation_id, user_id=user_id).first()
+        if thread is None or not thread.summary:
+            return "", 0
+        return thread.summary, thread.message_count - thread.summary_message_count
 
-    def process_file(self, file_path: Path):
+    @staticmethod
+    def _load_recent_turns(user_id: int, conversation_id: int, limit: int) -> List[Tuple[str, bool]]:
+        """按时间顺序返回最近 limit 条消息的 (内容, 是否用户消息)"""
+        messages = Message.query.with_entities(Message.content, Message.is_user).filter_by(
+            user_id=user_id,
+            conversation_id=conversation_id
+        ).order_by(Message.timestamp.desc(), Message.id.desc()).limit(limit).all()
+        return [(m.content, m.is_user) for m in reversed(messages)]
+
+    def _get_relevant_context(self, user_id: int, conversation_id: int, query: str,
+                              k: int = 3) -> List[Tuple[str, float]]:
+        query_vec = self._generate_embedding(query)
+        return self.memory.search_scored(user_id, conversation_id, query_vec, k)
+
+    def _search(self, query: str) -> List[Tuple[str, float]]:
+        """网络搜索，每条结果附带与问题的余弦相似度，与记忆检索结果按同一标准取舍"""
+        return self._score_snippets(query, self.searxng.get_search_snippets(query))
+
+    async def _asearch(self, query: str, timings: Dict[str, float]) -> List[Tuple[str, float]]:
+        """_search 的异步版本：搜索请求不占用线程，向量化在线程池中执行"""
+        start = time.perf_counter()
         try:
-            if file_path.suffix.lower() == '.pdf':
-                with open(file_path, 'rb') as f:
-                    reader = PdfReader(f)
-                    text_content = "\n".join([page.extract_text() for page in reader.pages])
+            snippets = await self.searxng.aget_search_snippets(query)
+            if not snippets:
+                return []
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, self._score_snippets, query, snippets)
+        finally:
+            elapsed = time.perf_counter() - start
+            timings["search"] = round(elapsed * 1000, 1)
+            metrics.observe(self._stage_metric("search"), elapsed)
+
+    def _score_snippets(self, query: str, snippets: List[str]) -> List[Tuple[str, float]]:
+        if not snippets:
+            return []
+        vectors = self._generate_embeddings([query] + snippets)
+        norms = np.linalg.norm(vectors, axis=1)
+        norms[norms == 0] = 1.0
+        scores = vectors[1:] @ vectors[0] / (norms[1:] * norms[0])
+        return list(zip(snippets, scores.tolist()))
+
+    def _document_note(self, document_job_id: int, user_id: int) -> str:
+        """等待上传文档短暂处理，返回给模型的文件说明；大文件不阻塞回答，继续在后台索引"""
+        self.documents.wait(document_job_id, self.stage_timeouts["file"])
+        job = self.documents.get(document_job_id, user_id)
+        if job is None:
+            return ""
+        if job.status == DocumentJob.DONE:
+            return f"【已上传文件】{job.filename}，共{job.total_chunks}段，相关内容见上文检索结果"
+        if job.status == DocumentJob.FAILED:
+            return f"【文件处理错误】{job.filename}：{job.error}"
+        progress = f"（已完成 {job.processed_chunks}/{job.total_chunks} 段）" if job.total_chunks else ""
+        return f"【已上传文件】{job.filename} 正在后台建立索引{progress}，已索引的部分见上文检索结果"
+
+    def _submit(self, timings: Dict[str, float], stage: str, fn, *args, executor=None) -> Future:
+        """把一个预处理阶段提交到线程池，记录其耗时，并在应用上下文中执行（检索阶段需要查询数据库）"""
+        app = current_app._get_current_object() if has_app_context() else self.app
 
-            elif file_path.suffix.lower() in ('.doc', '.docx'):
-                doc = Document(file_path)
-                text_content = "\n".join([para.text for para in doc.paragraphs])
+        def run():
+            start = time.perf_counter()
+            try:
+                if app is None:
+                    return fn(*args)
+                with app.app_context():
+                    return fn(*args)
+            finally:
+                elapsed = time.perf_counter() - start
+                timings[stage] = round(elapsed * 1000, 1)
+                metrics.observe(self._stage_metric(stage), elapsed)
 
-            else:
-                text_content = f"【不支持的文件类型】{file_path.name}"
+        return (executor or self.executor).submit(run)
 
-            if text_content.strip():
-                self._manage_context(f"文件内容：{text_content[:2000]}...")
+    @staticmethod
+    def _stage_metric(stage: str) -> str:
+        return "pipeline_" + stage.replace("+", "_")
 
+    @staticmethod
+    def _wait(future: Future, deadline: float, default, stage: str, dropped: List[str]):
+        """在截止时间前等待阶段结果，超时或失败则丢弃该阶段"""
+        try:
+            return future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except FutureTimeoutError:
+            dropped.append(stage)
+        except Exception as e:
+            print(f"[DEBUG] 阶段 {stage} 失败: {e}")
+            dropped.append(stage)
+        return default
+
+    @staticmethod
+    async def _await(future, deadline: float, default, stage: str, dropped: List[str]):
+        """_wait 的异步版本；超时的阶段在后台继续执行完（如把搜索结果写入缓存）"""
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            dropped.append(stage)
         except Exception as e:
-            self._manage_context(f"【文件处理错误】{str(e)}")
+            print(f"[DEBUG] 阶段 {stage} 失败: {e}")
+            dropped.append(stage)
+        return default
+
+    def _retrieval_timeout(self, document_job_id: int = None) -> float:
+        timeout = self.stage_timeouts["retrieval"]
+        if document_job_id:
+            timeout += self.stage_timeouts["file"]
+        return timeout
+
+    def _retrieve(self, user_id: int, conversation_id: int, prompt: str,
+                  document_job_id: int = None) -> Tuple[List[Tuple[str, bool]], List[Tuple[str, float]], str, str]:
+        """读取会话摘要和最近的对话，写入用户输入并检索相关历史和文档分块；有上传文件时先短暂等待其索引再检索"""
+        summary, unsummarized = self._load_summary(user_id, conversation_id)
+        # 有摘要时放入摘要之后的全部消息（摘要在后台追赶，最多 max_context_items + every 条），使两者衔接
+        limit = self.max_context_items
+        if summary:
+            limit = max(1, min(unsummarized, self.max_context_items + self.summaries.every))
+        turns = self._load_recent_turns(user_id, conversation_id, limit + 1)
+        # 本轮的用户消息在生成前已保存，作为问题单独放入提示词
+        if turns and turns[-1] == (prompt, True):
+            turns = turns[:-1]
+        turns = turns[-limit:]
+
+        file_note = self._document_note(document_job_id, user_id) if document_job_id else ""
+        self.memory.add(user_id, conversation_id, [prompt])
+        # 多取几条，去掉与问题本身和最近对话重复的条目
+        exclude = {prompt} | {content for content, _ in turns}
+        relevant = [
+            (text, score) for text, score in
+            self._get_relevant_context(user_id, conversation_id, prompt, k=self.retrieval_k + len(exclude))
+            if text not in exclude
+        ][:self.retrieval_k]
+        return turns, relevant, file_note, summary
 
-    def generate_response(self, prompt: str, user_id: int, conversation_id: int, file_path: Path = None) -> str:
+    def _build_prompt(self, prompt: str, user_id: int, conversation_id: int,
+                      document_job_id: int = None) -> str:
+        """组装发送给模型的完整提示词
+
+        网络搜索与文件索引+向量检索彼此独立，在线程池中并行执行；
+        每个阶段有各自的截止时间，超时的阶段（如较慢的搜索）直接丢弃，不阻塞回答。
+        最近对话、检索结果和搜索结果在token预算内按相关度取舍，并打印各部分占用的token数。
+        """
+        print(f"[DEBUG] 用户输入: {prompt}")
+        timings: Dict[str, float] = {}
+        dropped: List[str] = []
+        start = time.monotonic()
+
+        search_future = self._submit(timings, "search", self._search, prompt)
+        retrieval_stage = "file+retrieval" if document_job_id else "retrieval"
+        retrieval_future = self._submit(timings, retrieval_stage, self._retrieve,
+                                        user_id, conversation_id, prompt, document_job_id)
+
+        turns, relevant_context, file_note, summary = self._wait(
+            retrieval_future, start + self._retrieval_timeout(document_job_id), ([], [], "", ""), retrieval_stage,
+            dropped)
+        search_results = self._wait(search_future, start + self.stage_timeouts["search"], [],
+                                    "search", dropped)
+        return self._assemble_prompt(prompt, user_id, conversation_id, turns, relevant_context, file_note, summary,
+                                     search_results, timings, dropped, start)
+
+    async def _abuild_prompt(self, prompt: str, user_id: int, conversation_id: int,
+                             document_job_id: int = None) -> str:
+        """_build_prompt 的异步版本（ASGI模式使用），各阶段及截止时间相同"""
         print(f"[DEBUG] 用户输入: {prompt}")
-        if file_path:
-            self.process_file(file_path)
+        timings: Dict[str, float] = {}
+        dropped: List[str] = []
+        start = time.monotonic()
+
+        search_task = asyncio.ensure_future(self._asearch(prompt, timings))
+        retrieval_stage = "file+retrieval" if document_job_id else "retrieval"
+        retrieval_future = asyncio.wrap_future(self._submit(timings, retrieval_stage, self._retrieve,
+                                                            user_id, conversation_id, prompt, document_job_id))
 
-        self._manage_context(prompt)
+        turns, relevant_context, file_note, summary = await self._await(
+            retrieval_future, start + self._retrieval_timeout(document_job_id), ([], [], "", ""), retrieval_stage,
+            dropped)
+        search_results = await self._await(search_task, start + self.stage_timeouts["search"], [],
+                                           "search", dropped)
+        # 计算token数可能需要分词器，同样放到线程池中
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, self._assemble_prompt, prompt, user_id, conversation_id, turns, relevant_context,
+            file_note, summary, search_results, timings, dropped, start)
 
-        search_context = self.searxng.get_search_context(prompt)
-        if search_context:
-            self._manage_context(search_context)
+    def _assemble_prompt(self, prompt: str, user_id: int, conversation_id: int, turns: List[Tuple[str, bool]],
+                         relevant_context: List[Tuple[str, float]], file_note: str, summary: str,
+                         search_results: List[Tuple[str, float]], timings: Dict[str, float],
+                         dropped: List[str], start: float) -> str:
+        """在token预算内组装各阶段的结果"""
+        # 本轮的搜索结果写入记忆供后续对话检索，不占用当前请求的时间
+        snippets = [text for text, _ in search_results]
+        if snippets:
+            self._submit(timings, "memory_update", self.memory.add, user_id, conversation_id, snippets,
+                         executor=self.background)
 
-        relevant_context = self._get_relevant_context(prompt)
-        context_block = "\n".join(relevant_context + [search_context if search_context else ""])
+        elapsed = time.monotonic() - start
+        timings["total"] = round(elapsed * 1000, 1)
+        # 线程池中各阶段的耗时已计入直方图，这里补记到当前请求的 Server-Timing
+        for stage, ms in list(timings.items()):
+            if stage != "total":
+                metrics.add_timing(self._stage_metric(stage), ms / 1000)
+        metrics.observe("prompt_build", elapsed)
+        print(f"[DEBUG] 阶段耗时(ms): {timings}" + (f"，已丢弃: {dropped}" if dropped else ""))
 
+        full_prompt, usage = self.prompt_builder.build(
+            question=prompt,
+            history=[self.prompt_builder.format_turn(content, is_user) for content, is_user in turns],
+            retrieved=[(text, score) for text, score in relevant_context if text not in snippets],
+            search=search_results,
+            notes=[file_note] if file_note else [],
+            summary=summary
+        )
+        print(f"[DEBUG] 提示词token: {usage}")
+        return full_prompt
+
+    def _payload(self, model: str, full_prompt: str, stream: bool) -> dict:
+        return {
+            "model": model,
+            "prompt": full_prompt,
+            "stream": stream,
+            # 显式指定上下文窗口，避免按Ollama默认窗口静默截断提示词
+            "options": {"num_ctx": self.context_window}
+        }
+
+    def _complete(self, prompt: str, max_tokens: int, model: str = None) -> str:
+        """后台任务（摘要、标题）使用的非流式生成，失败时抛出异常"""
+        model = model or self.model
+        payload = self._payload(model, prompt, False)
+        payload["options"]["num_predict"] = max_tokens
+        result = self.pool.post("/api/generate", payload, timeout=120).json()
+        metrics.record_generation(model, result)
+        return result["response"]
+
+    def _cached_answer(self, user_id: int, conversation_id: int, prompt: str, model: str,
+                       document_job_id: int = None) -> Tuple[Optional[str], Optional[str]]:
+        """组装提示词之前按问题查找语义缓存，返回 (写入语义层时使用的问题, 缓存的回答)
+
+        只有没有私有上下文的轮次使用语义层：会话中只有本轮的用户消息，没有摘要，也没有上传过文档；
+        其他轮次返回的问题为 None，只在组装提示词之后按完整提示词查找。
+        """
+        if not self.response_cache.semantic or document_job_id:
+            return None, None
+        thread = ConversationThread.query.with_entities(
+            ConversationThread.message_count, ConversationThread.summary
+        ).filter_by(id=conversation_id, user_id=user_id).first()
+        if thread is None or thread.message_count > 1 or thread.summary:
+            return None, None
+        if DocumentJob.query.with_entities(DocumentJob.id).filter_by(conversation_id=conversation_id).first():
+            return None, None
+        cached = self.response_cache.lookup_question(user_id, model, prompt)
+        if cached is not None:
+            print("[DEBUG] 命中回答缓存（语义）")
+            # 命中时跳过了检索阶段，问题仍写入会话记忆
+            self.memory.add(user_id, conversation_id, [prompt])
+        return prompt, cached
+
+    async def _acached_answer(self, user_id: int, conversation_id: int, prompt: str, model: str,
+                              document_job_id: int = None) -> Tuple[Optional[str], Optional[str]]:
+        if not self.response_cache.semantic or document_job_id:
+            return None, None
+        return await asyncio.wrap_future(self._submit({}, "response_cache", self._cached_answer, user_id,
+                                                      conversation_id, prompt, model, document_job_id))
+
+    def _cached_payload(self, user_id: int, payload: dict) -> Optional[str]:
+        """按完整的模型请求查找 exact 缓存，每一轮都可以使用"""
+        cached = self.response_cache.lookup(user_id, payload)
+        if cached is not None:
+            print("[DEBUG] 命中回答缓存")
+        return cached
+
+    def generate_response(self, prompt: str, user_id: int, conversation_id: int,
+                          document_job_id: int = None, model: str = None) -> str:
+        if not self.pool.available:
+            return "错误：无法连接Ollama服务，请检查是否已启动"
+
+        model = model or self.model
+        question, cached = self._cached_answer(user_id, conversation_id, prompt, model, document_job_id)
+        if cached is not None:
+            return cached
+        full_prompt = self._build_prompt(prompt, user_id, conversation_id, document_job_id)
+        payload = self._payload(model, full_prompt, False)
+        cached = self._cached_payload(user_id, payload)
+        if cached is not None:
+            return cached
+
+        try:
+            with metrics.timer("ollama_request"):
+                response = self.pool.post("/api/generate", payload, timeout=30)
+            result = response.json()
+            metrics.record_generation(model, result)
+            answer = result["response"]
+            self.response_cache.store(user_id, payload, answer, question)
+            return answer
+        except Exception as e:
+            return f"错误：{str(e)}"
+
+    def stream_response(self, prompt: str, user_id: int, conversation_id: int,
+                        document_job_id: int = None, model: str = None) -> Iterator[str]:
+        """以流式方式逐段返回模型输出，Ollama每产生一段token就立即转发"""
+        if not self.pool.available:
+            yield "错误：无法连接Ollama服务，请检查是否已启动"
+            return
+
+        model = model or self.model
+        question, cached = self._cached_answer(user_id, conversation_id, prompt, model, document_job_id)
+        if cached is not None:
+            yield cached
+            return
+        full_prompt = self._build_prompt(prompt, user_id, conversation_id, document_job_id)
+        payload = self._payload(model, full_prompt, True)
+        cached = self._cached_payload(user_id, payload)
+        if cached is not None:
+            yield cached
+            return
+
+        parts = []
+        start = time.perf_counter()
         try:
-            if not self.check_connection():
-                return "错误：无法连接Ollama服务，请检查是否已启动"
-
-            response = requests.post(
-                f"{self.base_url}/api/generate",
-                json={
-                    "model": "deepseek-r1:1.5b",
-                    "prompt": f"请基于以下上下文用中文回答：\n【相关上下文】\n{context_block}\n\n【用户问题】{prompt}\n【回答要求】用markdown格式，包含必要的信息来源说明",
-                    "stream": False
-                },
-                timeout=30
-            )
-            response.raise_for_status()
-
-            return response.json()["response"]
+            with self.pool.stream(
+                "/api/generate",
+                payload,
+                # 流式模式下只限制连接时间和相邻两段输出的间隔，不限制总生成时长
+                timeout=(5, self.stream_read_timeout)
+            ) as response:
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if chunk.get("error"):
+                        yield f"错误：{chunk['error']}"
+                        return
+                    if chunk.get("response"):
+                        if not parts:
+                            metrics.observe("ollama_first_token", time.perf_counter() - start)
+                        parts.append(chunk["response"])
+                        yield chunk["response"]
+                    if chunk.get("done"):
+                        metrics.record_generation(model, chunk)
+                        # 只缓存完整生成的回答
+                        self.response_cache.store(user_id, payload, "".join(parts), question)
+                        return
+        except Exception as e:
+            yield f"错误：{str(e)}"
+
+    async def _cache_call(self, fn, *args):
+        """回答缓存的写入（语义模式下需要向量化）放到线程池中执行"""
+        return await asyncio.get_running_loop().run_in_executor(self.background, fn, *args)
+
+    async def agenerate_response(self, prompt: str, user_id: int, conversation_id: int,
+                                 document_job_id: int = None, model: str = None) -> str:
+        """generate_response 的异步版本（ASGI模式使用），等待Ollama时不占用线程"""
+        if not self.pool.available:
+            return "错误：无法连接Ollama服务，请检查是否已启动"
+
+        model = model or self.model
+        question, cached = await self._acached_answer(user_id, conversation_id, prompt, model, document_job_id)
+        if cached is not None:
+            return cached
+        full_prompt = await self._abuild_prompt(prompt, user_id, conversation_id, document_job_id)
+        payload = self._payload(model, full_prompt, False)
+        cached = self._cached_payload(user_id, payload)
+        if cached is not None:
+            return cached
+
+        try:
+            with metrics.timer("ollama_request"):
+                result = await self.async_pool.post("/api/generate", payload, timeout=30)
+            metrics.record_generation(model, result)
+            answer = result["response"]
+            if self.response_cache.enabled:
+                await self._cache_call(self.response_cache.store, user_id, payload, answer, question)
+            return answer
         except Exception as e:
             return f"错误：{str(e)}"
+
+    async def astream_response(self, prompt: str, user_id: int, conversation_id: int,
+                               document_job_id: int = None, model: str = None) -> AsyncIterator[str]:
+        """stream_response 的异步版本；客户端断开时取消本协程即可中止Ollama请求"""
+        if not self.pool.available:
+            yield "错误：无法连接Ollama服务，请检查是否已启动"
+            return
+
+        model = model or self.model
+        question, cached = await self._acached_answer(user_id, conversation_id, prompt, model, document_job_id)
+        if cached is not None:
+            yield cached
+            return
+        full_prompt = await self._abuild_prompt(prompt, user_id, conversation_id, document_job_id)
+        payload = self._payload(model, full_prompt, True)
+        cached = self._cached_payload(user_id, payload)
+        if cached is not None:
+            yield cached
+            return
+
+        parts = []
+        start = time.perf_counter()
+        try:
+            async with self.async_pool.stream("/api/generate", payload,
+                                              timeout=(5, self.stream_read_timeout)) as lines:
+                async for line in lines:
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if chunk.get("error"):
+                        yield f"错误：{chunk['error']}"
+                        return
+                    if chunk.get("response"):
+                        if not parts:
+                            metrics.observe("ollama_first_token", time.perf_counter() - start)
+                        parts.append(chunk["response"])
+                        yield chunk["response"]
+                    if chunk.get("done"):
+                        metrics.record_generation(model, chunk)
+                        if self.response_cache.enabled:
+                            await self._cache_call(self.response_cache.store, user_id, payload, "".join(parts),
+                                                   question)
+                        return
+        except Exception as e:
+            yield f"错误：{str(e)}"
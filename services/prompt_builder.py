@@ -0,0 +1,154 @@
+import math
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+# 中日韩字符（含全角标点），这类字符大致每个字符对应一个token
+_CJK = re.compile('[\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]')
+# 模型回答中的思考过程，不再放入后续轮次的上下文
+_THINK = re.compile(r'<think>.*?</think>', re.S)
+
+
+class TokenCounter:
+    """统计文本的token数
+
+    指定 tokenizer_name（HuggingFace 分词器名称或本地路径）时用对应分词器精确计数，分词器只加载一次；
+    未指定或加载失败时按字符类别估算。计数结果按文本LRU缓存，重复出现的历史消息和文档分块不重复分词。
+    """
+
+    def __init__(self, tokenizer_name: Optional[str] = None, cache_size: int = 4096):
+        self.tokenizer_name = tokenizer_name
+        self.cache_size = cache_size
+        self._tokenizer = None
+        self._cache: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def tokenizer(self):
+        if self._tokenizer is None and self.tokenizer_name:
+            with self._lock:
+                if self._tokenizer is None and self.tokenizer_name:
+                    try:
+                        from transformers import AutoTokenizer  # 延迟导入，避免拖慢应用启动
+
+                        self._tokenizer = AutoTokenizer.from_pretrained(self.tokenizer_name)
+                    except Exception as e:
+                        print(f"[DEBUG] 分词器 {self.tokenizer_name} 加载失败，改为估算token数: {e}")
+                        self.tokenizer_name = None
+        return self._tokenizer
+
+    @staticmethod
+    def estimate(text: str) -> int:
+        """估算token数：中日韩字符按1个token计，其余字符约4个字符1个token"""
+        cjk = len(_CJK.findall(text))
+        other = len(text) - cjk - text.count(' ')
+        return cjk + math.ceil(max(other, 0) / 4)
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        with self._lock:
+            cached = self._cache.get(text)
+            if cached is not None:
+                self._cache.move_to_end(text)
+                return cached
+
+        tokenizer = self.tokenizer
+        if tokenizer is not None:
+            tokens = len(tokenizer.encode(text, add_special_tokens=False))
+        else:
+            tokens = self.estimate(text)
+
+        with self._lock:
+            self._cache[text] = tokens
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return tokens
+
+
+class PromptBuilder:
+    """在token预算内组装提示词
+
+    问题、模板、文件说明和会话摘要必须保留，其余预算先分给最近的对话轮次（最多 history_share），
+    剩余部分由检索到的会话记忆/文档分块和网络搜索结果按相关度从高到低填充，放不下的条目直接丢弃。
+    """
+
+    HEADER = "请基于以下上下文用中文回答：\n"
+    FOOTER = "【用户问题】{question}\n【回答要求】用markdown格式，包含必要的信息来源说明"
+
+    def __init__(self, counter: TokenCounter, budget: int, history_share: float = 0.3):
+        self.counter = counter
+        self.budget = budget
+        self.history_share = history_share
+
+    @staticmethod
+    def format_turn(content: str, is_user: bool) -> str:
+        content = _THINK.sub('', content).strip()
+        return f"{'用户' if is_user else '助手'}：{content}"
+
+    @staticmethod
+    def _section(title: str, lines: List[str]) -> str:
+        if not lines:
+            return ""
+        return f"【{title}】\n" + "".join(line + "\n" for line in lines) + "\n"
+
+    def build(self, question: str, history: List[str], retrieved: List[Tuple[str, float]],
+              search: List[Tuple[str, float]], notes: List[str], summary: str = "") -> Tuple[str, Dict[str, int]]:
+        """返回 (提示词, 各部分token数)
+
+        history 为按时间顺序排列的最近轮次，retrieved / search 为 (文本, 相关度) 列表，
+        notes 为必须保留的说明（如上传文件的处理状态），summary 为最近轮次之前的对话摘要。
+        """
+        count = self.counter.count
+        usage = {
+            "template": count(self.HEADER) + count(self.FOOTER.format(question='')) + 12,  # 12 约为各小节标题
+            "question": count(question),
+            "notes": sum(count(note) + 1 for note in notes),
+            "summary": count(summary) + 1 if summary else 0,
+        }
+        remaining = self.budget - sum(usage.values())
+
+        # 最近的对话轮次：从最新一轮往前取，保持连续，再按时间顺序排列
+        turns: List[str] = []
+        history_budget = int(max(remaining, 0) * self.history_share)
+        used = 0
+        for turn in reversed(history):
+            cost = count(turn) + 1
+            if used + cost > history_budget:
+                break
+            turns.insert(0, turn)
+            used += cost
+        usage["history"] = used
+        remaining -= used
+
+        # 检索结果和搜索结果统一按相关度排序，放不下的条目跳过，继续尝试更短的条目
+        candidates = [(score, "retrieval", text) for text, score in retrieved] + \
+                     [(score, "search", text) for text, score in search]
+        candidates.sort(key=lambda item: item[0], reverse=True)
+        packed: Dict[str, List[str]] = {"retrieval": [], "search": []}
+        usage["retrieval"] = usage["search"] = 0
+        dropped = 0
+        for _, section, text in candidates:
+            cost = count(text) + 1
+            if cost > remaining:
+                dropped += 1
+                continue
+            packed[section].append(text)
+            usage[section] += cost
+            remaining -= cost
+
+        context = packed["retrieval"] + notes
+        prompt = (
+            self.HEADER
+            + self._section("对话摘要", [summary] if summary else [])
+            + self._section("最近对话", turns)
+            + self._section("相关上下文", context)
+            + self._section("网络搜索结果", [f"{i}. {text}" for i, text in enumerate(packed["search"], 1)])
+            + self.FOOTER.format(question=question)
+        )
+        usage["total"] = sum(usage[key] for key in ("template", "question", "notes", "summary", "history", "retrieval",
+                                                   "search"))
+        usage["budget"] = self.budget
+        usage["dropped"] = dropped
+        return prompt, usage
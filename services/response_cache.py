@@ -0,0 +1,149 @@
+import hashlib
+import json
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .ttl_cache import TTLCache
+
+OFF = 'off'
+EXACT = 'exact'
+SEMANTIC = 'semantic'
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _payload_digest(payload: dict) -> str:
+    """按模型、完整提示词和生成参数计算缓存键，流式与非流式请求共用同一个键"""
+    request = {k: v for k, v in payload.items() if k != "stream"}
+    return _digest(json.dumps(request, sort_keys=True, ensure_ascii=False))
+
+
+class ResponseCache:
+    """模型回答缓存，默认关闭
+
+    - exact：按 (范围, 模型 + 组装后的完整提示词 + 生成参数) 命中。提示词已包含本轮用到的历史、摘要、
+      文档和搜索结果，上下文不同则键不同，因此每一轮都可以使用，只能省去生成本身。
+    - semantic：在 exact 基础上，组装提示词之前按问题向量的余弦相似度命中（不低于 similarity），
+      复用会话记忆使用的向量模型。只用于没有私有上下文的轮次（会话的第一条消息，没有上传文档和摘要，
+      由调用方判断），命中时跳过搜索和检索；索引只记录问题向量和对应的 exact 键，回答只保存一份。
+    - scope 为 user 时只在同一用户内复用回答，为 global 时所有用户共享
+    回答保存在一个按条目数和字节数限制的 TTL + LRU 缓存中。
+    """
+
+    def __init__(self, embed_fn: Callable[[List[str]], np.ndarray], mode: str = OFF, scope: str = 'user',
+                 similarity: float = 0.95, ttl: float = 3600, max_entries: int = 2048,
+                 max_bytes: int = 32 * 1024 * 1024, min_question_chars: int = 4):
+        if mode not in (OFF, EXACT, SEMANTIC):
+            raise ValueError(f"未知的缓存模式：{mode}")
+        self.embed_fn = embed_fn
+        self.mode = mode
+        self.scope = scope
+        self.similarity = similarity
+        self.min_question_chars = min_question_chars  # 过短的问题（如“继续”）依赖上下文，不做语义匹配
+        self.answers = TTLCache(max_entries=max_entries, max_bytes=max_bytes, ttl=ttl,
+                                sizeof=lambda answer: len(answer.encode('utf-8')))
+        # 语义层索引：(范围, 模型) -> (exact 缓存键列表, 问题向量矩阵)
+        self._index: Dict[tuple, Tuple[List[tuple], np.ndarray]] = {}
+        self._lock = threading.Lock()
+        self._stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != OFF
+
+    @property
+    def semantic(self) -> bool:
+        return self.mode == SEMANTIC
+
+    def _scope_of(self, user_id: int):
+        return user_id if self.scope == 'user' else None
+
+    def _key(self, user_id: int, payload: dict) -> tuple:
+        return EXACT, self._scope_of(user_id), payload["model"], _payload_digest(payload)
+
+    def _matchable(self, question: str) -> bool:
+        return self.semantic and len(question.strip()) >= self.min_question_chars
+
+    def lookup(self, user_id: int, payload: dict) -> Optional[str]:
+        """按发送给模型的请求（模型、完整提示词、生成参数）查找回答，未命中时返回 None"""
+        if not self.enabled:
+            return None
+        answer = self.answers.get(self._key(user_id, payload))
+        self._count("exact_hits" if answer is not None else "misses")
+        return answer
+
+    def lookup_question(self, user_id: int, model: str, question: str) -> Optional[str]:
+        """组装提示词之前按问题做语义匹配，调用方保证本轮没有私有上下文
+
+        未命中不计入 misses，之后按提示词的查找会再计一次。
+        """
+        if not self._matchable(question):
+            return None
+        answer = self._nearest(self._scope_of(user_id), model, self._embed(question))
+        if answer is not None:
+            self._count("semantic_hits")
+        return answer
+
+    def store(self, user_id: int, payload: dict, answer: str, question: str = None):
+        """保存回答；传入 question（仅限没有私有上下文的轮次）时同时加入语义层索引"""
+        if not self.enabled or not answer:
+            return
+        key = self._key(user_id, payload)
+        self.answers.set(key, answer)
+
+        if question is None or not self._matchable(question):
+            return
+        scope, model = key[1], key[2]
+        vector = self._embed(question)
+        with self._lock:
+            keys, vectors = self._index.get((scope, model), ([], np.empty((0, vector.shape[0]), dtype='float32')))
+            if key in keys:
+                return
+            # 顺便清理已过期或被淘汰的条目，索引大小不超过缓存容量
+            alive = [i for i, k in enumerate(keys) if self.answers.contains(k)]
+            keys = [keys[i] for i in alive] + [key]
+            vectors = np.vstack([vectors[alive], vector[None, :]])
+            self._index[(scope, model)] = (keys, vectors)
+
+    def _embed(self, question: str) -> np.ndarray:
+        vector = np.asarray(self.embed_fn([question])[0], dtype='float32')
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _nearest(self, scope, model: str, vector: np.ndarray) -> Optional[str]:
+        """返回相似度不低于阈值的最相近问题的回答"""
+        with self._lock:
+            entry = self._index.get((scope, model))
+            if entry is None or not entry[0]:
+                return None
+            keys, vectors = entry
+            scores = vectors @ vector
+            for i in np.argsort(-scores):
+                if scores[i] < self.similarity:
+                    return None
+                answer = self.answers.get(keys[i])
+                if answer is not None:
+                    return answer
+        return None
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["semantic_index"] = sum(len(keys) for keys, _ in self._index.values())
+        lookups = stats["exact_hits"] + stats["semantic_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["exact_hits"] + stats["semantic_hits"]) / lookups if lookups else 0.0
+        cache = self.answers.stats()
+        stats["entries"] = cache["entries"]
+        stats["bytes"] = cache["bytes"]
+        stats["evictions"] = cache["evictions"]
+        stats["mode"] = self.mode
+        stats["scope"] = self.scope
+        return stats
@@ -1,31 +1,162 @@
+import json
+import threading
+import time
 import requests
 from typing import List, Dict
+from .http_client import CircuitBreaker, async_timeout, create_async_client, create_session
+from .metrics import metrics
+from .ttl_cache import TTLCache, STALE
 
 class SearXNGService:
-    def __init__(self, base_url: str = "http://localhost:8080"):
+    def __init__(self, base_url: str = "http://localhost:8080",
+                 cache_ttl: float = 600, stale_ttl: float = 3600, negative_ttl: float = 30,
+                 cache_max_entries: int = 1024, cache_max_bytes: int = 8 * 1024 * 1024,
+                 pool_size: int = 10, max_retries: int = 2):
         self.base_url = base_url
         self.timeout = 10  # 请求超时时间
+        self.session = create_session(pool_size=pool_size, max_retries=max_retries)
+        # 搜索服务故障时熔断，期间直接跳过搜索而不是每次等待超时
+        self.breaker = CircuitBreaker(self.check_connection, name='searxng')
+        self.negative_ttl = negative_ttl  # 搜索失败结果的缓存时间，避免故障期间反复请求
+
+        # 搜索结果缓存：过期后在 stale_ttl 内先返回旧结果，同时后台刷新
+        self.cache = TTLCache(
+            max_entries=cache_max_entries,
+            max_bytes=cache_max_bytes,
+            ttl=cache_ttl,
+            stale_ttl=stale_ttl,
+            sizeof=lambda results: len(json.dumps(results, ensure_ascii=False).encode('utf-8'))
+        )
+        self._refreshing = set()
+        self._retry_at = {}  # 后台刷新失败的查询 -> 下次允许刷新的时间
+        self._refresh_lock = threading.Lock()
+        self._pool_size = pool_size
+        self._max_retries = max_retries
+        self._async_client = None  # ASGI模式下首次异步搜索时创建
+
+    @staticmethod
+    def _cache_key(query: str, lang: str) -> tuple:
+        """规范化查询：去掉首尾空白、合并连续空白并忽略大小写"""
+        return " ".join(query.split()).lower(), lang
 
     def search(self, query: str, lang: str = 'zh') -> List[Dict]:
-        """执行网页搜索并返回格式化结果"""
+        """执行网页搜索并返回格式化结果，搜索失败时返回空列表"""
+        key = self._cache_key(query, lang)
+        state, results = self.cache.lookup(key)
+        if state is None:
+            return self._fetch_and_cache(key, query, lang)
+        if state == STALE:
+            self._refresh_in_background(key, query, lang)
+        return results
+
+    async def asearch(self, query: str, lang: str = 'zh') -> List[Dict]:
+        """search 的异步版本：缓存逻辑相同，未命中时的请求不占用线程"""
+        key = self._cache_key(query, lang)
+        state, results = self.cache.lookup(key)
+        if state is None:
+            try:
+                results = await self._afetch(query, lang)
+            except Exception as e:
+                print(f"[DEBUG] 搜索失败: {e}")
+                self.cache.set(key, [], ttl=self.negative_ttl)
+                return []
+            self.cache.set(key, results)
+            return results
+        if state == STALE:
+            self._refresh_in_background(key, query, lang)
+        return results
+
+    def check_connection(self) -> bool:
+        """检查SearXNG服务是否可用（供熔断器后台探测使用）"""
+        try:
+            response = self.session.get(f"{self.base_url}/", timeout=5)
+            return response.status_code == 200
+        except requests.exceptions.RequestException:
+            return False
+
+    def _fetch(self, query: str, lang: str) -> List[Dict]:
+        if not self.breaker.available:
+            raise ConnectionError("搜索服务已熔断")
+        params = {
+            'q': query,
+            'format': 'json',
+            'language': lang,
+            'safesearch': 1
+        }
+        try:
+            with metrics.timer("searxng"):
+                response = self.session.get(
+                    f"{self.base_url}/search",
+                    params=params,
+                    timeout=self.timeout
+                )
+            response.raise_for_status()
+        except requests.exceptions.RequestException:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+
+        return self._format_results(response.json()['results'])
+
+    async def _afetch(self, query: str, lang: str) -> List[Dict]:
+        import httpx
+
+        if not self.breaker.available:
+            raise ConnectionError("搜索服务已熔断")
+        if self._async_client is None:
+            self._async_client = create_async_client(self._pool_size, self._max_retries)
         try:
-            params = {
-                'q': query,
-                'format': 'json',
-                'language': lang,
-                'safesearch': 1
-            }
-            response = requests.get(
-                f"{self.base_url}/search",
-                params=params,
-                timeout=self.timeout
-            )
+            with metrics.timer("searxng"):
+                response = await self._async_client.get(
+                    f"{self.base_url}/search",
+                    params={'q': query, 'format': 'json', 'language': lang, 'safesearch': 1},
+                    timeout=async_timeout(self.timeout)
+                )
             response.raise_for_status()
-            
-            return self._format_results(response.json()['results'])
-            
+        except httpx.HTTPError:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+
+        return self._format_results(response.json()['results'])
+
+    def _fetch_and_cache(self, key: tuple, query: str, lang: str) -> List[Dict]:
+        try:
+            results = self._fetch(query, lang)
         except Exception as e:
-            return [{"title": "搜索服务不可用", "content": str(e)}]
+            print(f"[DEBUG] 搜索失败: {e}")
+            # 负缓存：短时间内不再请求，也不把错误信息当作搜索结果交给模型
+            self.cache.set(key, [], ttl=self.negative_ttl)
+            return []
+        self.cache.set(key, results)
+        return results
+
+    def _refresh_in_background(self, key: tuple, query: str, lang: str):
+        now = time.monotonic()
+        with self._refresh_lock:
+            if key in self._refreshing or self._retry_at.get(key, 0) > now:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                try:
+                    results = self._fetch(query, lang)
+                except Exception as e:
+                    print(f"[DEBUG] 后台刷新搜索结果失败: {e}")
+                    # 旧结果保持原有的过期时间，不因刷新失败而续期；negative_ttl 内不再重试
+                    with self._refresh_lock:
+                        self._retry_at = {k: t for k, t in self._retry_at.items() if t > now}
+                        self._retry_at[key] = time.monotonic() + self.negative_ttl
+                    return
+                self.cache.set(key, results)
+                with self._refresh_lock:
+                    self._retry_at.pop(key, None)
+            finally:
+                with self._refresh_lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, name='searxng-refresh', daemon=True).start()
 
     def _format_results(self, results: List[Dict]) -> List[Dict]:
         """格式化搜索结果"""
@@ -38,13 +169,18 @@ class SearXNGService:
             })
         return formatted
 
-    def get_search_context(self, query: str) -> str:
-        """生成搜索上下文提示"""
-        results = self.search(query)
-        if not results:
-            return ""
-            
-        context = "【网络搜索结果】\n"
-        for i, result in enumerate(results, 1):
-            context += f"{i}. {result['title']}: {result['content'][:200]}...\n"
-        return context
\ No newline at end of file
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+    @staticmethod
+    def _snippets(results: List[Dict]) -> List[str]:
+        return [f"{result['title']}: {result['content'][:200]}..." for result in results]
+
+    def get_search_snippets(self, query: str) -> List[str]:
+        """每条搜索结果格式化为一段摘要，供提示词按相关度逐条取舍"""
+        return self._snippets(self.search(query))
+
+    async def aget_search_snippets(self, query: str) -> List[str]:
+        return self._snippets(await self.asearch(query))
@@ -0,0 +1,150 @@
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Set
+
+from models.message import ConversationThread, Message
+from models.user import db
+from .metrics import metrics
+from .prompt_builder import PromptBuilder
+
+# 思考过程（含被 num_predict 截断、没有结束标签的情况）
+_THINK = re.compile(r'<think>.*?(?:</think>|$)', re.S)
+# 标题两端的引号、书名号和markdown标记
+_TITLE_TRIM = '"\'`*#《》“”‘’「」【】 \t'
+
+SUMMARY_PROMPT = (
+    "下面是一段对话的已有摘要和之后新增的对话。请把两者合并成一份新的摘要："
+    "保留用户的目标和偏好、已确认的事实和结论、尚未解决的问题，省略寒暄和重复内容。"
+    "不超过{max_words}字，直接输出摘要。\n\n"
+    "【已有摘要】\n{summary}\n\n【新增对话】\n{turns}\n"
+)
+TITLE_PROMPT = "请为下面的对话拟一个不超过15个字的标题，直接输出标题，不要加引号和解释。\n\n{turns}\n"
+
+
+class ConversationSummarizer:
+    """会话的滚动摘要和自动标题，在后台生成并保存到 conversation_thread 表
+
+    - 最近 keep_recent 条消息原样放入提示词；更早的消息每积累 every 条，就与已有摘要合并成新的摘要，
+      提示词中的历史部分因此不随会话长度增长
+    - 摘要覆盖的消息数记录在 summary_message_count 中，写入时以该值为条件，多个进程不会重复覆盖
+    - 会话仍为默认标题时，在第一轮问答结束后生成标题
+    同一进程内每个会话同时只有一个后台任务；every 为0时不生成摘要。
+    """
+
+    def __init__(self, complete: Callable[[str, int, Optional[str]], str], every: int = 10,
+                 keep_recent: int = 10, model: Optional[str] = None, auto_title: bool = True,
+                 max_words: int = 300, max_turn_chars: int = 400, summary_tokens: int = 1536,
+                 title_tokens: int = 512, workers: int = 1):
+        self.complete = complete  # (提示词, 最多生成的token数, 模型) -> 回答
+        self.every = every
+        self.keep_recent = keep_recent
+        self.model = model  # 为空时使用默认模型
+        self.auto_title = auto_title
+        self.max_words = max_words
+        self.max_turn_chars = max_turn_chars  # 参与摘要的每条消息最多取的字符数
+        # 推理模型会先输出思考过程，生成上限需要留出余量
+        self.summary_tokens = summary_tokens
+        self.title_tokens = title_tokens
+        self.app = None
+        self._workers = workers
+        self._executor = None
+        self._pending: Set[int] = set()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+
+    def schedule(self, conversation_id: int):
+        """一轮对话保存后调用：需要时在后台更新该会话的标题和摘要"""
+        if self.app is None or not (self.every or self.auto_title):
+            return
+        with self._lock:
+            if conversation_id in self._pending:
+                return
+            self._pending.add(conversation_id)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix='summary')
+        self._executor.submit(self._run, conversation_id)
+
+    def _run(self, conversation_id: int):
+        try:
+            with self.app.app_context():
+                thread = db.session.get(ConversationThread, conversation_id)
+                if thread is None:
+                    return
+                # 只读取会话所有者的消息
+                user_id = thread.user_id
+                if self.auto_title and thread.title == ConversationThread.DEFAULT_TITLE:
+                    self._update_title(conversation_id, user_id)
+                if self.every:
+                    self._update_summary(conversation_id, user_id)
+        except Exception as e:
+            print(f"[DEBUG] 会话 {conversation_id} 的摘要/标题生成失败: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(conversation_id)
+
+    def _turns(self, conversation_id: int, user_id: int, offset: int, limit: int) -> str:
+        rows = Message.query.with_entities(Message.content, Message.is_user).filter_by(
+            conversation_id=conversation_id, user_id=user_id
+        ).order_by(Message.timestamp.asc(), Message.id.asc()).offset(offset).limit(limit).all()
+        return "\n".join(PromptBuilder.format_turn(row.content, row.is_user)[:self.max_turn_chars] for row in rows)
+
+    def _generate(self, prompt: str, max_tokens: int) -> str:
+        return _THINK.sub('', self.complete(prompt, max_tokens, self.model)).strip()
+
+    def _update_title(self, conversation_id: int, user_id: int):
+        turns = self._turns(conversation_id, user_id, 0, 2)
+        if turns.count("\n") < 1:
+            return  # 第一轮回答尚未保存
+        # 生成期间不持有数据库连接和读事务
+        db.session.close()
+        with metrics.timer("title"):
+            title = self.clean_title(self._generate(TITLE_PROMPT.format(turns=turns), self.title_tokens))
+        if not title:
+            return
+        ConversationThread.query.filter_by(id=conversation_id, title=ConversationThread.DEFAULT_TITLE).update(
+            {"title": title}, synchronize_session=False)
+        db.session.commit()
+
+    def _update_summary(self, conversation_id: int, user_id: int):
+        """把摘要之后、最近 keep_recent 条之前的消息按每 every 条一批合并进摘要"""
+        while True:
+            thread = ConversationThread.query.with_entities(
+                ConversationThread.summary, ConversationThread.summary_message_count,
+                ConversationThread.message_count
+            ).filter_by(id=conversation_id).first()
+            if thread is None:
+                return
+            covered = thread.summary_message_count
+            if thread.message_count - self.keep_recent - covered < self.every:
+                return
+            turns = self._turns(conversation_id, user_id, covered, self.every)
+            db.session.close()
+
+            with metrics.timer("summary"):
+                summary = self._generate(SUMMARY_PROMPT.format(
+                    max_words=self.max_words, summary=thread.summary or "（无）", turns=turns
+                ), self.summary_tokens)
+            if not summary:
+                return
+            # 以覆盖的消息数为条件写入，其他进程已更新时放弃本次结果
+            updated = ConversationThread.query.filter_by(id=conversation_id, summary_message_count=covered).update({
+                "summary": summary[:self.max_words * 2],
+                "summary_message_count": covered + self.every
+            }, synchronize_session=False)
+            db.session.commit()
+            if not updated:
+                return
+
+    @staticmethod
+    def clean_title(text: str, max_length: int = 30) -> str:
+        """去掉思考过程后取第一行非空文本，去掉“标题：”前缀和两端的引号等符号"""
+        for line in _THINK.sub('', text).splitlines():
+            line = re.sub(r'^(标题|title)\s*[:：]\s*', '', line.strip(), flags=re.I).strip(_TITLE_TRIM)
+            # 标题会嵌入页面的内联脚本，去掉其中的引号
+            line = re.sub(r'["\'`]', '', line)
+            if line:
+                return line[:max_length]
+        return ""
@@ -0,0 +1,105 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+# 缓存查询结果状态
+FRESH = 'fresh'
+STALE = 'stale'
+
+
+class TTLCache:
+    """线程安全的 TTL + LRU 缓存
+
+    - 条目在 ttl 秒内为新鲜，之后 stale_ttl 秒内仍可作为过期数据返回（供后台刷新期间使用）
+    - 同时按条目数和估算字节数限制容量，超出时淘汰最久未使用的条目
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: Optional[int] = None,
+                 ttl: float = 300, stale_ttl: float = 0,
+                 sizeof: Optional[Callable[[Any], int]] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.sizeof = sizeof or (lambda value: 0)
+        # key -> (value, 新鲜截止时间, 过期数据截止时间, 字节数)
+        self._data: "OrderedDict[Hashable, Tuple[Any, float, float, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "stale_hits": 0, "misses": 0, "evictions": 0}
+
+    def lookup(self, key: Hashable) -> Tuple[Optional[str], Any]:
+        """返回 (状态, 值)，状态为 FRESH / STALE，未命中时为 (None, None)"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None, None
+            value, fresh_until, stale_until, _ = entry
+            if now < fresh_until:
+                self._data.move_to_end(key)
+                self._stats["hits"] += 1
+                return FRESH, value
+            if now < stale_until:
+                self._data.move_to_end(key)
+                self._stats["stale_hits"] += 1
+                return STALE, value
+            self._remove(key)
+            self._stats["misses"] += 1
+            return None, None
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """只返回新鲜数据"""
+        state, value = self.lookup(key)
+        return value if state == FRESH else default
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        now = time.monotonic()
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (value, now + ttl, now + ttl + self.stale_ttl, size)
+            self._bytes += size
+            self._evict()
+
+    def contains(self, key: Hashable) -> bool:
+        """是否有新鲜数据（不计入命中统计，也不影响LRU顺序）"""
+        with self._lock:
+            entry = self._data.get(key)
+            return entry is not None and time.monotonic() < entry[1]
+
+    def delete(self, key: Hashable):
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._data)
+            stats["bytes"] = self._bytes
+        lookups = stats["hits"] + stats["stale_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["hits"] + stats["stale_hits"]) / lookups if lookups else 0.0
+        return stats
+
+    def _remove(self, key: Hashable):
+        """调用方需持有锁"""
+        _, _, _, size = self._data.pop(key)
+        self._bytes -= size
+
+    def _evict(self):
+        """调用方需持有锁"""
+        while self._data and (len(self._data) > self.max_entries or
+                              (self.max_bytes is not None and self._bytes > self.max_bytes)):
+            key = next(iter(self._data))
+            self._remove(key)
+            self._stats["evictions"] += 1
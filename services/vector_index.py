@@ -0,0 +1,220 @@
+import math
+import os
+from typing import Optional, Tuple
+
+import numpy as np
+
+FLAT = 'flat'
+HNSW = 'hnsw'
+IVFPQ = 'ivfpq'
+AUTO = 'auto'
+KINDS = (FLAT, HNSW, IVFPQ, AUTO)
+
+IVFPQ_MIN_TRAIN = 256 * 39  # 乘积量化每个子空间训练256个中心，样本过少时不使用IVF-PQ
+ADD_BATCH = 65536  # 分批从（内存映射的）矩阵读入索引，避免一次复制全部向量
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """按行归一化为单位向量（零向量保持不变），归一化后内积即余弦相似度"""
+    vectors = np.ascontiguousarray(vectors, dtype='float32')
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+
+def _largest_divisor(dim: int, limit: int) -> int:
+    return max(m for m in range(1, min(dim, limit) + 1) if dim % m == 0)
+
+
+class VectorIndex:
+    """会话记忆的向量索引，度量为内积（向量需已归一化）
+
+    - flat：直接在（内存映射的）向量矩阵上精确检索，不占用额外内存，适合小规模
+    - hnsw：图索引，检索耗时随规模近似对数增长，需要在内存中保存向量和图
+    - ivfpq：倒排+乘积量化，每个向量只保存 pq_m 字节的编码，适合大规模；候选按原始向量重新打分
+    - auto：按向量数在 hnsw_threshold / ivfpq_threshold 处依次切换
+    索引中的id即向量在矩阵中的行号，只追加、不复用；删除由调用方在检索结果中过滤。
+    """
+
+    def __init__(self, dim: int, kind: str = AUTO, hnsw_threshold: int = 20000, ivfpq_threshold: int = 200000,
+                 hnsw_m: int = 32, ef_construction: int = 80, ef_search: int = 64,
+                 nlist: Optional[int] = None, nprobe: int = 16, pq_m: int = 48, rerank: int = 4):
+        if kind not in KINDS:
+            raise ValueError(f"未知的索引类型：{kind}，可选 {', '.join(KINDS)}")
+        self.dim = dim
+        self.kind = kind
+        self.hnsw_threshold = hnsw_threshold
+        self.ivfpq_threshold = ivfpq_threshold
+        self.hnsw_m = hnsw_m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.nlist = nlist  # 倒排列表数，未指定时按训练时的规模取 4*sqrt(n)
+        self.nprobe = nprobe
+        self.pq_m = _largest_divisor(dim, pq_m)  # 子空间数需整除维度
+        self.rerank = rerank  # IVF-PQ 先取 k*rerank 个候选再精确打分
+        self.index = None
+        self.index_kind = FLAT  # 当前实际使用的索引
+        self._trained_size = 0
+        self._saved_size = 0
+        self._mapped = False  # IVF的倒排列表是否映射自索引文件（只读）
+
+    def choose(self, n: int) -> str:
+        kind = self.kind
+        if kind == AUTO:
+            kind = IVFPQ if n >= self.ivfpq_threshold else HNSW if n >= self.hnsw_threshold else FLAT
+        if kind == IVFPQ and n < IVFPQ_MIN_TRAIN:
+            return FLAT
+        return kind
+
+    def needs_rebuild(self, n: int) -> bool:
+        """规模为 n 时是否需要换用其他索引（或IVF规模已增长到训练时的4倍，需要重新训练）"""
+        kind = self.choose(n)
+        if kind == FLAT:
+            return False
+        return (self.index is None or kind != self.index_kind or self.index.ntotal > n
+                or (kind == IVFPQ and n > 4 * self._trained_size))
+
+    def sync(self, vectors: np.ndarray) -> bool:
+        """使索引覆盖 vectors 的所有行：需要时重建，否则增量追加新行；返回是否重建"""
+        if self.needs_rebuild(len(vectors)):
+            kind = self.choose(len(vectors))
+            self.index = self._build(kind, vectors)
+            self.index_kind = kind
+            self._saved_size = 0
+            return True
+        self.extend(vectors)
+        return False
+
+    def extend(self, vectors: np.ndarray):
+        """把新增的行追加到当前索引，不换用其他索引"""
+        n = len(vectors)
+        if self.choose(n) == FLAT:
+            self.index, self.index_kind = None, FLAT
+        elif self.index is not None and self.index.ntotal < n:
+            self._add(vectors, self.index.ntotal, n)
+
+    def _build(self, kind: str, vectors: np.ndarray):
+        import faiss  # 延迟导入，避免拖慢应用启动
+
+        n = len(vectors)
+        if kind == HNSW:
+            index = faiss.IndexHNSWFlat(self.dim, self.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = self.ef_construction
+        else:
+            nlist = self.nlist or min(65536, max(16, int(4 * math.sqrt(n))))
+            quantizer = faiss.IndexFlatIP(self.dim)
+            index = faiss.IndexIVFPQ(quantizer, self.dim, nlist, self.pq_m, 8, faiss.METRIC_INNER_PRODUCT)
+            sample_size = min(n, max(64 * nlist, IVFPQ_MIN_TRAIN))
+            sample = np.sort(np.random.default_rng(0).choice(n, sample_size, replace=False))
+            index.train(np.ascontiguousarray(vectors[sample]))
+            self._trained_size = n
+        self.index = index
+        self._mapped = False
+        self._configure()
+        self._add(vectors, 0, n)
+        return index
+
+    def _configure(self):
+        if hasattr(self.index, 'hnsw'):
+            self.index.hnsw.efSearch = self.ef_search
+        else:
+            self.index.nprobe = self.nprobe
+
+    def _add(self, vectors: np.ndarray, start: int, end: int):
+        if self._mapped and end > start:
+            self._materialize()
+        for offset in range(start, end, ADD_BATCH):
+            self.index.add(np.ascontiguousarray(vectors[offset:min(end, offset + ADD_BATCH)]))
+
+    def search(self, vectors: np.ndarray, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """检索与 query（单个已归一化向量）最相近的 k 行，返回按相似度降序的 (ids, scores)"""
+        import faiss
+
+        query = np.ascontiguousarray(query, dtype='float32').reshape(1, -1)
+        k = min(k, len(vectors))
+        if k <= 0:
+            return np.empty(0, dtype='int64'), np.empty(0, dtype='float32')
+        if self.index is None:
+            scores, ids = faiss.knn(query, vectors, k, metric=faiss.METRIC_INNER_PRODUCT)
+        elif self.index_kind == HNSW:
+            scores, ids = self.index.search(query, k)
+        else:
+            _, ids = self.index.search(query, min(len(vectors), k * self.rerank))
+            # 按行号顺序读取候选的原始向量，对内存映射文件更友好
+            candidates = np.sort(ids[0][ids[0] >= 0])
+            exact = np.asarray(vectors[candidates]) @ query[0]
+            order = np.argsort(-exact)[:k]
+            return candidates[order], exact[order]
+        valid = ids[0] >= 0
+        return ids[0][valid], scores[0][valid]
+
+    def _materialize(self):
+        """把映射的倒排列表复制到内存中，之后才能追加新行"""
+        import faiss
+
+        mapped = self.index.invlists
+        lists = faiss.ArrayInvertedLists(mapped.nlist, mapped.code_size)
+        for list_no in range(mapped.nlist):
+            size = mapped.list_size(list_no)
+            if size:
+                lists.add_entries(list_no, size, mapped.get_ids(list_no), mapped.get_codes(list_no))
+        self.index.replace_invlists(lists, True)
+        lists.this.disown()  # 由索引负责释放
+        self._mapped = False
+
+    def nbytes(self) -> int:
+        """索引额外占用的内存（不含向量矩阵本身；映射的倒排列表在页缓存中，不计入）"""
+        if self.index is None:
+            return 0
+        n = self.index.ntotal
+        if self.index_kind == HNSW:
+            return n * (self.dim * 4 + self.hnsw_m * 2 * 4 + 8)
+        codes = 0 if self._mapped else n * (self.pq_m + 8)
+        return codes + self.index.nlist * self.dim * 4
+
+    def save(self, path: str) -> bool:
+        """把索引写入文件（先写临时文件再替换），规模比上次保存时增长不足10%则跳过"""
+        if self.index is None or self.index.ntotal < self._saved_size * 1.1:
+            return False
+        import faiss
+
+        tmp = f"{path}.{os.getpid()}.tmp"
+        faiss.write_index(self.index, tmp)
+        os.replace(tmp, path)
+        self._saved_size = self.index.ntotal
+        return True
+
+    def load(self, path: str, vectors: np.ndarray) -> bool:
+        """读取其他进程（或上次运行）保存的索引，类型与当前规模应使用的一致时采用，并补上新增的行
+
+        先以 IO_FLAG_MMAP 读取：IVF-PQ 的倒排列表直接映射索引文件，多个worker进程共享页缓存；
+        映射的倒排列表只读，需要追加新行时再复制到内存。HNSW不支持映射，此标志下照常读入内存。
+        映射失败时退回 IO_FLAG_READ_ONLY 完整读入。
+        """
+        kind = self.choose(len(vectors))
+        if kind == FLAT or not os.path.exists(path):
+            return False
+        import faiss
+
+        mapped = True
+        try:
+            index = faiss.read_index(path, faiss.IO_FLAG_MMAP)
+        except RuntimeError as e:
+            print(f"[DEBUG] 映射向量索引失败，改为读入内存: {e}")
+            mapped = False
+            try:
+                index = faiss.read_index(path, faiss.IO_FLAG_READ_ONLY)
+            except RuntimeError as e:
+                print(f"[DEBUG] 读取向量索引失败，将重建: {e}")
+                return False
+        loaded_kind = HNSW if isinstance(index, faiss.IndexHNSW) else IVFPQ if isinstance(index, faiss.IndexIVF) \
+            else None
+        if loaded_kind != kind or index.ntotal > len(vectors) or index.d != self.dim:
+            return False
+        self.index, self.index_kind = index, kind
+        self._mapped = mapped and kind == IVFPQ
+        self._configure()
+        self._saved_size = index.ntotal
+        if kind == IVFPQ:
+            self._trained_size = index.ntotal
+        self._add(vectors, index.ntotal, len(vectors))
+        return True
@@ -0,0 +1,58 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# 测试使用临时数据库和目录，不读写仓库中的 site.db、uploads 和向量目录（需在导入 app 之前设置）
+_TMP = tempfile.mkdtemp(prefix='llmwebui-test-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_TMP, 'test.db')
+os.environ['VECTOR_STORE_DIR'] = ''
+os.environ['DOCUMENT_CACHE_DIR'] = os.path.join(_TMP, 'document_cache')
+os.environ['EMBEDDER_WARMUP'] = '0'
+os.environ['SUMMARY_EVERY'] = '0'
+os.environ['AUTO_TITLE'] = '0'
+os.chdir(_TMP)
+
+
+@pytest.fixture
+def app_module():
+    import app as app_module
+
+    app_module.app.config['TESTING'] = True
+    app_module.app.config['SESSION_COOKIE_SECURE'] = False
+    with app_module.app.app_context():
+        app_module.db.drop_all()
+        app_module.db.create_all()
+    return app_module
+
+
+@pytest.fixture
+def user_id(app_module):
+    with app_module.app.app_context():
+        user = app_module.User(username='alice', email='alice@example.com')
+        user.set_password('password')
+        app_module.db.session.add(user)
+        app_module.db.session.commit()
+        return user.id
+
+
+@pytest.fixture
+def client(app_module, user_id):
+    client = app_module.app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+    return client
+
+
+@pytest.fixture
+def other_user_id(app_module, user_id):
+    with app_module.app.app_context():
+        user = app_module.User(username='bob', email='bob@example.com')
+        user.set_password('password')
+        app_module.db.session.add(user)
+        app_module.db.session.commit()
+        return user.id
@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+
+from services.admission import AdmissionController, QueueFull
+
+
+def test_round_robin_between_users():
+    controller = AdmissionController(max_active=1, max_per_user=1)
+    a1, a2, a3 = (controller.enter(1) for _ in range(3))
+    b1 = controller.enter(2)
+    assert a1.granted.is_set()
+    assert [t.granted.is_set() for t in (a2, a3, b1)] == [False, False, False]
+
+    order = []
+    for running in (a1, a2, b1):
+        running.release()
+        order.append(next(t for t in (a2, a3, b1) if t.granted.is_set() and t not in order))
+    # 用户2的请求不排在用户1的全部请求之后
+    assert order == [a2, b1, a3]
+
+
+def test_per_user_limit_leaves_room_for_others():
+    controller = AdmissionController(max_active=4, max_per_user=1)
+    first, second = controller.enter(1), controller.enter(1)
+    other = controller.enter(2)
+    assert first.granted.is_set() and not second.granted.is_set()
+    assert other.granted.is_set()
+    assert second.position() == 1
+
+
+def test_queue_full_reports_position():
+    controller = AdmissionController(max_active=1, max_queue=2)
+    controller.enter(1)
+    controller.enter(2)
+    controller.enter(3)
+    with pytest.raises(QueueFull) as info:
+        controller.enter(4)
+    assert info.value.position == 3
+    assert info.value.retry_after >= 1
+    assert controller.stats()["rejected"] == 1
+
+
+def test_queue_full_per_user():
+    controller = AdmissionController(max_active=1, max_queue=10, max_queue_per_user=1)
+    controller.enter(1)
+    controller.enter(1)
+    with pytest.raises(QueueFull):
+        controller.enter(1)
+    controller.enter(2)  # 其他用户不受影响
+
+
+def test_release_is_idempotent():
+    controller = AdmissionController(max_active=1)
+    running, waiting, queued = controller.enter(1), controller.enter(2), controller.enter(3)
+    running.release()
+    running.release()
+    assert waiting.granted.is_set()
+    assert not queued.granted.is_set()
+    assert controller.active == 1
+
+    queued.release()
+    queued.release()
+    assert controller.stats()["cancelled"] == 1
+    assert controller.queued == 0
+    waiting.release()
+    assert controller.active == 0
+
+
+def test_wait_async_does_not_accumulate_callbacks():
+    controller = AdmissionController(max_active=1)
+    running, waiting = controller.enter(1), controller.enter(2)
+
+    async def main():
+        for _ in range(5):
+            assert not await waiting.wait_async(0.01)
+        assert waiting._callbacks == []
+        pending = asyncio.ensure_future(waiting.wait_async(5))
+        await asyncio.sleep(0.01)
+        running.release()
+        return await pending
+
+    assert asyncio.run(main())
+    assert waiting._callbacks == []
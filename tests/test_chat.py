@@ -0,0 +1,34 @@
+import pytest
+
+
+@pytest.fixture
+def conversation_id(app_module, user_id):
+    with app_module.app.app_context():
+        thread = app_module.ConversationThread(title="新对话", user_id=user_id)
+        app_module.db.session.add(thread)
+        app_module.db.session.flush()
+        app_module.db.session.add(app_module.Message(
+            content="你好", is_user=True, user_id=user_id, conversation_id=thread.id, request_id='req-1'))
+        app_module.db.session.commit()
+        return thread.id
+
+
+@pytest.mark.parametrize('path', ['/chat', '/chat/stream'])
+def test_duplicate_request_id_is_rejected(app_module, client, conversation_id, path, monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("重复的请求不应触发生成")
+
+    monkeypatch.setattr(app_module.ollama, 'generate_response', fail)
+    monkeypatch.setattr(app_module.ollama, 'stream_response', fail)
+
+    response = client.post(path, data={
+        'message': '你好',
+        'conversation_id': conversation_id,
+        'request_id': 'req-1'
+    })
+    assert response.status_code == 409
+    assert response.get_json()['conversation_id'] == conversation_id
+    # 被拒绝的请求归还排队名额，也不保存消息
+    assert app_module.admission.stats()['active'] == 0
+    with app_module.app.app_context():
+        assert app_module.Message.query.filter_by(conversation_id=conversation_id).count() == 1
@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+
+@pytest.fixture
+def stream_tokens(app_module, monkeypatch):
+    """用固定的token代替Ollama流式输出，记录生成器是否被关闭"""
+    state = {"tokens": ["你好", "，", "世界"], "closed": False, "calls": []}
+
+    def stream_response(prompt, user_id, conversation_id, document_job_id=None, model=None):
+        state["calls"].append(prompt)
+        try:
+            yield from state["tokens"]
+        finally:
+            state["closed"] = True
+
+    monkeypatch.setattr(app_module.ollama, 'stream_response', stream_response)
+    return state
+
+
+def _events(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_stream_relays_tokens_and_saves_answer(app_module, client, stream_tokens):
+    response = client.post('/chat/stream', data={'message': '你好吗'})
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    assert response.headers['X-Accel-Buffering'] == 'no'
+
+    events = _events(response)
+    assert [e["type"] for e in events] == ["meta", "token", "token", "token", "done"]
+    meta, done = events[0], events[-1]
+    assert meta["user_message"]["content"] == '你好吗'
+    assert [e["content"] for e in events[1:-1]] == stream_tokens["tokens"]
+    assert done["conversation_id"] == meta["conversation_id"]
+    assert done["model_response"]["content"] == "你好，世界"
+    assert stream_tokens["calls"] == ['你好吗']
+
+    with app_module.app.app_context():
+        messages = app_module.Message.query.filter_by(conversation_id=meta["conversation_id"]).order_by(
+            app_module.Message.id).all()
+        assert [(m.is_user, m.content) for m in messages] == [(True, '你好吗'), (False, "你好，世界")]
+    assert app_module.admission.stats()["active"] == 0
+
+
+def test_closing_the_stream_releases_the_ticket(app_module, client, stream_tokens):
+    response = client.post('/chat/stream', data={'message': '你好吗'}, buffered=False)
+    lines = iter(response.response)
+    assert json.loads(next(lines))["type"] == "meta"
+    assert json.loads(next(lines))["type"] == "token"
+    assert app_module.admission.stats()["active"] == 1
+
+    # 客户端断开：响应被关闭，生成器随之关闭并归还名额
+    response.close()
+    assert stream_tokens["closed"]
+    assert app_module.admission.stats()["active"] == 0
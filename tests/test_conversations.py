@@ -0,0 +1,50 @@
+from datetime import datetime, timedelta
+
+
+def _create_threads(app_module, user_id, count):
+    """创建 count 个有消息的会话，其中前两个的最后活跃时间相同"""
+    base = datetime(2024, 1, 1)
+    ids = []
+    with app_module.app.app_context():
+        for i in range(count):
+            thread = app_module.ConversationThread(title=f"会话{i}", user_id=user_id)
+            app_module.db.session.add(thread)
+            app_module.db.session.flush()
+            app_module.db.session.add(app_module.Message(
+                content=f"问题{i}", is_user=True, user_id=user_id, conversation_id=thread.id))
+            app_module.db.session.flush()
+            thread.last_activity = base + timedelta(minutes=max(i, 1))
+            ids.append(thread.id)
+        app_module.db.session.commit()
+    return ids
+
+
+def test_keyset_pagination_covers_every_conversation_once(app_module, client, user_id):
+    ids = _create_threads(app_module, user_id, 7)
+    with app_module.app.app_context():
+        # 没有消息的会话不出现在列表中
+        app_module.db.session.add(app_module.ConversationThread(title="空会话", user_id=user_id))
+        app_module.db.session.commit()
+
+    seen, cursor = [], None
+    while True:
+        response = client.get('/conversations', query_string={'limit': 3, **({'cursor': cursor} if cursor else {})})
+        assert response.status_code == 200
+        data = response.get_json()
+        assert len(data['conversations']) <= 3
+        seen.extend(conv['id'] for conv in data['conversations'])
+        cursor = data['next_cursor']
+        if cursor is None:
+            break
+
+    # 按最后活跃时间倒序，时间相同的按id倒序
+    assert seen == list(reversed(ids[2:])) + [ids[1], ids[0]]
+
+
+def test_invalid_cursor(client):
+    assert client.get('/conversations?cursor=bad').status_code == 400
+
+
+def test_other_users_conversations_are_hidden(app_module, client, other_user_id):
+    _create_threads(app_module, other_user_id, 1)
+    assert client.get('/conversations').get_json()['conversations'] == []
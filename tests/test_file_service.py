@@ -0,0 +1,38 @@
+from services.file_service import chunk_text
+
+
+def _sentences(n):
+    return [f"这是第{i:03d}句话，用来测试分块。" for i in range(n)]
+
+
+def test_chunks_respect_size_and_overlap():
+    sentences = _sentences(60)
+    chunks = list(chunk_text(["".join(sentences)], chunk_size=100, overlap=40))
+
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 100 for chunk in chunks)
+    for previous, current in zip(chunks, chunks[1:]):
+        # 下一块以上一块末尾的完整句子开头，重叠不超过 overlap
+        overlap = next(s for s in sentences if current.startswith(s))
+        assert overlap in previous
+        shared = current[:len(previous)]
+        while not previous.endswith(shared):
+            shared = shared[:-1]
+        assert 0 < len(shared) <= 40
+    # 所有句子按顺序出现
+    joined = "".join(chunks)
+    positions = [joined.find(s) for s in sentences]
+    assert -1 not in positions
+
+
+def test_sentences_split_across_segments():
+    chunks = list(chunk_text(["第一句话。第二句", "话的后半部分。第三句。"], chunk_size=100, overlap=0))
+    assert chunks == ["第一句话。第二句话的后半部分。第三句。"]
+
+
+def test_long_sentence_is_cut_with_overlap():
+    sentence = "".join(chr(0x4e00 + i) for i in range(250))
+    chunks = list(chunk_text([sentence], chunk_size=100, overlap=20))
+    assert all(len(chunk) <= 100 for chunk in chunks)
+    assert chunks[0][-20:] == chunks[1][:20]
+    assert chunks[-1].endswith(sentence[-10:])
@@ -0,0 +1,90 @@
+import os
+import types
+
+import numpy as np
+
+from services import memory_store
+from services.memory_store import ConversationMemory, ConversationMemoryStore
+from services.vector_index import VectorIndex
+
+DIM = 16
+
+
+def _vectors(n, seed=0):
+    return np.random.default_rng(seed).normal(size=(n, DIM)).astype('float32')
+
+
+def test_vectors_persist_across_instances(tmp_path):
+    vectors = _vectors(20)
+    writer = ConversationMemory(DIM, str(tmp_path))
+    writer.add([f"文本{i}" for i in range(20)], vectors)
+
+    # 重启后直接映射已有文件
+    reader = ConversationMemory(DIM, str(tmp_path))
+    assert len(reader) == 20
+    assert isinstance(reader.vectors, np.memmap)
+    assert reader.search_scored(vectors[7], 1)[0][0] == "文本7"
+    assert reader.missing(["文本3", "新文本"]) == ["新文本"]
+
+    # 另一个进程追加的行在下次读取时可见
+    writer.add(["追加"], _vectors(1, seed=1))
+    assert reader.search_scored(_vectors(1, seed=1)[0], 1)[0][0] == "追加"
+
+
+def test_store_reloads_from_disk_without_embedding(tmp_path):
+    calls = []
+
+    def embed(texts):
+        calls.append(list(texts))
+        return _vectors(len(texts), seed=len(calls))
+
+    store = ConversationMemoryStore(embed, lambda user_id, conversation_id: ["历史消息"], dim=DIM,
+                                    storage_dir=str(tmp_path))
+    # 磁盘上还没有数据时从消息表重建，再写入新文本
+    store.add(1, 2, ["你好", "世界"])
+    assert len(calls) == 2
+
+    def loader(user_id, conversation_id):
+        raise AssertionError("磁盘上已有数据时不应从消息表重建")
+
+    restarted = ConversationMemoryStore(embed, loader, dim=DIM, storage_dir=str(tmp_path))
+    assert sorted(restarted.get(1, 2).texts) == ["世界", "你好", "历史消息"]
+    assert len(calls) == 2
+    assert os.path.isdir(tmp_path / "1" / "2")
+
+    restarted.drop(1, 2)
+    assert not os.path.exists(tmp_path / "1" / "2")
+
+
+def test_saved_ivfpq_index_is_memory_mapped(tmp_path):
+    vectors = _vectors(10000)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    path = str(tmp_path / "index.faiss")
+    built = VectorIndex(DIM, kind='ivfpq', nlist=16, pq_m=4)
+    built.sync(vectors[:9990])
+    assert built.save(path)
+
+    loaded = VectorIndex(DIM, kind='ivfpq', nlist=16, pq_m=4)
+    assert loaded.load(path, vectors[:9990])
+    assert loaded._mapped
+    assert loaded.search(vectors[:9990], vectors[5], 1)[0][0] == 5
+
+    # 映射的倒排列表只读，追加新行时复制到内存
+    loaded.extend(vectors)
+    assert not loaded._mapped
+    assert loaded.index.ntotal == 10000
+    assert loaded.search(vectors, vectors[9995], 1)[0][0] == 9995
+
+
+def test_lock_falls_back_to_msvcrt(tmp_path, monkeypatch):
+    calls = []
+    fake = types.SimpleNamespace(LK_LOCK=1, LK_UNLCK=0,
+                                 locking=lambda fd, mode, size: calls.append((mode, size)))
+    monkeypatch.setattr(memory_store, 'fcntl', None)
+    monkeypatch.setattr(memory_store, 'msvcrt', fake, raising=False)
+
+    memory = ConversationMemory(DIM, str(tmp_path))
+    memory.add(["文本"], _vectors(1))
+    assert memory.search_scored(_vectors(1)[0], 1)[0][0] == "文本"
+    assert calls and calls.count((1, 1)) == calls.count((0, 1))
+
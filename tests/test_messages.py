@@ -0,0 +1,85 @@
+import pytest
+
+
+@pytest.fixture
+def conversation(app_module, user_id):
+    """一个有 7 条消息的会话，返回 (会话id, 按时间顺序的消息id)"""
+    with app_module.app.app_context():
+        thread = app_module.ConversationThread(title="新对话", user_id=user_id)
+        app_module.db.session.add(thread)
+        app_module.db.session.flush()
+        messages = [app_module.Message(content=f"消息{i}", is_user=i % 2 == 0, user_id=user_id,
+                                       conversation_id=thread.id) for i in range(7)]
+        app_module.db.session.add_all(messages)
+        app_module.db.session.commit()
+        return thread.id, [m.id for m in messages]
+
+
+def _ids(response):
+    assert response.status_code == 200
+    return [m['id'] for m in response.get_json()['messages']]
+
+
+def test_pages_backwards_with_before(client, conversation):
+    conversation_id, ids = conversation
+    url = f'/conversations/{conversation_id}'
+
+    latest = client.get(url, query_string={'limit': 3})
+    assert _ids(latest) == ids[-3:]
+    assert latest.get_json()['has_more']
+
+    older = client.get(url, query_string={'limit': 3, 'before': ids[-3]})
+    assert _ids(older) == ids[1:4]
+    oldest = client.get(url, query_string={'limit': 3, 'before': ids[1]})
+    assert _ids(oldest) == ids[:1]
+    assert not oldest.get_json()['has_more']
+
+
+def test_incremental_refresh_with_after(client, conversation):
+    conversation_id, ids = conversation
+    newer = client.get(f'/conversations/{conversation_id}', query_string={'after': ids[4]})
+    assert _ids(newer) == ids[5:]
+
+
+def test_cursor_from_another_conversation_is_rejected(app_module, client, conversation, user_id):
+    _, ids = conversation
+    with app_module.app.app_context():
+        other = app_module.ConversationThread(title="新对话", user_id=user_id)
+        app_module.db.session.add(other)
+        app_module.db.session.commit()
+        other_id = other.id
+    response = client.get(f'/conversations/{other_id}', query_string={'before': ids[3]})
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+def test_etag_and_304(app_module, client, conversation, user_id):
+    conversation_id, _ = conversation
+    url = f'/conversations/{conversation_id}'
+
+    response = client.get(url)
+    etag = response.headers['ETag']
+    assert response.headers['Cache-Control'] == 'private, no-cache'
+
+    cached = client.get(url, headers={'If-None-Match': etag})
+    assert cached.status_code == 304
+    assert cached.data == b''
+
+    # 新消息改变ETag
+    with app_module.app.app_context():
+        app_module.db.session.add(app_module.Message(
+            content="回答", is_user=False, user_id=user_id, conversation_id=conversation_id))
+        app_module.db.session.commit()
+    changed = client.get(url, headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+    assert len(changed.get_json()['messages']) == 8
+
+
+def test_other_users_conversation_is_hidden(app_module, client, other_user_id):
+    with app_module.app.app_context():
+        thread = app_module.ConversationThread(title="新对话", user_id=other_user_id)
+        app_module.db.session.add(thread)
+        app_module.db.session.commit()
+        conversation_id = thread.id
+    assert client.get(f'/conversations/{conversation_id}').status_code == 404
@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+import requests
+
+from services.ollama_pool import AsyncOllamaPool, NoBackendAvailable, OllamaPool
+from tools.ollama_stub import start_stub
+
+MODEL = 'deepseek-r1:1.5b'
+
+
+@pytest.fixture
+def stubs():
+    servers = []
+
+    def start(**kwargs):
+        server, url = start_stub(**kwargs)
+        servers.append(server)
+        return server, url
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def _payload():
+    return {"model": MODEL, "prompt": "你好", "stream": False}
+
+
+def test_least_loaded_backend_and_failover_on_connection_error(stubs):
+    server, url = stubs(tokens=2)
+    pool = OllamaPool.from_spec(f"http://127.0.0.1:1,{url}", max_retries=0)
+    dead, alive = pool.backends
+
+    for _ in range(3):
+        assert pool.post("/api/generate", _payload()).json()["response"] == "stub-0 stub-1 "
+    assert server.requests == 3
+    assert alive.failures == 0
+    assert dead.failures >= 1
+    assert pool.available
+
+
+def test_read_timeout_is_not_retried_on_other_backends(stubs):
+    slow = [stubs(tokens=1, first_token_delay=0.5, name=f"slow{i}") for i in range(2)]
+    pool = OllamaPool.from_spec(",".join(url for _, url in slow), max_retries=0)
+
+    for _ in range(3):
+        with pytest.raises(requests.exceptions.ReadTimeout):
+            pool.post("/api/generate", _payload(), timeout=0.2)
+
+    # 每个请求只生成一次，繁忙但健康的实例不熔断
+    assert sum(server.requests for server, _ in slow) == 3
+    assert all(backend.breaker.available for backend in pool.backends)
+    assert pool.available
+    assert sum(backend.failures for backend in pool.backends) == 3
+
+
+def test_async_read_timeout_is_not_retried(stubs):
+    slow = [stubs(tokens=1, first_token_delay=0.5, name=f"slow{i}") for i in range(2)]
+    pool = OllamaPool.from_spec(",".join(url for _, url in slow), max_retries=0)
+    async_pool = AsyncOllamaPool(pool, max_retries=0)
+
+    async def main():
+        import httpx
+
+        try:
+            for _ in range(2):
+                with pytest.raises(httpx.ReadTimeout):
+                    await async_pool.post("/api/generate", _payload(), timeout=0.2)
+        finally:
+            await async_pool.aclose()
+
+    asyncio.run(main())
+    assert sum(server.requests for server, _ in slow) == 2
+    assert pool.available
+
+
+def test_missing_model_routes_to_backend_that_has_it(stubs):
+    small, small_url = stubs(models=[MODEL], name='small')
+    large, large_url = stubs(models=[MODEL, 'qwen2.5:7b'], name='large')
+    pool = OllamaPool.from_spec(f"{small_url},{large_url}", max_retries=0)
+
+    payload = dict(_payload(), model='qwen2.5:7b')
+    for _ in range(2):
+        assert pool.post("/api/generate", payload).json()["response"].startswith("large-")
+    # 第一次请求得知 small 没有该模型，之后不再发给它
+    assert small.requests == 0 and large.requests == 2
+    assert pool.backends[0].breaker.available
+
+    with pytest.raises((NoBackendAvailable, requests.exceptions.HTTPError)):
+        pool.post("/api/generate", dict(_payload(), model='unknown'))
@@ -0,0 +1,134 @@
+import numpy as np
+import pytest
+
+from services.response_cache import ResponseCache
+
+VECTORS = {
+    "什么是向量数据库？": [1.0, 0.0, 0.0],
+    "什么是向量数据库": [0.99, 0.1, 0.0],
+    "今天天气怎么样？": [0.0, 1.0, 0.0],
+}
+
+
+def embed(texts):
+    return np.array([VECTORS.get(t.strip(), [0.0, 0.0, 1.0]) for t in texts], dtype='float32')
+
+
+def payload(prompt, model='m', stream=False, num_ctx=4096):
+    return {"model": model, "prompt": prompt, "stream": stream, "options": {"num_ctx": num_ctx}}
+
+
+def test_exact_layer_keys_on_the_full_request():
+    cache = ResponseCache(embed, mode='exact')
+    cache.store(1, payload("历史A\n问题"), "回答")
+    assert cache.lookup(1, payload("历史A\n问题")) == "回答"
+    assert cache.lookup(1, payload("历史A\n问题", stream=True)) == "回答"  # 流式与非流式共用
+    assert cache.lookup(1, payload("历史B\n问题")) is None  # 上下文不同
+    assert cache.lookup(1, payload("历史A\n问题", num_ctx=8192)) is None  # 生成参数不同
+    assert cache.lookup(1, payload("历史A\n问题", model='other')) is None
+    assert cache.lookup(2, payload("历史A\n问题")) is None  # 默认只在同一用户内复用
+
+
+def test_semantic_layer_only_indexes_context_free_questions():
+    cache = ResponseCache(embed, mode='semantic', scope='user', similarity=0.9)
+    cache.store(1, payload("提示词1"), "回答", question="什么是向量数据库？")
+    assert cache.lookup_question(1, 'm', "什么是向量数据库") == "回答"
+    assert cache.lookup_question(2, 'm', "什么是向量数据库") is None
+    assert cache.lookup_question(1, 'm', "今天天气怎么样？") is None
+
+    # 回答只保存一份，语义索引指向同一条目
+    assert cache.stats()["entries"] == 1
+    assert cache.stats()["semantic_index"] == 1
+
+    # 有上下文的轮次不传问题，只写 exact 层
+    cache.store(1, payload("提示词2"), "另一个回答")
+    assert cache.stats()["semantic_index"] == 1
+    assert cache.lookup(1, payload("提示词2")) == "另一个回答"
+
+
+def test_global_scope_and_off():
+    cache = ResponseCache(embed, mode='semantic', scope='global', similarity=0.9)
+    cache.store(1, payload("提示词"), "回答", question="什么是向量数据库？")
+    assert cache.lookup_question(2, 'm', "什么是向量数据库") == "回答"
+    assert cache.lookup_question(2, 'other', "什么是向量数据库？") is None
+    assert cache.lookup(2, payload("提示词")) == "回答"
+
+    off = ResponseCache(embed)
+    off.store(1, payload("提示词"), "回答", question="什么是向量数据库？")
+    assert off.lookup(1, payload("提示词")) is None
+    assert off.lookup_question(1, 'm', "什么是向量数据库？") is None
+
+
+class FakePool:
+    available = True
+
+    def __init__(self):
+        self.requests = []
+
+    def post(self, path, payload, timeout=None):
+        self.requests.append(payload)
+        pool = self
+
+        class Response:
+            def json(self):
+                return {"response": f"回答{len(pool.requests)}", "done": True}
+        return Response()
+
+
+@pytest.fixture
+def service(app_module, monkeypatch):
+    ollama = app_module.ollama
+    monkeypatch.setattr(ollama, 'response_cache', ResponseCache(embed, mode='semantic', scope='global',
+                                                                similarity=0.9))
+    monkeypatch.setattr(ollama, 'pool', FakePool())
+    monkeypatch.setattr(ollama.memory, 'add', lambda *args: [])
+    return ollama
+
+
+def _thread(app_module, user_id, *contents):
+    with app_module.app.app_context():
+        thread = app_module.ConversationThread(title="新对话", user_id=user_id)
+        app_module.db.session.add(thread)
+        app_module.db.session.flush()
+        for i, content in enumerate(contents):
+            app_module.db.session.add(app_module.Message(
+                content=content, is_user=i % 2 == 0, user_id=user_id, conversation_id=thread.id))
+        app_module.db.session.commit()
+        return thread.id
+
+
+def test_semantic_lookup_only_for_turns_without_private_context(app_module, service, user_id, other_user_id):
+    first = _thread(app_module, user_id, "什么是向量数据库？")
+    with app_module.app.app_context():
+        assert service._cached_answer(user_id, first, "什么是向量数据库？", 'm') == ("什么是向量数据库？", None)
+    service.response_cache.store(user_id, payload("提示词"), "公开的回答", question="什么是向量数据库？")
+
+    # 其他用户的第一轮复用回答
+    fresh = _thread(app_module, other_user_id, "什么是向量数据库")
+    with app_module.app.app_context():
+        assert service._cached_answer(other_user_id, fresh, "什么是向量数据库", 'm') == \
+            ("什么是向量数据库", "公开的回答")
+
+    # 有历史消息或上传文档的会话不使用语义层
+    private = _thread(app_module, other_user_id, "我的项目叫X", "好的", "什么是向量数据库？")
+    with app_module.app.app_context():
+        assert service._cached_answer(other_user_id, private, "什么是向量数据库？", 'm') == (None, None)
+        assert service._cached_answer(other_user_id, fresh, "什么是向量数据库", 'm', document_job_id=1) == \
+            (None, None)
+
+
+def test_exact_layer_reuses_answers_for_identical_prompts_on_any_turn(app_module, service, user_id, monkeypatch):
+    conversation = _thread(app_module, user_id, "我的项目叫X", "好的", "继续")
+    prompts = iter(["历史+继续", "历史+继续", "新的历史+继续"])
+    monkeypatch.setattr(service, '_build_prompt', lambda *args: next(prompts))
+
+    with app_module.app.app_context():
+        first = service.generate_response("继续", user_id, conversation, model='m')
+        again = service.generate_response("继续", user_id, conversation, model='m')
+        changed = service.generate_response("继续", user_id, conversation, model='m')
+
+    assert first == again == "回答1"
+    assert changed == "回答2"
+    assert len(service.pool.requests) == 2
+    # 有上下文的轮次不进入语义索引
+    assert service.response_cache.stats()["semantic_index"] == 0
@@ -0,0 +1,65 @@
+import threading
+
+import pytest
+
+from services import ttl_cache
+from services.searxng_service import SearXNGService
+
+RESULTS = [{"title": "标题", "content": "内容", "url": "https://example.com"}]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def service(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(ttl_cache, 'time', clock)
+    service = SearXNGService(cache_ttl=10, stale_ttl=30, negative_ttl=5)
+    service.clock = clock
+    service.fetches = []
+    service.fail = False
+
+    def fetch(query, lang):
+        service.fetches.append(query)
+        if service.fail:
+            raise ConnectionError("搜索服务不可用")
+        return RESULTS
+
+    monkeypatch.setattr(service, '_fetch', fetch)
+    # 后台刷新同步执行，便于断言
+    monkeypatch.setattr(threading, 'Thread', lambda target, **kwargs: type(
+        'T', (), {'start': staticmethod(target)})())
+    return service
+
+
+def test_cache_key_is_normalized(service):
+    assert service.search("  向量  数据库 ") == RESULTS
+    assert service.search("向量 数据库") == RESULTS
+    assert len(service.fetches) == 1
+
+
+def test_failure_is_negatively_cached(service):
+    service.fail = True
+    assert service.search("q") == []
+    assert service.search("q") == []
+    assert len(service.fetches) == 1
+
+
+def test_failed_refresh_keeps_the_original_stale_expiry(service):
+    service.search("q")
+    service.fail = True
+
+    service.clock.now += 11  # 过期，后台刷新失败，仍返回旧结果
+    assert service.search("q") == RESULTS
+    assert len(service.fetches) == 2
+    assert service.search("q") == RESULTS
+    assert len(service.fetches) == 2  # negative_ttl 内不再重试
+
+    service.clock.now += 30  # 超过最初的 ttl + stale_ttl，不再返回旧结果
+    assert service.search("q") == []
@@ -0,0 +1,95 @@
+import pytest
+
+from services.summary_service import ConversationSummarizer
+
+
+def test_clean_title():
+    assert ConversationSummarizer.clean_title("<think>想一想</think>\n标题：《向量数据库入门》") == "向量数据库入门"
+    assert ConversationSummarizer.clean_title("<think>被截断的思考") == ""
+    assert ConversationSummarizer.clean_title('**"Python的\'引号\'"**') == "Python的引号"
+
+
+class FakeModel:
+    def __init__(self):
+        self.prompts = []
+
+    def __call__(self, prompt, max_tokens, model=None):
+        self.prompts.append(prompt)
+        return "<think>...</think>摘要" + str(len(self.prompts))
+
+
+@pytest.fixture
+def summarizer(app_module):
+    model = FakeModel()
+    service = ConversationSummarizer(model, every=4, keep_recent=2)
+    service.init_app(app_module.app)
+    return service, model
+
+
+def _thread(app_module, user_id, count, title="新对话"):
+    with app_module.app.app_context():
+        thread = app_module.ConversationThread(title=title, user_id=user_id)
+        app_module.db.session.add(thread)
+        app_module.db.session.flush()
+        for i in range(count):
+            app_module.db.session.add(app_module.Message(
+                content=f"消息{i}", is_user=i % 2 == 0, user_id=user_id, conversation_id=thread.id))
+        app_module.db.session.commit()
+        return thread.id
+
+
+def _thread_row(app_module, conversation_id):
+    with app_module.app.app_context():
+        return app_module.db.session.get(app_module.ConversationThread, conversation_id)
+
+
+def test_title_and_summary_batches(app_module, summarizer, user_id):
+    service, model = summarizer
+    conversation_id = _thread(app_module, user_id, 11)
+    service._run(conversation_id)
+
+    # 标题 + 两批摘要（11 条消息保留最近 2 条，每批 4 条）
+    assert len(model.prompts) == 3
+    assert "消息0" in model.prompts[0] and "消息1" in model.prompts[0]
+    assert "消息4" in model.prompts[2] and "消息7" in model.prompts[2] and "消息8" not in model.prompts[2]
+    assert "摘要2" in model.prompts[2]  # 上一批的摘要参与合并
+    thread = _thread_row(app_module, conversation_id)
+    assert thread.title == "摘要1"
+    assert thread.summary == "摘要3"
+    assert thread.summary_message_count == 8
+
+
+def test_only_the_owners_messages_are_summarized(app_module, summarizer, user_id, other_user_id):
+    service, model = summarizer
+    conversation_id = _thread(app_module, user_id, 0)
+    with app_module.app.app_context():
+        app_module.db.session.add(app_module.Message(
+            content="别人的消息", is_user=True, user_id=other_user_id, conversation_id=conversation_id))
+        app_module.db.session.add(app_module.Message(
+            content="自己的问题", is_user=True, user_id=user_id, conversation_id=conversation_id))
+        app_module.db.session.add(app_module.Message(
+            content="回答", is_user=False, user_id=user_id, conversation_id=conversation_id))
+        app_module.db.session.commit()
+
+    service._run(conversation_id)
+    assert len(model.prompts) == 1
+    assert "自己的问题" in model.prompts[0]
+    assert "别人的消息" not in model.prompts[0]
+
+
+@pytest.mark.parametrize('path', ['/chat', '/chat/stream'])
+def test_cannot_post_to_another_users_conversation(app_module, client, other_user_id, path, monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("不应触发生成")
+
+    monkeypatch.setattr(app_module.ollama, 'generate_response', fail)
+    monkeypatch.setattr(app_module.ollama, 'stream_response', fail)
+    conversation_id = _thread(app_module, other_user_id, 2)
+
+    for target in (conversation_id, 999999):
+        response = client.post(path, data={'message': '你好', 'conversation_id': target})
+        assert response.status_code == 404
+        assert response.get_json()['error'] == "对话不存在"
+    assert app_module.admission.stats()['active'] == 0
+    with app_module.app.app_context():
+        assert app_module.Message.query.filter_by(conversation_id=conversation_id).count() == 2
@@ -0,0 +1,78 @@
+import pytest
+
+from services import ttl_cache
+from services.ttl_cache import FRESH, STALE, TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(ttl_cache, 'time', clock)
+    return clock
+
+
+def test_fresh_then_stale_then_expired(clock):
+    cache = TTLCache(ttl=10, stale_ttl=5)
+    cache.set('q', [1])
+    assert cache.lookup('q') == (FRESH, [1])
+
+    clock.now += 11
+    assert cache.lookup('q') == (STALE, [1])
+    assert cache.get('q') is None  # get 只返回新鲜数据
+    assert not cache.contains('q')
+
+    clock.now += 5
+    assert cache.lookup('q') == (None, None)
+    assert cache.stats()["entries"] == 0
+
+
+def test_per_entry_ttl(clock):
+    cache = TTLCache(ttl=100, stale_ttl=0)
+    cache.set('negative', [], ttl=1)
+    clock.now += 2
+    assert cache.lookup('negative') == (None, None)
+
+
+def test_set_resets_expiry(clock):
+    cache = TTLCache(ttl=10, stale_ttl=5)
+    cache.set('q', 'old')
+    clock.now += 12
+    cache.set('q', 'new')
+    assert cache.lookup('q') == (FRESH, 'new')
+
+
+def test_lru_eviction_by_entries_and_bytes(clock):
+    cache = TTLCache(max_entries=2, ttl=10)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+
+    cache = TTLCache(max_bytes=10, ttl=10, sizeof=len)
+    cache.set('a', 'xxxxxx')
+    cache.set('b', 'yyyyyy')
+    assert cache.get('a') is None
+    assert cache.stats()["bytes"] == 6
+    assert cache.stats()["evictions"] == 1
+
+
+def test_stats_count_stale_hits(clock):
+    cache = TTLCache(ttl=1, stale_ttl=10)
+    cache.set('q', 1)
+    cache.lookup('q')
+    clock.now += 2
+    cache.lookup('q')
+    cache.lookup('missing')
+    stats = cache.stats()
+    assert (stats["hits"], stats["stale_hits"], stats["misses"]) == (1, 1, 1)
+    assert stats["hit_rate"] == pytest.approx(2 / 3)
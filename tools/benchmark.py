@@ -0,0 +1,384 @@
+"""吞吐量和延迟压测
+
+在临时目录中用全新的 SQLite 数据库启动 app.py（独立子进程），后端使用本地的 Ollama / SearXNG
+模拟服务（可配置延迟和生成速度）；预先为每个用户写入若干带历史消息的会话，然后由多个并发用户
+登录并按比例请求 /chat、/conversations 和 /conversations/<id>，统计各接口的 p50/p95/p99 延迟、
+每秒请求数以及服务进程的内存占用。
+
+    python -m tools.benchmark --users 16 --duration 60 --history 200 --json result.json
+    python -m tools.benchmark --baseline result.json --max-regression 0.2   # 与上次结果对比，退化时退出码为1
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import requests
+
+from .ollama_stub import start_stub as start_ollama_stub
+from .searxng_stub import start_stub as start_searxng_stub
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = 'bench-password'
+QUESTIONS = [
+    "如何在Python中读取大文件？",
+    "解释一下数据库索引的原理",
+    "帮我总结上面的讨论",
+    "What is the difference between a process and a thread?",
+    "写一个快速排序的例子",
+    "这个方案的缺点是什么？",
+]
+
+
+def seed(app_module, users: int, conversations: int, history: int):
+    """写入压测用户及其会话；消息用批量插入，并直接设置会话的统计字段"""
+    from models.message import ConversationThread, Message
+    from models.user import User, db
+
+    with app_module.app.app_context():
+        db.create_all()
+        now = datetime.utcnow()
+        for u in range(users):
+            user = User(username=f'bench{u}', email=f'bench{u}@example.com')
+            user.set_password(PASSWORD)
+            db.session.add(user)
+            db.session.flush()
+            for c in range(conversations):
+                start = now - timedelta(days=c + 1)
+                thread = ConversationThread(title=f'压测会话{c}', user_id=user.id, created_at=start,
+                                            last_activity=start + timedelta(seconds=history),
+                                            message_count=history)
+                db.session.add(thread)
+                db.session.flush()
+                rows = []
+                for i in range(history):
+                    is_user = i % 2 == 0
+                    content = (f"{QUESTIONS[i % len(QUESTIONS)]} #{i}" if is_user
+                               else f"这是第{i}条回答。" + "示例内容。" * 40)
+                    rows.append({
+                        "content": content,
+                        "content_hash": Message.hash_content(content),
+                        "is_user": is_user,
+                        "timestamp": start + timedelta(seconds=i + 1),
+                        "user_id": user.id,
+                        "conversation_id": thread.id
+                    })
+                if rows:
+                    db.session.execute(Message.__table__.insert(), rows)
+            db.session.commit()
+
+
+def serve(args):
+    """子进程：初始化数据库后用多线程的 WSGI 服务器运行应用"""
+    import logging
+    from werkzeug.serving import make_server
+
+    sys.path.insert(0, PROJECT_ROOT)
+    import app as app_module
+
+    # 压测通过 http 访问，会话cookie不能限制为仅 https
+    app_module.app.config['SESSION_COOKIE_SECURE'] = False
+    seed(app_module, args.users, args.conversations, args.history)
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)  # 不逐条打印访问日志
+    server = make_server('127.0.0.1', args.port, app_module.app, threaded=True)
+    print(f"READY {server.server_port}", flush=True)
+    server.serve_forever()
+
+
+def rss_mb(pid: int) -> Optional[float]:
+    """进程当前的常驻内存（MB）"""
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss / 1024 / 1024
+    except ImportError:
+        pass
+    except Exception:
+        return None
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def wait_ready(base_url: str, timeout: float):
+    """轮询就绪探针直到返回200（向量模型加载完成），超时则放弃本次压测，避免把加载时间计入聊天延迟"""
+    deadline = time.monotonic() + timeout
+    last = None
+    while time.monotonic() < deadline:
+        try:
+            response = requests.get(f"{base_url}/health/ready", timeout=5)
+            if response.status_code == 200:
+                return
+            last = f"HTTP {response.status_code}"
+        except requests.RequestException as e:
+            last = str(e)
+        time.sleep(0.2)
+    raise RuntimeError(f"应用在 {timeout:g} 秒内未就绪（{last}）")
+
+
+def percentile(values: List[float], p: float) -> float:
+    """已排序列表的百分位数（线性插值）"""
+    if not values:
+        return 0.0
+    index = (len(values) - 1) * p / 100
+    low = int(index)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (index - low)
+
+
+class Recorder:
+    """线程安全地记录各接口的延迟和失败数"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.statuses: Dict[str, Dict[int, int]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, seconds: float, status: int):
+        with self._lock:
+            self.latencies.setdefault(name, []).append(seconds)
+            codes = self.statuses.setdefault(name, {})
+            codes[status] = codes.get(status, 0) + 1
+            if status >= 400 or status == 0:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+    def summary(self, elapsed: float) -> Dict[str, dict]:
+        result = {}
+        with self._lock:
+            names = sorted(self.latencies)
+            everything = sorted(v for values in self.latencies.values() for v in values)
+            for name in names + ['total']:
+                values = everything if name == 'total' else sorted(self.latencies[name])
+                errors = sum(self.errors.values()) if name == 'total' else self.errors.get(name, 0)
+                result[name] = {
+                    "count": len(values),
+                    "errors": errors,
+                    "rps": round(len(values) / elapsed, 2) if elapsed else 0.0,
+                    "p50_ms": round(percentile(values, 50) * 1000, 1),
+                    "p95_ms": round(percentile(values, 95) * 1000, 1),
+                    "p99_ms": round(percentile(values, 99) * 1000, 1),
+                    "max_ms": round(values[-1] * 1000, 1) if values else 0.0
+                }
+                if name != 'total':
+                    result[name]["status"] = {str(k): v for k, v in sorted(self.statuses[name].items())}
+        return result
+
+
+def _timed(recorder: Recorder, name: str, method, url: str, **kwargs) -> Optional[requests.Response]:
+    start = time.perf_counter()
+    try:
+        response = method(url, timeout=300, **kwargs)
+    except requests.exceptions.RequestException:
+        recorder.record(name, time.perf_counter() - start, 0)
+        return None
+    recorder.record(name, time.perf_counter() - start, response.status_code)
+    return response
+
+
+def run_user(base_url: str, index: int, deadline: float, mix: Dict[str, float], think_time: float,
+             recorder: Recorder, seed_value: int):
+    """单个用户：登录，获取自己的会话列表，然后按比例随机请求各接口直到截止时间"""
+    rng = random.Random(seed_value + index)
+    http = requests.Session()
+    _timed(recorder, 'login', http.post, f"{base_url}/login",
+           data={"username": f"bench{index}", "password": PASSWORD}, allow_redirects=False)
+    response = _timed(recorder, 'conversations', http.get, f"{base_url}/conversations", allow_redirects=False)
+    if response is None or response.status_code != 200:
+        raise RuntimeError(f"用户 bench{index} 登录失败")
+    conversation_ids = [c["id"] for c in response.json()["conversations"]]
+
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    while time.monotonic() < deadline:
+        name = rng.choices(names, weights)[0]
+        if name == 'chat':
+            data = {"message": f"{rng.choice(QUESTIONS)} ({rng.randrange(10 ** 6)})"}
+            if conversation_ids:
+                data["conversation_id"] = str(rng.choice(conversation_ids))
+            _timed(recorder, 'chat', http.post, f"{base_url}/chat", data=data)
+        elif name == 'conversations':
+            _timed(recorder, 'conversations', http.get, f"{base_url}/conversations")
+        elif name == 'conversation' and conversation_ids:
+            _timed(recorder, 'conversation', http.get,
+                   f"{base_url}/conversations/{rng.choice(conversation_ids)}")
+        if think_time:
+            time.sleep(rng.uniform(0, 2 * think_time))
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    mix = {}
+    for item in spec.split(','):
+        name, _, weight = item.partition('=')
+        if name.strip() not in ('chat', 'conversations', 'conversation'):
+            raise argparse.ArgumentTypeError(f"未知的接口：{name}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def compare(result: dict, baseline: dict, max_regression: float) -> List[str]:
+    """与基线对比：p95 变慢或吞吐下降超过 max_regression（比例）即视为退化"""
+    problems = []
+    for name, current in result["endpoints"].items():
+        base = baseline.get("endpoints", {}).get(name)
+        if not base or not base["count"]:
+            continue
+        if base["p95_ms"] and current["p95_ms"] > base["p95_ms"] * (1 + max_regression):
+            problems.append(f"{name} p95 {base['p95_ms']}ms -> {current['p95_ms']}ms")
+    base_rps = baseline.get("endpoints", {}).get("total", {}).get("rps")
+    current_rps = result["endpoints"]["total"]["rps"]
+    if base_rps and current_rps < base_rps * (1 - max_regression):
+        problems.append(f"吞吐 {base_rps} -> {current_rps} req/s")
+    return problems
+
+
+def print_report(result: dict):
+    print(f"\n并发用户 {result['config']['users']}，持续 {result['elapsed_s']}s")
+    print(f"{'接口':<16}{'请求数':>8}{'失败':>6}{'req/s':>9}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'max(ms)':>10}")
+    for name, s in result["endpoints"].items():
+        print(f"{name:<16}{s['count']:>8}{s['errors']:>6}{s['rps']:>9}{s['p50_ms']:>10}{s['p95_ms']:>10}"
+              f"{s['p99_ms']:>10}{s['max_ms']:>10}")
+    memory = result["memory_mb"]
+    if memory["start"] is not None:
+        print(f"服务进程内存(MB)：启动后 {memory['start']}，峰值 {memory['peak']}，结束时 {memory['end']}")
+
+
+def run(args) -> dict:
+    ollama_server, ollama_url = start_ollama_stub(models=[args.model], tokens=args.tokens,
+                                                  token_delay=args.token_delay,
+                                                  first_token_delay=args.first_token_delay, name='bench')
+    searxng_server, searxng_url = start_searxng_stub(delay=args.search_delay)
+    workdir = tempfile.mkdtemp(prefix='llmwebui-bench-')
+    env = dict(os.environ)
+    env.update({
+        "PYTHONPATH": os.pathsep.join(p for p in (PROJECT_ROOT, env.get("PYTHONPATH")) if p),
+        "DATABASE_URL": 'sqlite:///' + os.path.join(workdir, 'bench.db'),
+        "VECTOR_STORE_DIR": os.path.join(workdir, 'vector_store'),
+        "DOCUMENT_CACHE_DIR": os.path.join(workdir, 'document_cache'),
+        "OLLAMA_BACKENDS": ollama_url,
+        "OLLAMA_MODELS": args.model,
+        "SEARXNG_URL": searxng_url,
+        "CHAT_MAX_ACTIVE": str(args.max_active),
+        "CHAT_MAX_PER_USER": env.get("CHAT_MAX_PER_USER", "2"),
+    })
+    command = [sys.executable, '-m', 'tools.benchmark', '--serve', '--port', '0',
+               '--users', str(args.users), '--conversations', str(args.conversations),
+               '--history', str(args.history)]
+    process = subprocess.Popen(command, cwd=workdir, env=env, stdout=subprocess.PIPE, text=True)
+    try:
+        # 等待子进程完成数据准备并开始监听
+        port = None
+        for line in process.stdout:
+            if line.startswith('READY '):
+                port = int(line.split()[1])
+                break
+        if port is None:
+            raise RuntimeError(f"应用启动失败，退出码 {process.wait()}")
+        base_url = f"http://127.0.0.1:{port}"
+        threading.Thread(target=lambda: [None for _ in process.stdout], daemon=True).start()
+
+        wait_ready(base_url, args.ready_timeout)
+        memory = {"start": rss_mb(process.pid), "peak": None, "end": None}
+        peak = [memory["start"] or 0.0]
+        stop = threading.Event()
+
+        def sample():
+            while not stop.wait(0.5):
+                value = rss_mb(process.pid)
+                if value is not None:
+                    peak[0] = max(peak[0], value)
+
+        threading.Thread(target=sample, daemon=True).start()
+
+        recorder = Recorder()
+        start = time.monotonic()
+        deadline = start + args.duration
+        users = [threading.Thread(target=run_user,
+                                  args=(base_url, i, deadline, args.mix, args.think_time, recorder, args.seed))
+                 for i in range(args.users)]
+        for t in users:
+            t.start()
+        for t in users:
+            t.join()
+        elapsed = time.monotonic() - start
+        stop.set()
+        memory["end"] = rss_mb(process.pid)
+        if memory["start"] is not None:
+            memory["peak"] = max(peak[0], memory["end"] or 0.0)
+            memory = {k: round(v, 1) if v is not None else None for k, v in memory.items()}
+
+        config = {k: v for k, v in vars(args).items() if k not in ('serve', 'json', 'baseline', 'port')}
+        return {
+            "config": config,
+            "elapsed_s": round(elapsed, 2),
+            "endpoints": recorder.summary(elapsed),
+            "memory_mb": memory,
+            "backend_requests": {"ollama": ollama_server.requests, "searxng": searxng_server.requests}
+        }
+    finally:
+        process.terminate()
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        ollama_server.shutdown()
+        searxng_server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='LLMWebUI 吞吐量和延迟压测')
+    parser.add_argument('--users', type=int, default=8, help='并发用户数')
+    parser.add_argument('--duration', type=float, default=30, help='压测时长（秒）')
+    parser.add_argument('--conversations', type=int, default=5, help='每个用户预置的会话数')
+    parser.add_argument('--history', type=int, default=100, help='每个会话预置的消息数')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('chat=1,conversations=2,conversation=2'),
+                        help='各接口的请求比例，如 chat=1,conversations=2,conversation=2')
+    parser.add_argument('--think-time', type=float, default=0.0, help='用户两次请求之间的平均间隔（秒）')
+    parser.add_argument('--max-active', type=int, default=8, help='应用同时生成的请求数上限（CHAT_MAX_ACTIVE）')
+    parser.add_argument('--model', default='deepseek-r1:1.5b')
+    parser.add_argument('--tokens', type=int, default=50, help='模拟回答的token数')
+    parser.add_argument('--token-delay', type=float, default=0.01, help='模拟相邻token的间隔（秒）')
+    parser.add_argument('--first-token-delay', type=float, default=0.1, help='模拟预填充耗时（秒）')
+    parser.add_argument('--search-delay', type=float, default=0.1, help='模拟搜索耗时（秒）')
+    parser.add_argument('--ready-timeout', type=float, default=300, help='等待应用就绪（向量模型加载完成）的最长时间（秒）')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子，相同参数下请求序列可复现')
+    parser.add_argument('--json', help='把结果写入该文件')
+    parser.add_argument('--baseline', help='与该文件中的结果对比')
+    parser.add_argument('--max-regression', type=float, default=0.2, help='允许的退化比例')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        serve(args)
+        return 0
+
+    result = run(args)
+    print_report(result)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            problems = compare(result, json.load(f), args.max_regression)
+        for problem in problems:
+            print(f"[退化] {problem}")
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
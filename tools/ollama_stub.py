@@ -0,0 +1,146 @@
+"""本地Ollama模拟服务，用于测试和压测，不需要GPU和真实模型
+
+    python -m tools.ollama_stub --port 11435 --models deepseek-r1:1.5b,qwen2.5:7b --token-delay 0.02
+
+也可在测试中直接启动：
+    server, url = start_stub(models=['deepseek-r1:1.5b'])
+    ...
+    server.shutdown()
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterable, Tuple
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: dict):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/':
+            data = b'Ollama is running'
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        elif self.path == '/api/tags':
+            self._send_json(200, {"models": [{"name": name} for name in self.server.models]})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        if self.path != '/api/generate':
+            self._send_json(404, {"error": "not found"})
+            return
+
+        model = request.get('model', '')
+        if model not in self.server.models:
+            self._send_json(404, {"error": f"model '{model}' not found"})
+            return
+
+        server = self.server
+        with server.lock:
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+            server.requests += 1
+        try:
+            self._generate(request, model)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def _generate(self, request: dict, model: str):
+        server = self.server
+        start = time.perf_counter()
+        prompt_tokens = len(request.get('prompt', ''))
+        time.sleep(server.first_token_delay)
+        tokens = [f"{server.name}-{i} " for i in range(server.tokens)]
+        final = {
+            "model": model,
+            "done": True,
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": int(server.first_token_delay * 1e9),
+            "eval_count": len(tokens),
+        }
+
+        if not request.get('stream', True):
+            time.sleep(server.token_delay * len(tokens))
+            final["eval_duration"] = int(server.token_delay * len(tokens) * 1e9)
+            final["total_duration"] = int((time.perf_counter() - start) * 1e9)
+            self._send_json(200, dict(final, response=''.join(tokens)))
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        def write(body: dict):
+            data = (json.dumps(body, ensure_ascii=False) + '\n').encode('utf-8')
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        try:
+            for token in tokens:
+                write({"model": model, "response": token, "done": False})
+                time.sleep(server.token_delay)
+            final["eval_duration"] = int(server.token_delay * len(tokens) * 1e9)
+            final["total_duration"] = int((time.perf_counter() - start) * 1e9)
+            write(dict(final, response=''))
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def start_stub(port: int = 0, models: Iterable[str] = ('deepseek-r1:1.5b',), tokens: int = 20,
+               token_delay: float = 0.0, first_token_delay: float = 0.0,
+               name: str = 'stub') -> Tuple[ThreadingHTTPServer, str]:
+    """在后台线程启动模拟服务，返回 (server, 地址)；server 上的 requests / max_active 可用于断言"""
+    server = ThreadingHTTPServer(('127.0.0.1', port), _Handler)
+    server.daemon_threads = True
+    server.models = list(models)
+    server.tokens = tokens
+    server.token_delay = token_delay
+    server.first_token_delay = first_token_delay
+    server.name = name
+    server.lock = threading.Lock()
+    server.active = 0
+    server.max_active = 0
+    server.requests = 0
+    threading.Thread(target=server.serve_forever, name=f'ollama-stub-{name}', daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='本地Ollama模拟服务')
+    parser.add_argument('--port', type=int, default=11435)
+    parser.add_argument('--models', default='deepseek-r1:1.5b', help='逗号分隔的模型名')
+    parser.add_argument('--tokens', type=int, default=20, help='每次回答输出的token数')
+    parser.add_argument('--token-delay', type=float, default=0.02, help='相邻两个token的间隔（秒）')
+    parser.add_argument('--first-token-delay', type=float, default=0.1, help='首个token前的等待（秒），模拟预填充')
+    parser.add_argument('--name', default='stub')
+    args = parser.parse_args()
+
+    server, url = start_stub(args.port, args.models.split(','), args.tokens, args.token_delay,
+                             args.first_token_delay, args.name)
+    print(f"Ollama模拟服务已启动: {url}，模型: {server.models}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,80 @@
+"""本地SearXNG模拟服务，用于测试和压测
+
+    python -m tools.searxng_stub --port 8081 --delay 0.2
+
+也可在测试中直接启动：
+    server, url = start_stub(delay=0.1)
+    ...
+    server.shutdown()
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Tuple
+from urllib.parse import parse_qs, urlparse
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, data: bytes, content_type: str = 'application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/':
+            self._send(200, b'SearXNG stub', 'text/plain')
+            return
+        if url.path != '/search':
+            self._send(404, b'{"error": "not found"}')
+            return
+
+        server = self.server
+        with server.lock:
+            server.requests += 1
+        query = parse_qs(url.query).get('q', [''])[0]
+        time.sleep(server.delay)
+        # 结果只由查询决定，重复查询得到相同内容，便于观察缓存效果
+        results = [{
+            "title": f"{query} - 结果{i}",
+            "content": f"关于“{query}”的第{i}条摘要。" * 3,
+            "url": f"https://example.com/{i}?q={query}"
+        } for i in range(1, server.results + 1)]
+        self._send(200, json.dumps({"query": query, "results": results}, ensure_ascii=False).encode('utf-8'))
+
+
+def start_stub(port: int = 0, delay: float = 0.0, results: int = 5) -> Tuple[ThreadingHTTPServer, str]:
+    """在后台线程启动模拟服务，返回 (server, 地址)"""
+    server = ThreadingHTTPServer(('127.0.0.1', port), _Handler)
+    server.daemon_threads = True
+    server.delay = delay
+    server.results = results
+    server.lock = threading.Lock()
+    server.requests = 0
+    threading.Thread(target=server.serve_forever, name='searxng-stub', daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='本地SearXNG模拟服务')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--delay', type=float, default=0.2, help='每次搜索的响应延迟（秒）')
+    parser.add_argument('--results', type=int, default=5, help='每次返回的结果数')
+    args = parser.parse_args()
+
+    server, url = start_stub(args.port, args.delay, args.results)
+    print(f"SearXNG模拟服务已启动: {url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
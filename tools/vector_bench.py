@@ -0,0 +1,93 @@
+"""向量索引的召回率/延迟对比
+
+对同一批向量分别建立 flat / hnsw / ivfpq 索引（services.vector_index），以精确检索结果为基准，
+统计建索引耗时、索引额外内存、单条查询的 p50/p95 延迟和 recall@k。
+
+    python -m tools.vector_bench --sizes 10000,50000,200000
+    python -m tools.vector_bench --vectors vector_store/1/3/vectors.f32   # 使用真实会话记忆中的向量
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+
+from services.vector_index import FLAT, HNSW, IVFPQ, VectorIndex, normalize
+
+
+def synthetic(n: int, dim: int, clusters: int, seed: int) -> np.ndarray:
+    """按主题聚类分布的单位向量，比均匀随机向量更接近句向量的分布"""
+    rng = np.random.default_rng(seed)
+    centers = normalize(rng.standard_normal((clusters, dim)))
+    labels = rng.integers(0, clusters, n)
+    noise = rng.standard_normal((n, dim)).astype('float32') / np.sqrt(dim)
+    return normalize(centers[labels] + noise)
+
+
+def queries_from(vectors: np.ndarray, count: int, seed: int) -> np.ndarray:
+    """在已有向量附近取查询，模拟与历史内容相关的提问"""
+    rng = np.random.default_rng(seed + 1)
+    picks = vectors[rng.integers(0, len(vectors), count)]
+    return normalize(picks + 0.05 * rng.standard_normal(picks.shape).astype('float32'))
+
+
+def bench(vectors: np.ndarray, queries: np.ndarray, kind: str, k: int, truth: np.ndarray, options: dict) -> dict:
+    index = VectorIndex(vectors.shape[1], kind=kind, **options)
+    start = time.perf_counter()
+    index.sync(vectors)
+    build = time.perf_counter() - start
+
+    latencies = []
+    hits = 0
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        ids, _ = index.search(vectors, query, k)
+        latencies.append(time.perf_counter() - start)
+        hits += len(set(ids.tolist()) & set(expected.tolist()))
+    latencies.sort()
+    return {
+        "index": index.index_kind,
+        "build_s": build,
+        "extra_mb": index.nbytes() / 1024 / 1024,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95)] * 1000,
+        "recall": hits / (len(queries) * k)
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='向量索引召回率/延迟对比')
+    parser.add_argument('--sizes', default='10000,50000,200000', help='逗号分隔的向量数')
+    parser.add_argument('--vectors', help='float32向量文件（如会话记忆的 vectors.f32），指定时忽略 --sizes')
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--clusters', type=int, default=200)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--kinds', default=f'{FLAT},{HNSW},{IVFPQ}')
+    parser.add_argument('--ef-search', type=int, default=64)
+    parser.add_argument('--nprobe', type=int, default=16)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    import faiss
+
+    if args.vectors:
+        count = os.path.getsize(args.vectors) // (args.dim * 4)
+        datasets = [normalize(np.memmap(args.vectors, dtype='float32', mode='r', shape=(count, args.dim)))]
+    else:
+        datasets = [synthetic(int(n), args.dim, args.clusters, args.seed) for n in args.sizes.split(',')]
+    options = {"ef_search": args.ef_search, "nprobe": args.nprobe}
+
+    print(f"{'向量数':>8} {'索引':<6}{'建索引(s)':>10}{'额外内存(MB)':>14}{'p50(ms)':>9}{'p95(ms)':>9}"
+          f"{f'recall@{args.k}':>11}")
+    for vectors in datasets:
+        queries = queries_from(vectors, args.queries, args.seed)
+        _, truth = faiss.knn(queries, vectors, args.k, metric=faiss.METRIC_INNER_PRODUCT)
+        for kind in args.kinds.split(','):
+            r = bench(vectors, queries, kind, args.k, truth, options)
+            print(f"{len(vectors):>8} {r['index']:<6}{r['build_s']:>10.2f}{r['extra_mb']:>14.1f}"
+                  f"{r['p50_ms']:>9.3f}{r['p95_ms']:>9.3f}{r['recall']:>11.3f}")
+
+
+if __name__ == '__main__':
+    main()